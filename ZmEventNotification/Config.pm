@@ -239,6 +239,8 @@ sub loadEsConfigSettings {
   $hooks_config{hook_pass_image_path} = config_get_val($cfg, 'hook', 'hook_pass_image_path');
   $hooks_config{tag_detected_objects} = config_get_val($cfg, 'hook', 'tag_detected_objects',
     DEFAULT_HOOK_TAG_DETECTED_OBJECTS);
+  $hooks_config{hook_output_format} = config_get_val($cfg, 'hook', 'hook_output_format',
+    DEFAULT_HOOK_OUTPUT_FORMAT);
 }
 
 sub saveEsControlSettings {
@@ -246,6 +248,22 @@ sub saveEsControlSettings {
   main::Debug(2, "ESCONTROL_INTERFACE: Saving admin interfaces to $escontrol_config{file}");
   store(\%escontrol_interface_settings, $escontrol_config{file})
     or main::Fatal("Error writing to $escontrol_config{file}: $!");
+  _writeEsControlJson();
+}
+
+# JSON copy of the control state next to the Storable file, so the
+# detection hook (Python) can see force-mutes without parsing Storable
+sub _writeEsControlJson {
+  my $json_file = $escontrol_config{file} . '.json';
+  my $tmp_file  = $json_file . '.tmp';
+  if ( open( my $fh, '>', $tmp_file ) ) {
+    print $fh encode_json( \%escontrol_interface_settings );
+    close($fh);
+    rename( $tmp_file, $json_file )
+      or main::Error("ESCONTROL_INTERFACE: Error renaming $tmp_file: $!");
+  } else {
+    main::Error("ESCONTROL_INTERFACE: Error writing to $json_file: $!");
+  }
 }
 
 sub loadEsControlSettings {
@@ -261,6 +279,7 @@ sub loadEsControlSettings {
     %escontrol_interface_settings = %{ retrieve($escontrol_config{file}) };
     my $json = encode_json(\%escontrol_interface_settings);
     main::Debug(2, "ESCONTROL_INTERFACE: Loaded parameters: $json");
+    _writeEsControlJson();
   }
 }
 
@@ -360,6 +379,7 @@ Notify End only if Start success...... ${\(_yes_or_no($hooks_config{event_end_no
 Use Hook Description.................. ${\(_yes_or_no($hooks_config{use_hook_description}))}
 Store Frame in ZM..................... ${\(_yes_or_no($hooks_config{hook_pass_image_path}))}
 Tag detected objects in ZM............ ${\(_yes_or_no($hooks_config{tag_detected_objects}))}
+Hook output format.................... ${\(_value_or_undef($hooks_config{hook_output_format}))}
 
 Picture URL .......................... ${\(_value_or_undef($notify_config{picture_url}))}
 Include picture....................... ${\(_yes_or_no($notify_config{include_picture}))}
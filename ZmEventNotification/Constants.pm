@@ -82,6 +82,8 @@ use constant {
   DEFAULT_FCM_INCLUDE_PROFILE_IN_PUSH => 'no',
   DEFAULT_MAX_PARALLEL_HOOKS => 0,
   DEFAULT_HOOK_TAG_DETECTED_OBJECTS => 'no',
+  DEFAULT_HOOK_OUTPUT_FORMAT => 'text',
+  HOOK_OUTPUT_VERSION => 1,
 };
 
 # Auto-export all symbols -- this is a constants-only module,
@@ -7,7 +7,7 @@ use POSIX qw(strftime);
 use Time::HiRes qw(gettimeofday);
 use ZmEventNotification::Constants qw(:all);
 use ZmEventNotification::Config qw(:all);
-use ZmEventNotification::Util qw(getConnectionIdentity isInList getInterval parseDetectResults buildPictureUrl appendImagePath getFrameId);
+use ZmEventNotification::Util qw(getConnectionIdentity isInList getInterval parseHookOutput parseHookRecord buildPictureUrl appendImagePath getFrameId);
 use ZmEventNotification::FCM qw(sendOverFCM);
 use ZmEventNotification::MQTT qw(sendOverMQTTBroker);
 use ZmEventNotification::Rules qw(isAllowedInRules);
@@ -224,6 +224,76 @@ sub shouldSendEventToConn {
   return $retVal;
 }
 
+# Runs a hook command and returns its stdout ($? is set as for backticks).
+# ZMES_HOOK_OUTPUT_FORMAT tells zm_event_start.sh which format to ask
+# zm_detect.py for. With $on_line, each line is also handed to it as soon
+# as the hook prints it.
+sub _run_hook {
+  my ( $cmd, $on_line ) = @_;
+  local $ENV{ZMES_HOOK_OUTPUT_FORMAT} = $hooks_config{hook_output_format} // 'text';
+  return `$cmd` if !$on_line;
+
+  my $fh;
+  if ( !open( $fh, '-|', $cmd ) ) {
+    main::Error("Could not run hook $cmd: $!");
+    $? = 1 << 8;
+    return '';
+  }
+  my $res = '';
+  while ( my $line = <$fh> ) {
+    $res .= $line;
+    $on_line->($line);
+  }
+  close($fh);
+  return $res;
+}
+
+# Notifies on a provisional (progressive_results) hook record, before the
+# hook has finished. Returns 1 if it did.
+sub _notify_provisional {
+  my ( $alarm, $line ) = @_;
+  my ( $txt, $jsonstring, $rec ) = parseHookRecord($line);
+  return 0 if !$rec || ( $rec->{type} // '' ) ne 'provisional' || !$txt;
+  main::Debug(1, "hook start: provisional result $txt, sending start notifications now");
+  my %start = %{ $alarm->{Start} };
+  $start{Cause} = $txt . ' ' . $start{Cause} if $hooks_config{use_hook_description};
+  $start{DetectionJson} = decode_json($jsonstring);
+  _send_start_notifications( { %$alarm, Start => \%start }, 0 );
+  return 1;
+}
+
+sub _send_start_notifications {
+  my ( $alarm, $hookResult ) = @_;
+  my $mid   = $alarm->{MonitorId};
+  my $eid   = $alarm->{EventId};
+  my $mname = $alarm->{MonitorName};
+
+  my ( $rulesAllowed, $rulesObject ) = isAllowedInRules($alarm);
+  if ( !$rulesAllowed ) {
+    main::Debug(1, 'rules: Not processing start notifications as rules checks failed');
+    return;
+  }
+  my $temp_alarm_obj = _build_alarm_obj(
+    $mname, $mid, $eid, $alarm->{Start}->{Cause},
+    $alarm->{Start}->{DetectionJson}, $rulesObject
+  );
+
+  _run_api_push($temp_alarm_obj, $eid, $mid, 'event_start', $hookResult);
+  main::Debug(1, 'Matching alarm to connection rules...');
+  my %fcm_token_duplicates = ();
+  foreach (@main::active_connections) {
+    if ($_->{token} && $fcm_token_duplicates{$_->{token}}) {
+      main::Debug(1, '...'.substr($_->{token},-10).' occurs mutiples times. NOT USUAL, ignoring');
+      next;
+    }
+    if ( shouldSendEventToConn( $temp_alarm_obj, $_ ) ) {
+      main::Debug(1, 'token is unique, shouldSendEventToConn returned true, so calling sendEvent');
+      sendEvent( $temp_alarm_obj, $_, 'event_start', $hookResult );
+      $fcm_token_duplicates{$_->{token}}++ if $_->{token};
+    }
+  }
+}
+
 sub _tag_detected_objects {
   my ($eid, $resJsonString, $label) = @_;
   return unless $hooks_config{tag_detected_objects} && $resJsonString;
@@ -335,13 +405,20 @@ sub processNewAlarmsInFork {
           $cmd = appendImagePath($cmd, $eid) if $hooks_config{hook_pass_image_path};
           main::Debug(1, 'Invoking hook on event start:' . $cmd);
           print main::WRITER "update_parallel_hooks--TYPE--add\n";
-          my $res = `$cmd`;
+          # with progressive_results, zm_detect.py prints a provisional record
+          # first: notify on it, and take notes and tags from the final one
+          my $notified = 0;
+          my $on_line = ( $hooks_config{hook_output_format} // '' ) eq 'jsonl'
+            ? sub { $notified ||= _notify_provisional( $alarm, shift ) }
+            : undef;
+          my $res = _run_hook($cmd, $on_line);
           $hookResult = $? >> 8;
+          $alarm->{Start}->{Notified} = $notified;
 
           print main::WRITER "update_parallel_hooks--TYPE--del\n";
 
           chomp($res);
-          my ( $resTxt, $resJsonString ) = parseDetectResults($res);
+          my ( $resTxt, $resJsonString ) = parseHookOutput($res, $hooks_config{hook_output_format});
           $hookResult = 1 if !$resTxt;
           $startHookResult = $hookResult;
 
@@ -399,29 +476,11 @@ sub processNewAlarmsInFork {
       }
     } elsif ( $alarm->{Start}->{State} eq 'ready' ) {
 
-      my ( $rulesAllowed, $rulesObject ) = isAllowedInRules($alarm);
-      if ( !$rulesAllowed ) {
-        main::Debug(1, 'rules: Not processing start notifications as rules checks failed');
+      if ( $alarm->{Start}->{Notified} ) {
+        main::Debug(1, 'Start notifications were already sent on the provisional hook result');
+        main::Debug(1, 'Final hook result found nothing after a provisional match') if $hookResult;
       } else {
-        my $temp_alarm_obj = _build_alarm_obj(
-          $mname, $mid, $eid, $alarm->{Start}->{Cause},
-          $alarm->{Start}->{DetectionJson}, $rulesObject
-        );
-
-        _run_api_push($temp_alarm_obj, $eid, $mid, 'event_start', $hookResult);
-        main::Debug(1, 'Matching alarm to connection rules...');
-        my %fcm_token_duplicates = ();
-        foreach (@main::active_connections) {
-          if ($_->{token} && $fcm_token_duplicates{$_->{token}}) {
-            main::Debug(1, '...'.substr($_->{token},-10).' occurs mutiples times. NOT USUAL, ignoring');
-            next;
-          }
-          if ( shouldSendEventToConn( $temp_alarm_obj, $_ ) ) {
-            main::Debug(1, 'token is unique, shouldSendEventToConn returned true, so calling sendEvent');
-            sendEvent( $temp_alarm_obj, $_, 'event_start', $hookResult );
-            $fcm_token_duplicates{$_->{token}}++ if $_->{token};
-          }
-        }
+        _send_start_notifications( $alarm, $hookResult );
       }
       $alarm->{Start}->{State} = 'done';
     }
@@ -461,13 +520,13 @@ sub processNewAlarmsInFork {
           $cmd = appendImagePath($cmd, $eid) if $hooks_config{hook_pass_image_path};
           main::Debug(1, 'Invoking hook on event end:' . $cmd);
           print main::WRITER "update_parallel_hooks--TYPE--add\n";
-          my $res = `$cmd`;
+          my $res = _run_hook($cmd);
           $hookResult = $? >> 8;
 
           print main::WRITER "update_parallel_hooks--TYPE--del\n";
 
           chomp($res);
-          my ( $resTxt, $resJsonString ) = parseDetectResults($res);
+          my ( $resTxt, $resJsonString ) = parseHookOutput($res, $hooks_config{hook_output_format});
           $hookResult = 1 if (!$resTxt);
 
           $alarm->{End}->{State} = 'ready';
@@ -12,7 +12,7 @@ use ZmEventNotification::Config qw(:all);
 our @EXPORT_OK = qw(
   trim rsplit uniq getInterval isValidMonIntList isInList
   getConnFields getObjectForConn getConnectionIdentity parseDetectResults
-  buildPictureUrl maskPassword appendImagePath getFrameId
+  parseHookOutput parseHookRecord buildPictureUrl maskPassword appendImagePath getFrameId
 );
 
 our %EXPORT_TAGS = ( all => \@EXPORT_OK );
@@ -148,19 +148,24 @@ sub buildPictureUrl {
   return '' if $base_url eq '';
 
   my $pic = $base_url =~ s/EVENTID/$eid/gr;
+  if ($pic =~ /EVENTPATH/) {
+    my $rel = getRelativeEventPath($eid);
+    $pic = $pic =~ s/EVENTPATH/$rel/gr if defined($rel);
+  }
 
+  # objdetect_mp4, objdetect_gif and objdetect_thumb (objdetect_thumb.jpg) all fall back to snapshot
   if ($resCode == 1) {
     main::Debug(2, "$label: called when hook failed, not using objdetect in url");
-    $pic = $pic =~ s/objdetect(_...)?/snapshot/gr;
+    $pic = $pic =~ s/objdetect(_[a-z0-9]+)?/snapshot/gr;
   }
 
   if (!$hooks_config{event_start_hook} || !$hooks_config{enabled}) {
     main::Debug(2, "$label: no start hook or hooks disabled, not using objdetect in url");
-    $pic = $pic =~ s/objdetect(_...)/snapshot/gr;
+    $pic = $pic =~ s/objdetect(_[a-z0-9]+)/snapshot/gr;
   }
 
-  $pic .= '&username=' . $notify_config{picture_portal_username} if $notify_config{picture_portal_username};
-  $pic .= '&password=' . uri_escape($notify_config{picture_portal_password}) if $notify_config{picture_portal_password};
+  $pic .= ($pic =~ /\?/ ? '&' : '?') . 'username=' . $notify_config{picture_portal_username} if $notify_config{picture_portal_username};
+  $pic .= ($pic =~ /\?/ ? '&' : '?') . 'password=' . uri_escape($notify_config{picture_portal_password}) if $notify_config{picture_portal_password};
 
   if ($frame_id eq 'alarm') {
     $pic = $pic =~ s/BESTMATCH/alarm/gr;
@@ -173,6 +178,21 @@ sub buildPictureUrl {
   return $pic;
 }
 
+# Event directory below the storage root (e.g. 1/2024-01-31/1234), for
+# EVENTPATH in picture_url
+sub getRelativeEventPath {
+  my $eid = shift;
+  my $rel = eval {
+    require ZoneMinder::Event;
+    ZoneMinder::Event->new($eid)->Relative_Path();
+  };
+  if (!$rel) {
+    main::Error("Could not resolve EVENTPATH for event $eid: " . ($@ || 'no path'));
+    return undef;
+  }
+  return $rel;
+}
+
 sub maskPassword {
   my $str = shift;
   $str =~ s/pass(word)?=(.*?)($|&|})/pass$1=xxx$3/g;
@@ -197,4 +217,46 @@ sub parseDetectResults {
   return ($txt, $jsonstring);
 }
 
+# One line of zm_detect.py --output-format jsonl: returns the record's
+# text ('' if nothing was detected), the same detection JSON the text format
+# carries, and the record itself; or an empty list if the line is not a
+# record.
+sub parseHookRecord {
+  my $line = shift // '';
+  return () if $line !~ /^\s*\{/;
+  my $rec = eval { decode_json($line) };
+  return () if ref($rec) ne 'HASH' || !defined( $rec->{zmes_hook} );
+  if ( $rec->{zmes_hook} > HOOK_OUTPUT_VERSION ) {
+    main::Debug(1, "hook output schema $rec->{zmes_hook} is newer than " . HOOK_OUTPUT_VERSION . ', reading the fields we know');
+  }
+  my $txt = $rec->{detected} ? ( $rec->{text} // '' ) : '';
+  my $jsonstring = $txt
+    ? encode_json( { map { $_ => $rec->{$_} } qw(labels boxes frame_id confidences image_dimensions) } )
+    : '[]';
+  return ( $txt, $jsonstring, $rec );
+}
+
+# Like parseDetectResults, for hook_output_format=jsonl: finds the final
+# (type result) record zm_detect.py --output-format jsonl printed and returns
+# parseHookRecord's values for it. Output without a record (e.g.
+# zm_event_end.sh, or a hook that doesn't know the format) is parsed as the
+# text format, with an undef record.
+sub parseHookOutput {
+  my $results = shift;
+  my $format  = shift // 'text';
+  $results //= '';
+  if ( $format eq 'jsonl' ) {
+    foreach my $line ( split( /\n/, $results ) ) {
+      my ( $txt, $jsonstring, $rec ) = parseHookRecord($line);
+      next if !$rec || ( $rec->{type} // '' ) ne 'result';
+      main::Debug(2, "parse of hook record:$txt and $jsonstring");
+      return ( $txt, $jsonstring, $rec );
+    }
+    my @text = grep { /detected:/ } split( /\n/, $results );
+    $results = $text[-1] // $results;
+  }
+  my ( $txt, $jsonstring ) = parseDetectResults($results);
+  return ( $txt, $jsonstring, undef );
+}
+
 1;
@@ -13,7 +13,7 @@ AUTHOR = 'Pliable Pixels'
 LICENSE = 'GPL'
 INSTALL_REQUIRES = [
     'numpy', 'requests', 'Shapely', 'imutils',
-    'pyzm>=2.3.6', 'scikit-learn', 'Pillow',
+    'pyzm>=2.5.4', 'scikit-learn', 'Pillow',
     'PyYAML', 'configupdater'
 ]
 
@@ -40,9 +40,29 @@ setup(name=NAME,
       license=LICENSE,
       install_requires=INSTALL_REQUIRES,
       py_modules=[
-          'zmes_hook_helpers.common_params', 
-          'zmes_hook_helpers.log',
+          'zmes_hook_helpers.animation',
           'zmes_hook_helpers.apigw',
+          'zmes_hook_helpers.auth_cache',
+          'zmes_hook_helpers.common_params',
+          'zmes_hook_helpers.detect',
+          'zmes_hook_helpers.es_rules',
+          'zmes_hook_helpers.frame_sources',
+          'zmes_hook_helpers.gates',
+          'zmes_hook_helpers.hook_entry',
+          'zmes_hook_helpers.http_pool',
+          'zmes_hook_helpers.jpeg',
+          'zmes_hook_helpers.log',
           'zmes_hook_helpers.push',
-          'zmes_hook_helpers.utils'
-      ])
+          'zmes_hook_helpers.readiness',
+          'zmes_hook_helpers.server',
+          'zmes_hook_helpers.shm_frames',
+          'zmes_hook_helpers.stages',
+          'zmes_hook_helpers.utils',
+          'zmes_hook_helpers.writeback',
+          'zmes_hook_helpers.zm_cache'
+      ],
+      entry_points={
+          'console_scripts': [
+              'zm_detect_hook = zmes_hook_helpers.hook_entry:main',
+          ],
+      })
@@ -40,9 +40,18 @@ class _StubZMClient:
     def event(self, eid): return _StubEvent()
 
 class _StubStreamConfig:
+    delay = 0
+    max_attempts = 1
+    sleep_between_attempts = 3
+
     @classmethod
     def from_dict(cls, d): return cls()
 
+    def model_copy(self, update=None):
+        copy = type(self)()
+        copy.__dict__.update(self.__dict__, **(update or {}))
+        return copy
+
 class _StubZone:
     def __init__(self, name="", points=None, pattern=None, ignore_pattern=None, _raw=None):
         self.name = name
@@ -67,6 +76,7 @@ _mock_pyzm.ZMClient = _StubZMClient
 
 _mock_log = types.ModuleType("pyzm.log")
 _mock_log.setup_zm_logging = lambda *a, **kw: StubLogger()
+_mock_log.get_log_file = lambda: None
 
 _mock_helpers = types.ModuleType("pyzm.helpers")
 _mock_helpers_utils = types.ModuleType("pyzm.helpers.utils")
@@ -117,6 +127,7 @@ if os.path.abspath(_hook_dir) not in sys.path:
 class StubLogger:
     def Debug(self, level, msg): pass
     def Info(self, msg): pass
+    def Warning(self, msg): pass
     def Error(self, msg): pass
     def Fatal(self, msg): raise SystemExit(msg)
     def close(self): pass
@@ -134,11 +145,42 @@ def reset_common_params():
     # teardown: nothing extra needed
 
 
+@pytest.fixture(autouse=True)
+def config_cache_dir(tmp_path, monkeypatch):
+    """Keep the compiled config cache out of base_data_path during tests."""
+    from zmes_hook_helpers import utils
+    real = utils._config_cache_file
+    cache_dir = tmp_path / "config_cache"
+    monkeypatch.setattr(utils, "_config_cache_file",
+                        lambda args: str(cache_dir / os.path.basename(real(args))))
+    return cache_dir
+
+
 @pytest.fixture
 def fixtures_dir():
     return os.path.join(os.path.dirname(__file__), "fixtures")
 
 
+@pytest.fixture
+def make_config(tmp_path, fixtures_dir):
+    """Factory writing the fixture objectconfig.yml to tmp_path for a zm_detect run.
+
+    Secrets point at the fixtures, base_data_path at tmp_path and the
+    annotated image is not written; keyword arguments override ``general``
+    keys. Returns the path of the file.
+    """
+    def make(**general):
+        with open(os.path.join(fixtures_dir, "test_objectconfig.yml")) as f:
+            data = yaml.safe_load(f)
+        data["general"].update(secrets=os.path.join(fixtures_dir, "test_secrets.yml"),
+                               base_data_path=str(tmp_path), write_image_to_zm="no", write_debug_image="no")
+        data["general"].update(general)
+        path = tmp_path / "objectconfig.yml"
+        path.write_text(yaml.dump(data))
+        return str(path)
+    return make
+
+
 @pytest.fixture
 def test_objectconfig(fixtures_dir):
     path = os.path.join(fixtures_dir, "test_objectconfig.yml")
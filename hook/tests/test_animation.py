@@ -0,0 +1,156 @@
+"""Tests for the create_animation clip."""
+import os
+
+import numpy as np
+import pytest
+
+import zmes_hook_helpers.common_params as g
+from zmes_hook_helpers import animation
+
+cv2 = pytest.importorskip('cv2')
+
+
+def _jpg(value):
+    ok, buf = cv2.imencode('.jpg', np.full((120, 160, 3), value, dtype=np.uint8))
+    return buf.tobytes()
+
+
+class FakeResponse:
+    def __init__(self, content):
+        self.content = content
+
+
+class FakeAPI:
+    portal_url = 'https://zm/zm'
+
+    def __init__(self, frames):
+        self.frames = frames
+        self.urls = []
+
+    def request(self, url, **kw):
+        self.urls.append(url)
+        fid = int(url.rsplit('fid=', 1)[1])
+        if fid not in self.frames:
+            raise ValueError('BAD_IMAGE')
+        return FakeResponse(_jpg(fid))
+
+
+class FakeEvent:
+    frames = 100
+    length = 10.0
+    max_score_frame_id = 40
+
+    def __init__(self, path):
+        self._path = path
+
+    def path(self):
+        return self._path
+
+    def raw(self):
+        return {'Event': {'AlarmFrameId': '12'}}
+
+
+class FakeZM:
+    def __init__(self, path, frames):
+        self.api = FakeAPI(frames)
+        self.ev = FakeEvent(path)
+
+    def event(self, eid):
+        return self.ev
+
+
+MATCHED = {'labels': ['person'], 'boxes': [[10, 10, 60, 80]], 'frame_id': 'snapshot',
+           'image_dimensions': {'original': (120, 160), 'resized': None}}
+
+
+class TestFrames:
+    def test_anchor(self):
+        ev = FakeEvent(None)
+        assert animation.anchor_frame('37', ev) == 37
+        assert animation.anchor_frame('snapshot', ev) == 40
+        assert animation.anchor_frame('alarm', ev) == 12
+        assert animation.anchor_frame('snapshot') == 1
+
+    def test_window_includes_anchor(self):
+        assert animation.frame_ids(40, 10, 2, 2) == [30, 32, 34, 36, 38, 40, 42, 44, 46, 48, 50]
+        assert animation.frame_ids(3, 10, 2, 2) == [1, 3, 5, 7, 9, 11, 13]
+        assert animation.frame_ids(5, 10, 1, 3) == [2, 5, 8]
+
+    def test_fps(self):
+        assert animation.event_fps(FakeEvent(None)) == 10.0
+        assert animation.event_fps(None) == animation._DEFAULT_FPS
+
+    def test_streams_one_frame_at_a_time(self):
+        fetched = []
+
+        def fetch(fid):
+            fetched.append(fid)
+            return np.zeros((2, 2, 3), dtype=np.uint8) if fid < 3 else None
+
+        frames = animation.stream_frames(fetch, [1, 2, 3, 4])
+        assert fetched == []
+        next(frames)
+        assert fetched == [1]
+        assert [fid for fid, _ in frames] == [2]
+        assert fetched == [1, 2, 3]
+
+    def test_missing_frame_is_retried(self, monkeypatch):
+        monkeypatch.setattr(animation, '_RETRY_SLEEP', 0)
+        api = FakeAPI({1})
+        assert animation.fetch_frame(api, 7, 1).shape == (120, 160, 3)
+        assert animation.fetch_frame(api, 7, 2) is None
+        assert len(api.urls) == 1 + animation._FETCH_TRIES
+
+    def test_draw_scales_boxes(self):
+        out = animation.draw(np.zeros((120, 160, 3), dtype=np.uint8), MATCHED, 80)
+        assert out.shape == (60, 80, 3)
+        assert out[5:40, 5:30].any()
+        assert not out[50:, 50:].any()
+
+
+class TestCreate:
+    def test_mp4(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(animation, '_RETRY_SLEEP', 0)
+        # the opencv-python wheels have no avc1 encoder
+        monkeypatch.setattr(animation, '_MP4_CODEC', 'mp4v')
+        g.config.update(animation_types=['mp4'], animation_width=80, animation_stride=2, animation_duration=2)
+        zm = FakeZM(str(tmp_path), set(range(1, 46)))
+        written = animation.create(zm, {'eventid': '7'}, MATCHED)
+        assert written == [str(tmp_path / 'objdetect.mp4')]
+        cap = cv2.VideoCapture(written[0])
+        try:
+            ok, frame = cap.read()
+            assert ok and frame.shape[1] == 80
+            # frames 30..44 every 2, cut short where the event ends
+            assert int(cap.get(cv2.CAP_PROP_FRAME_COUNT)) == 8
+        finally:
+            cap.release()
+        assert [n for n in os.listdir(tmp_path) if n.startswith('.')] == []
+
+    def test_gif(self, tmp_path):
+        pytest.importorskip('PIL')
+        from PIL import Image
+        g.config.update(animation_types=['gif'], animation_width=80, animation_stride=5, animation_duration=2)
+        zm = FakeZM(str(tmp_path), set(range(1, 101)))
+        (path,) = animation.create(zm, {'eventid': '7'}, MATCHED)
+        assert path.endswith('objdetect.gif')
+        assert Image.open(path).n_frames == 5
+
+    def test_mp4_falls_back_to_gif_without_h264(self, tmp_path, monkeypatch):
+        pytest.importorskip('PIL')
+        monkeypatch.setattr(animation, '_encoder_works', lambda fourcc: False)
+        g.config.update(animation_types=['mp4'], animation_width=80, animation_stride=5, animation_duration=2)
+        zm = FakeZM(str(tmp_path), set(range(1, 101)))
+        assert animation.create(zm, {'eventid': '7'}, MATCHED) == [str(tmp_path / 'objdetect.gif')]
+        g.config.update(animation_types=['mp4', 'gif'])
+        assert animation.create(zm, {'eventid': '7'}, MATCHED) == [str(tmp_path / 'objdetect.gif')]
+
+    def test_nothing_without_labels(self, tmp_path):
+        zm = FakeZM(str(tmp_path), set(range(1, 101)))
+        assert animation.create(zm, {'eventid': '7'}, {'labels': []}) == []
+        assert zm.api.urls == []
+
+    def test_unknown_type(self, tmp_path):
+        g.config.update(animation_types=['webm'])
+        zm = FakeZM(str(tmp_path), set(range(1, 101)))
+        assert animation.create(zm, {'eventid': '7'}, MATCHED) == []
@@ -0,0 +1,158 @@
+"""Tests for zmes_hook_helpers.auth_cache (on-disk ZM token cache)."""
+import json
+import os
+import stat
+import sys
+import time
+import types
+from datetime import datetime, timedelta
+
+import pytest
+
+from zmes_hook_helpers import auth_cache
+
+
+class _Auth:
+    """Just the AuthManager surface auth_cache touches."""
+
+    def __init__(self, api_version='2.0'):
+        self.auth_enabled = True
+        self.api_version = api_version
+        self.zm_version = '1.38.0'
+        self._access_token = ''
+        self._refresh_token = ''
+        self._access_token_expires_at = None
+        self._refresh_token_expires_at = None
+        self._initial_token = None
+        self.logins = []
+
+    def _is_token_api(self):
+        return self.api_version >= '2.0'
+
+    def login(self):
+        self.logins.append(self._initial_token)
+        self._access_token = 'fresh-access'
+        self._refresh_token = 'fresh-refresh'
+        self._access_token_expires_at = datetime.now() + timedelta(hours=1)
+        self._refresh_token_expires_at = datetime.now() + timedelta(days=1)
+
+
+def _entry(access_in, refresh_in):
+    now = time.time()
+    return {'api_version': '2.0', 'zm_version': '1.38.0',
+            'access_token': 'cached-access', 'access_expires': now + access_in,
+            'refresh_token': 'cached-refresh', 'refresh_expires': now + refresh_in}
+
+
+class TestSeed:
+    def test_valid_access_token_skips_login(self):
+        auth = _Auth()
+        assert auth_cache.seed(auth, _entry(3600, 86400), _Auth.login) == 'access'
+        assert auth.logins == []
+        assert auth._access_token == 'cached-access'
+        assert auth._refresh_token_expires_at > datetime.now()
+
+    def test_access_inside_grace_uses_refresh(self):
+        auth = _Auth()
+        assert auth_cache.seed(auth, _entry(60, 86400), _Auth.login) == 'refresh'
+        assert auth.logins == ['cached-refresh']
+
+    def test_everything_expired_full_login(self):
+        auth = _Auth()
+        assert auth_cache.seed(auth, _entry(-10, 60), _Auth.login) is None
+        assert auth.logins == [None]
+
+    def test_no_entry(self):
+        auth = _Auth()
+        assert auth_cache.seed(auth, None, _Auth.login) is None
+        assert auth.logins == [None]
+
+    def test_pyzm_without_token_fields(self, tmp_path):
+        auth = _Auth()
+        del auth._refresh_token_expires_at
+        assert auth_cache.seed(auth, _entry(3600, 86400), _Auth.login) == 'unsupported'
+        assert auth.logins == [None]
+        del auth._refresh_token_expires_at
+        assert not auth_cache.save(str(tmp_path / 'tok.json'), auth)
+
+
+class TestSaveLoad:
+    def test_round_trip_and_mode(self, tmp_path):
+        path = auth_cache.cache_path(str(tmp_path), 'https://zm/api/', 'admin')
+        auth = _Auth()
+        auth.login()
+        assert auth_cache.save(path, auth)
+        assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
+        assert stat.S_IMODE(os.stat(os.path.dirname(path)).st_mode) == 0o700
+        entry = auth_cache.load(path)
+        assert entry['access_token'] == 'fresh-access'
+        assert entry['refresh_token'] == 'fresh-refresh'
+
+    def test_keyed_on_portal_and_user(self, tmp_path):
+        a = auth_cache.cache_path(str(tmp_path), 'https://zm/api', 'admin')
+        assert a == auth_cache.cache_path(str(tmp_path), 'https://zm/api/', 'admin')
+        assert a != auth_cache.cache_path(str(tmp_path), 'https://zm/api', 'other')
+        assert a != auth_cache.cache_path(str(tmp_path), 'https://zm2/api', 'admin')
+        assert a.startswith(os.path.join(str(tmp_path), 'misc', 'zm_auth'))
+
+    def test_expired_entry_not_loaded(self, tmp_path):
+        path = str(tmp_path / 'tok.json')
+        with open(path, 'w') as f:
+            json.dump(_entry(-10, 10), f)
+        assert auth_cache.load(path) is None
+
+    def test_legacy_auth_not_saved(self, tmp_path):
+        auth = _Auth(api_version='1.0')
+        auth.login()
+        assert not auth_cache.save(str(tmp_path / 'tok.json'), auth)
+
+    def test_corrupt_file(self, tmp_path):
+        path = tmp_path / 'tok.json'
+        path.write_text('{nope')
+        assert auth_cache.load(str(path)) is None
+
+
+class TestConnect:
+    @pytest.fixture
+    def fake_pyzm(self, monkeypatch):
+        """ZMClient whose constructor logs in through AuthManager.login, like pyzm's ZMAPI."""
+        auth_mod = types.ModuleType('pyzm.zm.auth')
+        auth_mod.AuthManager = _Auth
+
+        class Client:
+            def __init__(self, **kw):
+                self.kw = kw
+                self.api = types.SimpleNamespace(auth=_Auth())
+                self.api.auth.login()
+
+        monkeypatch.setitem(sys.modules, 'pyzm.zm.auth', auth_mod)
+        monkeypatch.setattr(sys.modules['pyzm'], 'ZMClient', Client, raising=False)
+        return Client
+
+    @pytest.fixture
+    def config(self, tmp_path):
+        return {'api_portal': 'https://zm/api', 'portal': 'https://zm', 'user': 'admin',
+                'password': 'pw', 'allow_self_signed': 'yes', 'base_data_path': str(tmp_path),
+                'auth_token_cache': 'yes'}
+
+    def test_second_connect_reuses_token(self, fake_pyzm, config):
+        first = auth_cache.connect(config)
+        assert first.api.auth.logins == [None]
+        second = auth_cache.connect(config)
+        assert second.api.auth.logins == []
+        assert second.api.auth._access_token == 'fresh-access'
+        # patch is removed afterwards
+        assert _Auth.login.__name__ == 'login' and _Auth.login.__qualname__ == '_Auth.login'
+
+    def test_disabled(self, fake_pyzm, config):
+        config['auth_token_cache'] = 'no'
+        auth_cache.connect(config)
+        assert auth_cache.connect(config).api.auth.logins == [None]
+        assert not os.path.exists(os.path.join(config['base_data_path'], 'misc', 'zm_auth'))
+
+    def test_remember_replaces_renewed_token(self, fake_pyzm, config):
+        zm = auth_cache.connect(config)
+        zm.api.auth._access_token = 'renewed-after-401'
+        auth_cache.remember(zm, config)
+        path = auth_cache.cache_path(config['base_data_path'], config['api_portal'], config['user'])
+        assert auth_cache.load(path)['access_token'] == 'renewed-after-401'
@@ -0,0 +1,167 @@
+"""Tests for the compiled config cache used by process_config."""
+import os
+import ssl
+
+import pytest
+import yaml
+
+import zmes_hook_helpers.common_params as g
+from zmes_hook_helpers import utils
+
+
+@pytest.fixture
+def config_files(tmp_path, fixtures_dir):
+    with open(os.path.join(fixtures_dir, "test_objectconfig.yml")) as f:
+        data = yaml.safe_load(f)
+    secrets = tmp_path / "secrets.yml"
+    with open(os.path.join(fixtures_dir, "test_secrets.yml")) as f:
+        secrets.write_text(f.read())
+    data["general"]["secrets"] = str(secrets)
+    data["general"]["config_cache"] = "yes"
+    data["monitors"] = {"1": {"zones": {"driveway": {"coords": "0,0 100,0 100,100 0,100"}},
+                              "object_detection_pattern": "person"}}
+    cfg = tmp_path / "objectconfig.yml"
+    cfg.write_text(yaml.dump(data))
+    return cfg, secrets
+
+
+def _run(cfg, mid=None):
+    g.config = {}
+    g.polygons = []
+    args = {"config": str(cfg)}
+    if mid:
+        args["monitorid"] = mid
+    utils.process_config(args, ssl.create_default_context())
+    return dict(g.config), list(g.polygons)
+
+
+def _bump(path, text):
+    path.write_text(text)
+    st = os.stat(path)
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 1000000000))
+
+
+class TestConfigCache:
+    def test_cached_result_matches_fresh(self, config_files, config_cache_dir):
+        cfg, _ = config_files
+        fresh = _run(cfg, "1")
+        assert len(os.listdir(config_cache_dir)) == 1
+        assert utils.load_config_cache({"config": str(cfg), "monitorid": "1"}) is not None
+        assert _run(cfg, "1") == fresh
+        assert fresh[1][0]["name"] == "driveway"
+
+    def test_keyed_on_monitor(self, config_files, config_cache_dir):
+        cfg, _ = config_files
+        with_zone = _run(cfg, "1")
+        without = _run(cfg, "2")
+        assert len(os.listdir(config_cache_dir)) == 2
+        assert without[1] == []
+        assert _run(cfg, "1") == with_zone
+
+    def test_config_edit_invalidates(self, config_files):
+        cfg, _ = config_files
+        _run(cfg)
+        _bump(cfg, cfg.read_text().replace("poly_thickness: 2", "poly_thickness: 5"))
+        assert utils.load_config_cache({"config": str(cfg)}) is None
+        assert _run(cfg)[0]["poly_thickness"] == 5
+
+    def test_secrets_edit_invalidates(self, config_files):
+        cfg, secrets = config_files
+        _run(cfg)
+        _bump(secrets, secrets.read_text().replace("testuser", "otheruser"))
+        assert _run(cfg)[0]["user"] == "otheruser"
+
+    def test_same_mtime_content_change_invalidates(self, config_files):
+        cfg, _ = config_files
+        _run(cfg)
+        st = os.stat(cfg)
+        cfg.write_text(cfg.read_text().replace("poly_thickness: 2", "poly_thickness: 7"))
+        os.utime(cfg, ns=(st.st_atime_ns, st.st_mtime_ns))
+        assert _run(cfg)[0]["poly_thickness"] == 7
+
+    def test_off_by_default(self, config_files, config_cache_dir):
+        cfg, _ = config_files
+        cfg.write_text(cfg.read_text().replace("config_cache: 'yes'", ""))
+        _run(cfg)
+        assert not config_cache_dir.exists() or os.listdir(config_cache_dir) == []
+
+    def test_cli_munging_not_cached(self, config_files):
+        cfg, _ = config_files
+        g.config = {}
+        utils.process_config({"config": str(cfg), "file": "/tmp/x.jpg", "output_path": "/tmp/out"})
+        assert g.config["write_image_to_zm"] == "no"
+        cfg_plain, _ = _run(cfg)
+        assert cfg_plain["write_image_to_zm"] == "yes"
+        assert cfg_plain["image_path"] != "/tmp/out"
+
+    def test_corrupt_cache_is_ignored(self, config_files, config_cache_dir):
+        cfg, _ = config_files
+        fresh = _run(cfg)
+        for name in os.listdir(config_cache_dir):
+            (config_cache_dir / name).write_bytes(b"not json")
+        assert _run(cfg) == fresh
+
+    def test_no_secrets_in_cache(self, config_files, config_cache_dir):
+        cfg, secrets = config_files
+        fresh = _run(cfg, "1")
+        (name,) = os.listdir(config_cache_dir)
+        text = (config_cache_dir / name).read_text()
+        assert "testpass" not in text and "mlpass" not in text
+        assert '{"__secret__": "ZM_PASSWORD"}' in text
+        cached = _run(cfg, "1")
+        assert cached == fresh and cached[0]["password"] == "testpass"
+        # tuples (zone coordinates) come back as tuples
+        assert cached[1][0]["value"] == fresh[1][0]["value"]
+
+    def test_untrusted_cache_ignored(self, config_files, config_cache_dir, monkeypatch):
+        cfg, _ = config_files
+        _run(cfg)
+        (name,) = os.listdir(config_cache_dir)
+        path = config_cache_dir / name
+        assert utils.load_config_cache({"config": str(cfg)}) is not None
+        os.chmod(path, 0o666)
+        assert utils.load_config_cache({"config": str(cfg)}) is None
+        os.chmod(path, 0o600)
+        monkeypatch.setattr(utils.os, "geteuid", lambda: os.getuid() + 1)
+        assert utils.load_config_cache({"config": str(cfg)}) is None
+
+    def test_pyzm_overrides_from_cache(self, config_files):
+        cfg, _ = config_files
+        cfg.write_text(cfg.read_text().replace("poly_thickness: 2", "poly_thickness: 2\n  pyzm_overrides: {log_level_debug: 3}"))
+        _run(cfg)
+        g.config = {}
+        utils.get_pyzm_config({"config": str(cfg)})
+        assert g.config["pyzm_overrides"] == {"log_level_debug": 3}
+
+    def test_debug_overrides_not_cached(self, config_files):
+        cfg, _ = config_files
+        args = {"config": str(cfg)}
+        for debug in (True, False):
+            g.config, g.polygons = {}, []
+            entry = utils.get_pyzm_config(args)
+            if debug:
+                # what zm_detect.py does for --debug
+                g.config["pyzm_overrides"].update(dump_console=True, log_level_debug=5)
+            utils.process_config(args, ssl.create_default_context(), cache_entry=entry)
+        assert entry is not None
+        assert "dump_console" not in g.config["pyzm_overrides"]
+        assert "pyzm_overrides" not in entry["config"]
+
+    def test_cache_read_once(self, config_files, monkeypatch):
+        cfg, _ = config_files
+        _run(cfg)
+        reads = []
+        real = utils.load_config_cache
+        monkeypatch.setattr(utils, "load_config_cache", lambda a: reads.append(a) or real(a))
+        g.config, g.polygons = {}, []
+        entry = utils.get_pyzm_config({"config": str(cfg)})
+        utils.process_config({"config": str(cfg)}, cache_entry=entry)
+        assert len(reads) == 1 and g.config["ml_sequence"]
+
+    def test_cache_file_under_base_data_path(self, tmp_path, monkeypatch):
+        monkeypatch.undo()
+        cfg = tmp_path / "c.yml"
+        cfg.write_text("general:\n  base_data_path: /srv/zmes\n")
+        path = utils._config_cache_file({"config": str(cfg), "monitorid": "3"})
+        assert path.startswith("/srv/zmes/misc/config_cache/")
+        assert path != utils._config_cache_file({"config": str(cfg), "monitorid": "4"})
@@ -0,0 +1,94 @@
+"""Tests for zmes_hook_helpers.es_rules (pre-detection ES mute check)."""
+import json
+from datetime import datetime
+
+import yaml
+
+import zmes_hook_helpers.common_params as g
+from zmes_hook_helpers import es_rules, gates
+
+# 2024-01-03 was a Wednesday
+WED_2230 = datetime(2024, 1, 3, 22, 30)
+WED_0030 = datetime(2024, 1, 3, 0, 30)
+WED_1200 = datetime(2024, 1, 3, 12, 0)
+
+
+def _rules(*rules, mid=3):
+    return {'notifications': {'monitors': {mid: {'rules': list(rules)}}}}
+
+
+def _mute(**kw):
+    rule = {'time_format': '%I:%M %p', 'from': '9:00 am', 'to': '5:00 pm', 'action': 'mute'}
+    rule.update(kw)
+    return rule
+
+
+class TestRuleMutes:
+    def test_plain_mute_window(self):
+        assert es_rules.rule_mutes(_rules(_mute()), 3, WED_1200) is not None
+        assert es_rules.rule_mutes(_rules(_mute()), 3, WED_2230) is None
+
+    def test_other_monitor(self):
+        assert es_rules.rule_mutes(_rules(_mute()), 4, WED_1200) is None
+
+    def test_string_monitor_key(self):
+        assert es_rules.rule_mutes(_rules(_mute(), mid='3'), '3', WED_1200) is not None
+
+    def test_cause_has_is_inconclusive(self):
+        assert es_rules.rule_mutes(_rules(_mute(cause_has='person')), 3, WED_1200) is None
+
+    def test_first_matching_rule_decides(self):
+        rules = _rules(_mute(cause_has='person'), _mute())
+        assert es_rules.rule_mutes(rules, 3, WED_1200) is None
+        rules = _rules(_mute(**{'from': '1:00 am', 'to': '2:00 am'}), _mute())
+        assert es_rules.rule_mutes(rules, 3, WED_1200) is not None
+
+    def test_critical_notify_first(self):
+        rules = _rules(dict(_mute(), action='critical_notify'), _mute())
+        assert es_rules.rule_mutes(rules, 3, WED_1200) is None
+
+    def test_daysofweek(self):
+        assert es_rules.rule_mutes(_rules(_mute(daysofweek='Mon,Wed')), 3, WED_1200) is not None
+        assert es_rules.rule_mutes(_rules(_mute(daysofweek='Sat,Sun')), 3, WED_1200) is None
+
+    def test_wrapping_window_matches_like_rules_pm(self):
+        # Rules.pm moves "from" back a day and compares times of day, so a
+        # 9pm-1am window only matches the part after midnight.
+        rule = _mute(**{'from': '9:00 pm', 'to': '1:00 am'})
+        assert es_rules.rule_mutes(_rules(rule), 3, WED_0030) is not None
+        assert es_rules.rule_mutes(_rules(rule), 3, WED_2230) is None
+
+    def test_unknown_action_allows(self):
+        assert es_rules.rule_mutes(_rules(dict(_mute(), action='shout'), _mute()), 3, WED_1200) is None
+
+
+class TestMuted:
+    def test_escontrol_force_mute(self, tmp_path):
+        ctl = tmp_path / 'escontrol_interface.dat'
+        (tmp_path / 'escontrol_interface.dat.json').write_text(json.dumps({'notifications': {'3': -1, '4': 1}}))
+        assert es_rules.muted(3, escontrol_file=str(ctl)) == 'escontrol'
+        assert es_rules.muted(4, escontrol_file=str(ctl)) is None
+        assert es_rules.muted(5, escontrol_file=str(ctl)) is None
+
+    def test_missing_files(self, tmp_path):
+        assert es_rules.muted(3, str(tmp_path / 'nope.yml'), str(tmp_path / 'nope.dat')) is None
+
+    def test_rules_file(self, tmp_path):
+        path = tmp_path / 'es_rules.yml'
+        path.write_text(yaml.dump(_rules(_mute())))
+        assert es_rules.muted(3, rules_file=str(path), now=WED_1200) == 'es_rules'
+
+
+class TestGate:
+    def test_off_by_default(self, tmp_path):
+        g.config = {'escontrol_interface_file': str(tmp_path / 'c.dat')}
+        (tmp_path / 'c.dat.json').write_text(json.dumps({'notifications': {'3': -1}}))
+        assert gates.es_muted('3') is None
+        g.config['es_mute_check'] = 'yes'
+        assert gates.es_muted('3') == 'escontrol'
+
+    def test_bad_rules_file_never_mutes(self, tmp_path):
+        path = tmp_path / 'es_rules.yml'
+        path.write_text(yaml.dump(_rules(_mute(**{'from': 'noon-ish'}))))
+        g.config = {'es_mute_check': 'yes', 'es_rules_file': str(path)}
+        assert gates.es_muted('3') is None
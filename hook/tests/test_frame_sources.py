@@ -0,0 +1,155 @@
+"""Tests for zmes_hook_helpers.frame_sources (reading frames from the event directory and mp4)."""
+import numpy as np
+import pytest
+
+from zmes_hook_helpers import frame_sources
+
+cv2 = pytest.importorskip('cv2')
+
+
+class _StreamConfig:
+    def __init__(self, **kw):
+        self.__dict__.update(dict(frame_set=['snapshot', 'alarm', '1'], max_frames=0, start_frame=1,
+                                  frame_skip=1, resize=None, convert_snapshot_to_fid=False), **kw)
+
+    def model_copy(self, update):
+        return _StreamConfig(**dict(self.__dict__, **update))
+
+
+class _Event:
+    max_score_frame_id = 42
+
+    def __init__(self, path=None, http=None):
+        self._path = path
+        self.http = http or {}
+        self.requested = []
+
+    def path(self):
+        return self._path
+
+    def extract_frames(self, stream_config=None):
+        self.requested.append(list(stream_config.frame_set))
+        frames = [(f, self.http[f]) for f in stream_config.frame_set if f in self.http]
+        return frames, {'original': (240, 320), 'resized': None}
+
+
+def _write(path, value, shape=(240, 320)):
+    cv2.imwrite(str(path), np.full(shape + (3,), value, dtype=np.uint8))
+
+
+class TestFrameIds:
+    def test_frame_set(self):
+        assert frame_sources.frame_ids(_StreamConfig()) == ['snapshot', 'alarm', '1']
+
+    def test_snapshot_to_fid(self):
+        sc = _StreamConfig(convert_snapshot_to_fid=True)
+        assert frame_sources.frame_ids(sc, _Event()) == ['42', 'alarm', '1']
+
+    def test_max_frames(self):
+        sc = _StreamConfig(frame_set=[], max_frames=3, start_frame=5, frame_skip=2)
+        assert frame_sources.frame_ids(sc) == ['5', '7', '9']
+        assert frame_sources.frame_ids(_StreamConfig(frame_set=[])) is None
+
+    def test_frame_file(self):
+        assert frame_sources.frame_file('/ev', 'alarm') == '/ev/alarm.jpg'
+        assert frame_sources.frame_file('/ev', '42') == '/ev/00042-capture.jpg'
+        assert frame_sources.frame_file('/ev', '42', digits=3) == '/ev/042-capture.jpg'
+
+
+def _video(path, count=60):
+    out = cv2.VideoWriter(str(path), cv2.VideoWriter_fourcc(*'mp4v'), 10, (320, 240))
+    for i in range(count):
+        out.write(np.full((240, 320, 3), i * 4, dtype=np.uint8))
+    out.release()
+
+
+class TestLocal:
+    def test_all_local(self, tmp_path):
+        _write(tmp_path / 'snapshot.jpg', 10)
+        _write(tmp_path / 'alarm.jpg', 20)
+        _write(tmp_path / '00001-capture.jpg', 30)
+        ev = _Event(str(tmp_path))
+        frames, dims = frame_sources.extract(ev, _StreamConfig(resize=160), 'local')
+        assert [f for f, _ in frames] == ['snapshot', 'alarm', '1']
+        assert frames[0][1].shape == (120, 160, 3)
+        assert dims == {'original': (240, 320), 'resized': (120, 160)}
+        assert ev.requested == []
+
+    def test_missing_frames_downloaded(self, tmp_path):
+        _write(tmp_path / 'alarm.jpg', 20)
+        http = np.zeros((240, 320, 3), dtype=np.uint8)
+        ev = _Event(str(tmp_path), http={'snapshot': http, '1': http})
+        frames, dims = frame_sources.extract(ev, _StreamConfig(), 'local')
+        assert [f for f, _ in frames] == ['snapshot', 'alarm', '1']
+        assert frames[0][1] is http and frames[1][1].mean() > 10
+        assert ev.requested == [['snapshot', '1']]
+        assert dims == {'original': (240, 320), 'resized': None}
+
+    def test_partly_written_jpeg_is_downloaded(self, tmp_path):
+        _write(tmp_path / 'alarm.jpg', 20)
+        data = (tmp_path / 'alarm.jpg').read_bytes()
+        (tmp_path / 'alarm.jpg').write_bytes(data[:len(data) // 2])
+        assert frame_sources.read_jpeg(str(tmp_path / 'alarm.jpg')) is None
+        ev = _Event(str(tmp_path))
+        frame_sources.extract(ev, _StreamConfig(frame_set=['alarm']), 'local')
+        assert ev.requested == [['alarm']]
+
+    def test_no_event_dir(self, tmp_path):
+        ev = _Event(str(tmp_path / 'gone'))
+        frame_sources.extract(ev, _StreamConfig(), 'local')
+        assert ev.requested == [['snapshot', 'alarm', '1']]
+
+    def test_eventpath_argument_wins(self, tmp_path):
+        _write(tmp_path / 'alarm.jpg', 20)
+        ev = _Event('/nonexistent')
+        frames, _ = frame_sources.extract(ev, _StreamConfig(frame_set=['alarm']), 'local', str(tmp_path))
+        assert [f for f, _ in frames] == ['alarm'] and ev.requested == []
+
+
+class TestVideo:
+    def test_decodes_requested_frames(self, tmp_path):
+        _video(tmp_path / '7-video.mp4')
+        found = frame_sources.decode_frames(str(tmp_path / '7-video.mp4'), [50, 5, 52, 6])
+        assert sorted(found) == [5, 6, 50, 52]
+        for number, image in found.items():
+            assert abs(image.mean() - (number - 1) * 4) < 6
+
+    def test_frame_numbers(self):
+        ev = _Event()
+        ev.raw = lambda: {'Event': {'AlarmFrameId': '12'}}
+        assert [frame_sources.frame_number(f, ev) for f in ('snapshot', 'alarm', '3', 'x')] == [42, 12, 3, None]
+        assert frame_sources.frame_number('alarm', _Event()) is None
+
+    def test_video_then_http(self, tmp_path):
+        _video(tmp_path / 'event.mp4', count=30)
+        http = np.zeros((240, 320, 3), dtype=np.uint8)
+        ev = _Event(str(tmp_path), http={'snapshot': http})
+        frames, dims = frame_sources.extract(ev, _StreamConfig(frame_set=['snapshot', '10']), 'video')
+        # snapshot is frame 42, past the end of the video
+        assert [f for f, _ in frames] == ['snapshot', '10']
+        assert ev.requested == [['snapshot']]
+        assert dims['original'] == (240, 320)
+
+    def test_jpegs_first(self, tmp_path):
+        _video(tmp_path / 'event.mp4')
+        _write(tmp_path / 'snapshot.jpg', 200)
+        ev = _Event(str(tmp_path))
+        frames, _ = frame_sources.extract(ev, _StreamConfig(frame_set=['snapshot', '2']), 'local, video')
+        assert frames[0][1].mean() > 190 and abs(frames[1][1].mean() - 4) < 6
+        assert ev.requested == []
+
+    def test_unfinished_video_is_downloaded(self, tmp_path):
+        (tmp_path / 'event.mp4').write_bytes(b'\0' * 1000)
+        ev = _Event(str(tmp_path))
+        frame_sources.extract(ev, _StreamConfig(frame_set=['3']), 'video')
+        assert ev.requested == [['3']]
+
+
+class TestExtract:
+    def test_http_is_pyzm(self, tmp_path):
+        _write(tmp_path / 'alarm.jpg', 20)
+        ev = _Event(str(tmp_path))
+        frame_sources.extract(ev, _StreamConfig(frame_set=['alarm']))
+        assert ev.requested == [['alarm']]
+        frame_sources.extract(ev, _StreamConfig(frame_set=['alarm']), 'local')
+        assert ev.requested == [['alarm']]
@@ -0,0 +1,166 @@
+"""Tests for zmes_hook_helpers.gates and the early-exit path in zm_detect."""
+import json
+import sys
+
+import pytest
+import yaml
+
+import zmes_hook_helpers.common_params as g
+from zmes_hook_helpers import gates
+
+
+def _ml(**enabled):
+    seq = {'general': {'model_sequence': ','.join(enabled)}}
+    for mtype, flags in enabled.items():
+        seq[mtype] = {'sequence': [{'name': '{}{}'.format(mtype, i), 'enabled': f} for i, f in enumerate(flags)]}
+    return seq
+
+
+class TestNoEnabledModels:
+    def test_all_disabled(self):
+        assert gates.no_enabled_models(_ml(object=['no', 'no'], face=['no']))
+
+    def test_one_enabled(self):
+        assert not gates.no_enabled_models(_ml(object=['no', 'yes']))
+
+    def test_enabled_defaults_to_yes(self):
+        assert not gates.no_enabled_models({'general': {'model_sequence': 'object'},
+                                            'object': {'sequence': [{'name': 'x'}]}})
+
+    def test_disabled_type_not_in_model_sequence(self):
+        ml = _ml(object=['no'])
+        ml['face'] = {'sequence': [{'enabled': 'yes'}]}
+        assert gates.no_enabled_models(ml)
+
+    def test_bool_values(self):
+        assert gates.no_enabled_models(_ml(object=[False]))
+        assert not gates.no_enabled_models(_ml(object=[True]))
+
+
+class TestNoMatchingPattern:
+    def _ml(self, tmp_path, pattern='.*', top=None, labels=('person', 'car', 'dog'), **extra):
+        path = tmp_path / 'coco.names'
+        path.write_text('\n'.join(labels) + '\n')
+        ml = {'general': {'model_sequence': 'object'},
+              'object': {'general': {'pattern': pattern},
+                         'sequence': [dict({'name': 'yolo', 'object_labels': str(path)}, **extra)]}}
+        if top:
+            ml['general']['pattern'] = top
+        return ml
+
+    def test_pattern_matching_no_label(self, tmp_path):
+        assert gates.no_matching_pattern(self._ml(tmp_path, '(persn|truck)'))
+        assert gates.check('Motion', self._ml(tmp_path, '(persn|truck)')) == 'no_matching_pattern'
+
+    def test_some_label_matches(self, tmp_path):
+        assert not gates.no_matching_pattern(self._ml(tmp_path, '(person|truck)'))
+
+    def test_both_patterns_apply(self, tmp_path):
+        assert gates.no_matching_pattern(self._ml(tmp_path, 'person', top='(car|dog)'))
+        assert not gates.no_matching_pattern(self._ml(tmp_path, '(person|car)', top='(car|dog)'))
+
+    def test_config_zones(self, tmp_path):
+        g.polygons = [{'name': 'a', 'pattern': 'person', 'ignore_pattern': None},
+                      {'name': 'b', 'pattern': None, 'ignore_pattern': '.*'}]
+        assert gates.no_matching_pattern(self._ml(tmp_path, '(car|dog)'))
+        assert not gates.no_matching_pattern(self._ml(tmp_path, '(person|dog)'))
+        # imported ZM zones may accept anything
+        g.config['import_zm_zones'] = 'yes'
+        assert not gates.no_matching_pattern(self._ml(tmp_path, '(car|dog)'))
+
+    def test_unknown_labels_never_fire(self, tmp_path):
+        ml = self._ml(tmp_path, 'nothing')
+        ml['object']['sequence'].append({'name': 'remote'})
+        assert not gates.no_matching_pattern(ml)
+        ml = self._ml(tmp_path, 'nothing', object_labels=str(tmp_path / 'missing.names'))
+        assert not gates.no_matching_pattern(ml)
+        assert not gates.no_matching_pattern(self._ml(tmp_path, '(unclosed'))
+
+
+class TestNoTriggeredZone:
+    def test_fires_when_no_zone_survived(self):
+        g.config = {'only_triggered_zm_zones': 'yes'}
+        assert gates.no_triggered_zone('Motion: Street', 0)
+
+    def test_config_zones_dont_count(self):
+        g.config = {'only_triggered_zm_zones': 'yes'}
+        g.polygons = [{'name': 'from_config'}]
+        assert gates.no_triggered_zone('Motion: Street', 0)
+
+    def test_not_without_reason(self):
+        g.config = {'only_triggered_zm_zones': 'yes'}
+        assert not gates.no_triggered_zone('', 0)
+
+    def test_not_when_zone_matched(self):
+        g.config = {'only_triggered_zm_zones': 'yes'}
+        assert not gates.no_triggered_zone('Motion: Driveway', 1)
+
+    def test_not_when_option_off(self):
+        g.config = {'only_triggered_zm_zones': 'no'}
+        assert not gates.no_triggered_zone('Motion: Street', 0)
+
+    def test_check_skips_zone_gate_until_zones_read(self):
+        g.config = {'only_triggered_zm_zones': 'yes'}
+        ml = _ml(object=['yes'])
+        assert gates.check('Motion: Street', ml) is None
+        assert gates.check('Motion: Street', ml, 0) == 'no_triggered_zone'
+
+    def test_import_result_drives_gate(self, tmp_path):
+        from zmes_hook_helpers import utils
+        g.config = {'only_triggered_zm_zones': 'yes', 'base_data_path': str(tmp_path), 'zm_zones_cache_ttl': 60}
+        g.polygons = [{'name': 'from_config'}]
+        zones = [{'name': 'Driveway', 'type': 'Active', 'points': [[0, 0], [1, 0], [1, 1]],
+                  'pattern': None, 'ignore_pattern': None}]
+        utils._store_zm_zones('1', zones)
+        assert gates.no_triggered_zone('Motion: Street', utils.import_zm_zones('1', 'Motion: Street', None))
+        assert not gates.no_triggered_zone('Motion: Driveway', utils.import_zm_zones('1', 'Motion: Driveway', None))
+
+
+class TestRecord:
+    def test_counts_per_gate(self, tmp_path):
+        g.config = {'base_data_path': str(tmp_path)}
+        (tmp_path / 'misc').mkdir()
+        assert gates.record('a') == 1
+        assert gates.record('a') == 2
+        assert gates.record('b') == 1
+        with open(tmp_path / 'misc' / 'gate_counts.json') as f:
+            assert json.load(f) == {'a': 2, 'b': 1}
+
+    def test_unwritable_returns_zero(self, tmp_path):
+        g.config = {'base_data_path': str(tmp_path / 'missing')}
+        assert gates.record('a') == 0
+
+
+class TestMainHandlerGate:
+    @pytest.fixture
+    def config(self, make_config):
+        """Config with every object model disabled."""
+        def make(**general):
+            path = make_config(**general)
+            with open(path) as f:
+                data = yaml.safe_load(f)
+            data['ml']['ml_sequence']['object']['sequence'] = [{'name': 'off', 'enabled': 'no'}]
+            with open(path, 'w') as f:
+                yaml.dump(data, f)
+            return path
+        return make
+
+    def test_no_enabled_models_exits_before_detection(self, tmp_path, config, capsys, monkeypatch):
+        cfg = config(early_exit_gates='yes')
+        from zmes_hook_helpers import detect
+        monkeypatch.setattr(detect.server, 'get_detector',
+                            lambda *a, **kw: (_ for _ in ()).throw(AssertionError('detector built')))
+        detect.main_handler(['-c', cfg, '-e', '1', '-m', '1', '-r', 'Motion: All'])
+        assert capsys.readouterr().out == ''
+        with open(tmp_path / 'misc' / 'gate_counts.json') as f:
+            assert json.load(f) == {'no_enabled_models': 1}
+
+    def test_gates_off_by_default(self, tmp_path, config, monkeypatch):
+        cfg = config()
+        from zmes_hook_helpers import detect
+        built = []
+        monkeypatch.setattr(detect.server, 'get_detector',
+                            lambda *a, **kw: built.append(1) or sys.modules['pyzm'].Detector())
+        detect.main_handler(['-c', cfg, '-e', '1', '-m', '1', '-r', 'Motion: All'])
+        assert built
+        assert not (tmp_path / 'misc' / 'gate_counts.json').exists()
@@ -0,0 +1,75 @@
+"""Tests for the zm_detect_hook console entry point."""
+import json
+
+import pytest
+
+from zmes_hook_helpers import hook_entry
+
+
+@pytest.fixture(autouse=True)
+def keep_signal_handlers(monkeypatch):
+    # main() installs SIGINT/SIGTERM handlers meant for the hook process only
+    monkeypatch.setattr(hook_entry.signal, 'signal', lambda *a: None)
+
+
+class TestFilterOutput:
+    def test_text(self):
+        out = 'noise\n[a] detected:person:97%  --SPLIT--{"labels": ["person"]}\n'
+        assert hook_entry.filter_output(out) == ('[a] detected:person:97% --SPLIT--{"labels": ["person"]}\n', 0)
+        assert hook_entry.filter_output('noise\n') == ('\n', 1)
+
+
+
+class TestRecordStream:
+    def test_passes_records_through_as_printed(self):
+        import io
+        dest = io.StringIO()
+        stream = hook_entry.RecordStream(dest)
+        early = json.dumps({'zmes_hook': 1, 'type': 'provisional', 'detected': True})
+        stream.write('noise\n' + early[:10])
+        assert dest.getvalue() == ''
+        stream.write(early[10:] + '\n')
+        assert dest.getvalue() == early + '\n'
+
+        final = json.dumps({'zmes_hook': 1, 'type': 'result', 'detected': True})
+        stream.write(final)
+        stream.close()
+        assert dest.getvalue() == early + '\n' + final + '\n'
+
+
+class TestMain:
+    def test_argv_like_zm_event_start(self, monkeypatch):
+        seen = []
+        monkeypatch.setattr(hook_entry, 'run', lambda argv, out=None: seen.append(argv) or ('', 0))
+        monkeypatch.delenv('ZMES_HOOK_OUTPUT_FORMAT', raising=False)
+        assert hook_entry.main(['7', '1', 'Front Door', 'Motion: All', '/ev/7', '--config', '/c.yml']) == 1
+        assert seen[0] == ['--monitorid', '1', '--eventid', '7', '--config', '/c.yml',
+                           '--eventpath', '/ev/7', '--reason', 'Motion: All']
+
+        monkeypatch.setenv('ZMES_HOOK_OUTPUT_FORMAT', 'jsonl')
+        assert hook_entry.main(['7', '--socket', '/run/zm.sock']) == 0
+        assert seen[1][-4:] == ['--socket', '/run/zm.sock', '--output-format', 'jsonl']
+        assert '--monitorid' not in seen[1]
+
+    def test_detection(self, make_config, capsys, monkeypatch):
+        cfg = make_config()
+        real_run = hook_entry.run
+        monkeypatch.setattr(hook_entry, 'run', lambda argv, out=None: real_run(argv + ['--fakeit', 'person'], out))
+        monkeypatch.delenv('ZMES_HOOK_OUTPUT_FORMAT', raising=False)
+        assert hook_entry.main(['7', '1', 'Front', 'Motion', '--config', cfg]) == 0
+        out = capsys.readouterr().out
+        assert out.startswith('[') and 'detected:person' in out and '--SPLIT--' in out
+        assert len(out.splitlines()) == 1
+
+    def test_jsonl_exit_code_from_main_handler(self, make_config, capsys, monkeypatch):
+        cfg = make_config()
+        real_run = hook_entry.run
+        monkeypatch.setattr(hook_entry, 'run', lambda argv, out=None: real_run(argv + ['--fakeit', 'person'], out))
+        monkeypatch.setenv('ZMES_HOOK_OUTPUT_FORMAT', 'jsonl')
+        assert hook_entry.main(['7', '1', 'Front', 'Motion', '--config', cfg]) == 0
+        records = [json.loads(l) for l in capsys.readouterr().out.splitlines()]
+        assert records[-1]['type'] == 'result' and records[-1]['detected']
+
+    def test_missing_config(self, tmp_path, capsys):
+        assert hook_entry.main(['7', '--config', str(tmp_path / 'nope.yml')]) == 1
+        assert capsys.readouterr().out == '\n'
@@ -0,0 +1,116 @@
+"""Tests for zmes_hook_helpers.http_pool (shared session, retries, per-endpoint timings)."""
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from zmes_hook_helpers import http_pool, stages
+
+requests = pytest.importorskip('requests')
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    fail = 0  # answer this many requests with 503 first
+
+    def do_GET(self):
+        status = 503 if _Handler.fail > 0 else 200
+        _Handler.fail -= 1
+        body = b'{}'
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        self.server.connections.add(self.client_address)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    srv = ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+    srv.connections = set()
+    srv.daemon_threads = True
+    t = threading.Thread(target=srv.serve_forever, daemon=True)
+    t.start()
+    http_pool.stats.reset()
+    yield srv
+    srv.shutdown()
+    srv.server_close()
+
+
+def _url(srv, path):
+    return 'http://127.0.0.1:{}{}'.format(srv.server_port, path)
+
+
+class TestEndpoint:
+    def test_names(self):
+        assert http_pool.endpoint('get', 'https://zm/zm/api/events/12.json?token=x') == 'GET events'
+        assert http_pool.endpoint('put', 'https://zm/zm/api/events/12.json') == 'PUT events'
+        assert http_pool.endpoint('get', 'https://zm/zm/index.php?view=image&eid=1') == 'GET portal:image'
+        assert http_pool.endpoint('get', 'https://zm/cgi-bin/nph-zms?mode=single') == 'GET zms'
+        assert http_pool.endpoint('post', 'https://fcm.example.com/send') == 'POST fcm.example.com'
+
+    def test_settings(self):
+        opts = http_pool.settings({'http_pool_size': '4', 'http_backoff': 1, 'http_retries': None})
+        assert opts['http_pool_size'] == 4 and opts['http_backoff'] == 1.0
+        assert opts['http_retries'] == http_pool.DEFAULTS['http_retries']
+
+
+class TestSession:
+    def test_keep_alive_and_timings(self, server):
+        sess = http_pool.tune(requests.Session())
+        for _ in range(3):
+            assert sess.get(_url(server, '/zm/api/events/1.json')).ok
+        assert len(server.connections) == 1
+        assert http_pool.stats.calls == {'GET events': 3}
+        assert http_pool.stats.summary().startswith('GET events 3x ')
+
+    def test_retries_with_backoff(self, server, monkeypatch):
+        slept = []
+        monkeypatch.setattr('time.sleep', slept.append)
+        _Handler.fail = 2
+        sess = http_pool.tune(requests.Session(), {'http_backoff': 1, 'http_backoff_max': 1.5})
+        assert sess.get(_url(server, '/zm/api/monitors.json')).ok
+        assert http_pool.stats.retries == 2
+        assert all(0 <= s <= 1.5 for s in slept)
+
+    def test_default_timeout_and_tuple_kept(self):
+        seen = []
+        sess = requests.Session()
+        sess.request = lambda method, url, **kw: seen.append(kw['timeout']) or type('R', (), {'status_code': 200})()
+        http_pool.tune(sess, {'http_connect_timeout': 2, 'http_read_timeout': 7})
+        http_pool.tune(sess, {'http_connect_timeout': 2, 'http_read_timeout': 7})
+        sess.get('http://zm/zm/api/host/getVersion.json', timeout=30)
+        sess.post('http://fcm/send', timeout=http_pool.timeout(10))
+        assert seen == [(2.0, 7.0), (5.0, 10.0)]
+
+    def test_errors_counted(self, server):
+        _Handler.fail = 1
+        sess = http_pool.tune(requests.Session(), {'http_retries': 0})
+        assert sess.get(_url(server, '/zm/index.php?view=image')).status_code == 503
+        assert http_pool.stats.errors == {'GET portal:image': 1}
+
+    def test_deadline_cuts_timeout(self):
+        seen = []
+        sess = requests.Session()
+        sess.request = lambda method, url, **kw: seen.append(kw['timeout']) or type('R', (), {'status_code': 200})()
+        http_pool.tune(sess, {'http_connect_timeout': 2, 'http_read_timeout': 30}, stages.Deadline(5))
+        sess.get('http://zm/zm/api/events/1.json')
+        http_pool.tune(sess, {}, stages.Deadline(0.01))
+        sess.get('http://zm/zm/api/events/1.json')
+        assert seen[0][0] == 2.0 and 4 < seen[0][1] <= 5
+        assert seen[1] == (http_pool.MIN_TIMEOUT, http_pool.MIN_TIMEOUT)
+
+    def test_no_retries_past_deadline(self, server, monkeypatch):
+        slept = []
+        monkeypatch.setattr('time.sleep', slept.append)
+        _Handler.fail = 2
+        deadline = stages.Deadline(60)
+        monkeypatch.setattr(deadline, 'remaining', lambda: 0.0)
+        sess = http_pool.tune(requests.Session(), {'http_backoff': 1}, deadline)
+        assert sess.get(_url(server, '/zm/api/monitors.json')).status_code == 503
+        assert http_pool.stats.retries == 0 and slept == []
+        _Handler.fail = 0
@@ -1,4 +1,5 @@
 """Tests for import_zm_zones using pyzm ZMClient. Ref: ZoneMinder/zmeventnotificationNg#18"""
+import json
 import sys
 import os
 import pytest
@@ -161,3 +162,106 @@ class TestImportZmZones:
 
         import_zm_zones("1", None, mock_zm)
         assert g.polygons[0]['name'] == 'front_yard_camera_1'
+
+
+class TestZmZonesCache:
+    def setup_method(self):
+        g.polygons = []
+        g.logger = _FakeLogger()
+
+    def _zm(self, *zones):
+        mock_zm = MagicMock()
+        mock_zm.monitor.return_value.get_zones.return_value = list(zones)
+        return mock_zm
+
+    def _set_config(self, tmp_path, ttl=600):
+        g.config = {
+            'only_triggered_zm_zones': 'no',
+            'import_zm_zones': 'yes',
+            'zm_zones_cache_ttl': ttl,
+            'base_data_path': str(tmp_path),
+            'api_portal': 'https://zm/api',
+        }
+
+    def test_second_import_uses_cache(self, tmp_path):
+        from zmes_hook_helpers.utils import import_zm_zones
+        self._set_config(tmp_path)
+        zm = self._zm(_make_zone("Front Yard", "0,0 100,0 100,100 0,100"))
+        import_zm_zones("1", None, zm)
+        fresh = list(g.polygons)
+        g.polygons = []
+        import_zm_zones("1", None, None)
+        assert g.polygons == fresh
+        assert zm.monitor.call_count == 1
+
+    def test_reason_filter_runs_on_cached_list(self, tmp_path):
+        from zmes_hook_helpers.utils import import_zm_zones
+        self._set_config(tmp_path)
+        g.config['only_triggered_zm_zones'] = 'yes'
+        zm = self._zm(_make_zone("Driveway", "0,0 100,0 100,100 0,100"),
+                      _make_zone("Backyard", "50,50 150,50 150,150 50,150"),
+                      _make_zone("Porch", "1,1 2,1 2,2", "Inactive"))
+        import_zm_zones("1", "Motion: Driveway", zm)
+        assert [p['name'] for p in g.polygons] == ['driveway']
+        g.polygons = []
+        import_zm_zones("1", "Motion: Backyard,Porch", None)
+        assert [p['name'] for p in g.polygons] == ['backyard']
+
+    def test_expired_entry_refetches(self, tmp_path):
+        from zmes_hook_helpers.utils import import_zm_zones
+        self._set_config(tmp_path)
+        zm = self._zm(_make_zone("A", "0,0 1,0 1,1"))
+        import_zm_zones("1", None, zm)
+        path = tmp_path / 'misc' / 'zm_zones' / '1.json'
+        data = json.loads(path.read_text())
+        data['fetched'] -= 601
+        path.write_text(json.dumps(data))
+        import_zm_zones("1", None, zm)
+        assert zm.monitor.call_count == 2
+
+    def test_ttl_zero_disables(self, tmp_path):
+        from zmes_hook_helpers.utils import import_zm_zones
+        self._set_config(tmp_path, ttl=0)
+        zm = self._zm(_make_zone("A", "0,0 1,0 1,1"))
+        import_zm_zones("1", None, zm)
+        import_zm_zones("1", None, zm)
+        assert zm.monitor.call_count == 2
+        assert not (tmp_path / 'misc' / 'zm_zones').exists()
+
+    def test_other_portal_not_reused(self, tmp_path):
+        from zmes_hook_helpers.utils import import_zm_zones, zm_zones_cached
+        self._set_config(tmp_path)
+        import_zm_zones("1", None, self._zm(_make_zone("A", "0,0 1,0 1,1")))
+        assert zm_zones_cached("1")
+        g.config['api_portal'] = 'https://other/api'
+        assert not zm_zones_cached("1")
+
+    def test_flush(self, tmp_path):
+        from zmes_hook_helpers.utils import import_zm_zones, zm_zones_cached, flush_zm_zones_cache
+        self._set_config(tmp_path)
+        import_zm_zones("1", None, self._zm(_make_zone("A", "0,0 1,0 1,1")))
+        import_zm_zones("2", None, self._zm(_make_zone("B", "0,0 1,0 1,1")))
+        flush_zm_zones_cache("1")
+        assert not zm_zones_cached("1") and zm_zones_cached("2")
+        flush_zm_zones_cache()
+        assert not zm_zones_cached("2")
+
+
+class TestZoneCacheExpiry:
+    def test_expired_between_check_and_read_logs_in(self, tmp_path, make_config, monkeypatch):
+        cfg = make_config(import_zm_zones='yes', zm_zones_cache_ttl=600)
+        from zmes_hook_helpers import detect
+        zm = MagicMock()
+        zm.monitor.return_value.get_zones.return_value = [_make_zone("Driveway", "0,0 10,0 10,10")]
+        connects = []
+        detector = MagicMock()
+        detector.detect.return_value.to_dict.return_value = {
+            'labels': ['person'], 'boxes': [[0, 0, 1, 1]], 'confidences': [0.9], 'frame_id': 'alarm',
+            'image_dimensions': None, 'model_names': ['yolo']}
+        # the cache looked fresh when the login was skipped, and is gone by the time it is read
+        monkeypatch.setattr(detect.utils, 'zm_zones_cached', lambda mid: True)
+        monkeypatch.setattr(detect, '_connect', lambda deadline=None: connects.append(deadline) or zm)
+        monkeypatch.setattr(detect.server, 'get_detector', lambda *a, **kw: detector)
+        detect.main_handler(['-c', cfg, '-m', '3', '-f', str(tmp_path / 'x.jpg'), '--output-format', 'jsonl'])
+        assert len(connects) == 1
+        assert [p['name'] for p in g.polygons] == ['driveway']
@@ -0,0 +1,70 @@
+"""Tests for the single JPEG encode of the annotated frame."""
+import json
+
+import cv2
+import numpy as np
+
+import zmes_hook_helpers.common_params as g
+from zmes_hook_helpers import jpeg
+
+
+def _frame():
+    img = np.zeros((48, 64, 3), dtype=np.uint8)
+    img[:, 32:] = (0, 0, 255)
+    return img
+
+
+class TestEncode:
+    def test_decodes_back(self):
+        data = jpeg.encode(_frame(), quality=90)
+        assert data[:2] == b'\xff\xd8'
+        out = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+        assert out.shape == (48, 64, 3)
+        assert out[10, 50, 2] > 200 and out[10, 10, 2] < 50
+
+    def test_quality_from_config(self):
+        g.config = {'jpeg_quality': 20}
+        small = jpeg.encode(np.random.RandomState(0).randint(0, 255, (64, 64, 3), dtype=np.uint8))
+        g.config = {'jpeg_quality': 95}
+        large = jpeg.encode(np.random.RandomState(0).randint(0, 255, (64, 64, 3), dtype=np.uint8))
+        assert len(small) < len(large)
+
+    def test_turbojpeg_falls_back_to_opencv(self, monkeypatch):
+        monkeypatch.setattr(jpeg, '_turbo', False)
+        assert jpeg.encode(_frame(), encoder='turbojpeg')[:2] == b'\xff\xd8'
+
+
+class TestWriteObjdetect:
+    def test_same_files_as_pyzm(self, tmp_path):
+        md = {'labels': ['person'], 'boxes': [[1, 2, 3, 4]], 'frame_id': 'snapshot', 'confidences': [0.9],
+              'image_dimensions': {}, 'polygons': [], 'model_names': ['yolo']}
+        assert jpeg.write_objdetect(str(tmp_path / 'ev'), b'JPG', md) == str(tmp_path / 'ev')
+        assert (tmp_path / 'ev' / 'objdetect.jpg').read_bytes() == b'JPG'
+        with open(tmp_path / 'ev' / 'objects.json') as f:
+            assert json.load(f) == {'labels': ['person'], 'boxes': [[1, 2, 3, 4]], 'frame_id': 'snapshot',
+                                    'confidences': [0.9], 'image_dimensions': {}}
+
+
+class TestThumbnail:
+    def test_scales_to_width(self):
+        thumb = jpeg.thumbnail(np.zeros((2160, 3840, 3), dtype=np.uint8), 640)
+        assert thumb.shape == (360, 640, 3)
+
+    def test_narrow_image_unchanged(self):
+        img = _frame()
+        assert jpeg.thumbnail(img, 640) is img
+        assert jpeg.thumbnail(img, 0) is img
+
+    def test_written_next_to_objdetect(self, tmp_path):
+        jpeg.write_objdetect(str(tmp_path), b'BIG', {}, thumb=b'SMALL')
+        assert (tmp_path / 'objdetect_thumb.jpg').read_bytes() == b'SMALL'
+
+
+class TestRelativeEventPath:
+    def test_schemes(self):
+        assert jpeg.relative_event_path('/var/cache/zoneminder/events/1/2024-01-31/1234', 1) == '1/2024-01-31/1234'
+        assert jpeg.relative_event_path('/ev/8/24/01/31/08/30/15', 8) == '8/24/01/31/08/30/15'
+        assert jpeg.relative_event_path('/ev/3/99', '3') == '3/99'
+
+    def test_unknown_layout(self):
+        assert jpeg.relative_event_path('/tmp/debug', 3) is None
@@ -168,3 +168,123 @@ class TestFormatDetectionOutput:
         output = format_detection_output(data, config)
         txt, _ = output.split('--SPLIT--', 1)
         assert txt.startswith('[a]')
+
+
+class TestDetectionRecord:
+    def test_record(self):
+        from zmes_hook_helpers.utils import format_detection_record, HOOK_OUTPUT_VERSION
+        data = _make_matched_data(['person'], [[1, 2, 3, 4]], 'alarm', [0.97])
+        rec = format_detection_record(data, '[a] detected:person:97%', {'detect': 0.8125},
+                                      {'objdetect_jpg': '/ev/objdetect.jpg'}, event_id='7')
+        assert rec['zmes_hook'] == HOOK_OUTPUT_VERSION and rec['type'] == 'result'
+        assert rec['detected'] is True
+        assert rec['labels'] == ['person'] and rec['boxes'] == [[1, 2, 3, 4]]
+        assert rec['timings_ms'] == {'detect': 812.5}
+        assert rec['artifacts'] == {'objdetect_jpg': '/ev/objdetect.jpg'}
+        assert rec['event_id'] == '7'
+        # zm_event_start.sh passes on the lines starting with the first key
+        assert json.dumps(rec).startswith('{"zmes_hook":')
+
+    def test_no_detection(self):
+        from zmes_hook_helpers.utils import format_detection_record
+        rec = format_detection_record({}, gate='no_enabled_models')
+        assert rec['detected'] is False and rec['labels'] == [] and rec['gate'] == 'no_enabled_models'
+
+
+class TestJsonlMainHandler:
+    def _run(self, argv, capsys, code=None):
+        from zmes_hook_helpers import detect
+        exit_code = detect.main_handler(argv)
+        if code is not None:
+            assert exit_code == code
+        return capsys.readouterr().out.splitlines()
+
+    def test_one_record(self, make_config, capsys):
+        cfg = make_config()
+        (line,) = self._run(['-c', cfg, '-e', '7', '-m', '1', '--fakeit', 'person', '--output-format', 'jsonl'],
+                            capsys, code=0)
+        rec = json.loads(line)
+        assert rec['detected'] and rec['labels'] == ['person'] and 'detected:person' in rec['text']
+        assert rec['event_id'] == '7' and rec['monitor_id'] == '1'
+        assert 'detect' in rec['timings_ms'] and 'total' in rec['timings_ms']
+        assert '--SPLIT--' not in line
+
+    def test_text_is_default(self, make_config, capsys):
+        cfg = make_config()
+        (line,) = self._run(['-c', cfg, '-e', '7', '-m', '1', '--fakeit', 'person'], capsys, code=0)
+        assert 'detected:person--SPLIT--' in line
+
+    def test_gate_record(self, make_config, capsys):
+        cfg = make_config(early_exit_gates='yes')
+        (line,) = self._run(['-c', cfg, '-e', '7', '-m', '1', '--output-format', 'jsonl'], capsys, code=1)
+        rec = json.loads(line)
+        assert rec['detected'] is False and rec['gate'] == 'no_enabled_models'
+
+
+class _FrameResult:
+    def __init__(self, labels, frame_id=None):
+        self.labels, self.frame_id = labels, frame_id
+        self.matched = bool(labels)
+
+    def to_dict(self):
+        return _make_matched_data(self.labels, frame_id=self.frame_id)
+
+
+class _ProgressiveDetector:
+    """Two frames: 'snapshot' matches person, 'alarm' adds a car and wins."""
+
+    def _detect_multi_frame(self, frames, zones, pipeline, original_shape=None):
+        best = None
+        for frame_id, labels in frames:
+            result = pipeline.run(labels)
+            result.frame_id = frame_id
+            if best is None or len(result.labels) > len(best.labels):
+                best = result
+        return best
+
+    def detect_event(self, zm, eid, zones=None, stream_config=None):
+        pipeline = type('P', (), {'run': lambda s, labels: _FrameResult(labels), '_backends': []})()
+        return self._detect_multi_frame([('snapshot', ['person']), ('alarm', ['person', 'car'])], zones, pipeline) \
+            or _FrameResult([])
+
+
+class TestProgressive:
+    def _run_progressive(self, make_config, capsys, monkeypatch, fmt='jsonl', **general):
+        cfg = make_config(**general)
+        from zmes_hook_helpers import detect
+        monkeypatch.setattr(detect.server, 'get_detector', lambda *a, **kw: _ProgressiveDetector())
+        detect.main_handler(['-c', cfg, '-e', '7', '-m', '1', '--output-format', fmt])
+        return capsys.readouterr().out.splitlines()
+
+    def test_provisional_then_final(self, make_config, capsys, monkeypatch):
+        first, final = [json.loads(l) for l in self._run_progressive(
+            make_config, capsys, monkeypatch, progressive_results='yes')]
+        assert first['type'] == 'provisional' and first['detected']
+        assert first['labels'] == ['person'] and first['frame_id'] == 'snapshot'
+        assert first['artifacts'] == {}
+        assert final['type'] == 'result' and final['labels'] == ['person', 'car']
+        assert final['frame_id'] == 'alarm'
+
+    def test_provisional_image_written_before_record(self, tmp_path, make_config, capsys, monkeypatch):
+        cfg = make_config(progressive_results='yes', write_image_to_zm='yes')
+        from zmes_hook_helpers import detect
+        order = []
+        monkeypatch.setattr(_FrameResult, 'image', 'frame', raising=False)
+        monkeypatch.setattr(detect.server, 'get_detector', lambda *a, **kw: _ProgressiveDetector())
+        monkeypatch.setattr(detect, '_encode', lambda res, md: (b'jpg', None))
+        monkeypatch.setattr(detect.jpeg, 'write_objdetect',
+                            lambda path, jpg, md, thumb=None: order.append(('image', md['frame_id'])))
+        print_record = detect._print_record
+        monkeypatch.setattr(detect, '_print_record',
+                            lambda *a, **kw: order.append(('record', kw.get('type'))) or print_record(*a, **kw))
+        detect.main_handler(['-c', cfg, '-e', '7', '-m', '1', '-p', str(tmp_path), '--output-format', 'jsonl'])
+        assert order[:2] == [('image', 'snapshot'), ('record', 'provisional')]
+
+    def test_off_by_default(self, make_config, capsys, monkeypatch):
+        (line,) = self._run_progressive(make_config, capsys, monkeypatch)
+        assert json.loads(line)['type'] == 'result'
+
+    def test_text_format_unchanged(self, make_config, capsys, monkeypatch):
+        (line,) = self._run_progressive(make_config, capsys, monkeypatch, fmt='text',
+                                        progressive_results='yes')
+        assert line.startswith('[a] detected:person,car--SPLIT--')
@@ -0,0 +1,21 @@
+"""Tests for push picture URL templating."""
+from zmes_hook_helpers.push import picture_url
+
+ZMS = 'https://zm/zm/index.php?view=image&eid=EVENTID&fid=objdetect&width=600'
+THUMB = 'https://zm/events/EVENTPATH/objdetect_thumb.jpg'
+
+
+class TestPictureUrl:
+    def test_eventid(self):
+        assert picture_url(ZMS, 12) == 'https://zm/zm/index.php?view=image&eid=12&fid=objdetect&width=600'
+
+    def test_no_match_uses_alarm_frame(self):
+        assert 'fid=alarm' in picture_url(ZMS, 12, no_match=True)
+
+    def test_eventpath(self):
+        assert picture_url(THUMB, 12, event_path='1/2024-01-31/12') == \
+            'https://zm/events/1/2024-01-31/12/objdetect_thumb.jpg'
+
+    def test_eventpath_without_image(self):
+        assert picture_url(THUMB, 12) is None
+        assert picture_url(THUMB, 12, no_match=True, event_path='1/12') is None
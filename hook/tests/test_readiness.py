@@ -0,0 +1,95 @@
+"""Tests for zmes_hook_helpers.readiness (adaptive wait)."""
+import json
+
+import pytest
+
+import zmes_hook_helpers.common_params as g
+from zmes_hook_helpers import readiness, stages
+
+
+class _StreamConfig:
+    def __init__(self, **kw):
+        self.__dict__.update(dict(frame_set=['snapshot', 'alarm'], max_frames=0, start_frame=1, frame_skip=1,
+                                  resize=None, convert_snapshot_to_fid=False, delay=0, max_attempts=3,
+                                  sleep_between_attempts=3), **kw)
+
+    def model_copy(self, update):
+        return _StreamConfig(**dict(self.__dict__, **update))
+
+
+class _Extract:
+    """Serves ``alarm`` from the *ready*-th call on."""
+
+    def __init__(self, ready=1):
+        self.ready = ready
+        self.calls = []
+
+    def __call__(self, event, cfg):
+        self.calls.append((list(cfg.frame_set), cfg.max_attempts))
+        have = ['snapshot'] + (['alarm'] if len(self.calls) >= self.ready else [])
+        return [(f, f.upper()) for f in cfg.frame_set if f in have], {'original': (480, 640), 'resized': None}
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    slept = []
+    monkeypatch.setattr(stages.time, 'sleep', slept.append)
+    return slept
+
+
+class TestPoller:
+    def test_ready_right_away(self, sleeps):
+        extract = _Extract()
+        poller = readiness.Poller(extract, 5)
+        frames, dims = poller(None, _StreamConfig())
+        assert frames == [('snapshot', 'SNAPSHOT'), ('alarm', 'ALARM')]
+        assert dims['original'] == (480, 640)
+        assert poller.polls == 1 and poller.ready_after is not None and sleeps == []
+
+    def test_polls_missing_frames_with_backoff(self, sleeps):
+        extract = _Extract(ready=4)
+        frames, _ = readiness.Poller(extract, 5)(None, _StreamConfig())
+        assert [f for f, _ in frames] == ['snapshot', 'alarm']
+        assert extract.calls == [(['snapshot', 'alarm'], 1), (['alarm'], 1), (['alarm'], 1), (['alarm'], 1)]
+        assert sleeps == [0.25, 0.5, 1.0]
+
+    def test_sleeps_learned_time_first(self, sleeps):
+        extract = _Extract(ready=3)
+        readiness.Poller(extract, 5, expected=2)(None, _StreamConfig())
+        assert sleeps[0] == pytest.approx(1.6, abs=0.05)
+        assert sleeps[1] == 0.25
+
+    def test_ceiling_then_download_with_retries(self, sleeps, monkeypatch):
+        clock = iter(range(100))
+        monkeypatch.setattr(readiness.time, 'perf_counter', lambda: next(clock))
+        extract = _Extract(ready=100)
+        poller = readiness.Poller(extract, 3)
+        frames, _ = poller(None, _StreamConfig())
+        assert [f for f, _ in frames] == ['snapshot']
+        assert poller.ready_after is None
+        assert extract.calls[-1] == (['alarm'], 3)
+        assert [c for c in extract.calls[:-1] if c[1] != 1] == []
+
+    def test_no_frame_set_sleeps_ceiling(self, sleeps):
+        extract = _Extract()
+        readiness.Poller(extract, 4)(None, _StreamConfig(frame_set=[]))
+        assert sleeps == [4] and len(extract.calls) == 1
+
+
+class TestLearn:
+    def test_moving_average_per_monitor(self, tmp_path):
+        g.config = {'base_data_path': str(tmp_path)}
+        (tmp_path / 'misc').mkdir()
+        assert readiness.expected(1) == 0
+        assert readiness.learn(1, 2.0) == 2.0
+        assert readiness.learn(1, 4.0) == pytest.approx(2.6)
+        readiness.learn(2, 1.0)
+        assert readiness.expected(1) == pytest.approx(2.6)
+        with open(tmp_path / 'misc' / 'frame_readiness.json') as f:
+            assert json.load(f)['2'] == {'seconds': 1.0, 'events': 1}
+
+    def test_no_monitor_or_store(self, tmp_path):
+        g.config = {'base_data_path': str(tmp_path / 'missing')}
+        assert readiness.learn(None, 2) == 0
+        assert readiness.learn(1, 2) == 0
+        assert readiness.expected(1) == 0
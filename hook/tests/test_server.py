@@ -0,0 +1,152 @@
+"""Tests for the persistent detection server (zmes_hook_helpers.server)."""
+import os
+import tempfile
+import threading
+import time
+
+import pytest
+
+import zmes_hook_helpers.server as server
+from zmes_hook_helpers.server import DetectorCache, forward, strip_client_args
+
+
+class _Factory:
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, ml_options):
+        self.calls += 1
+        return object()
+
+
+class TestDetectorCache:
+    def test_reuses_detector_for_same_options(self):
+        cache, factory = DetectorCache(2), _Factory()
+        a = cache.get({'general': {'model_sequence': 'object'}}, factory)
+        b = cache.get({'general': {'model_sequence': 'object'}}, factory)
+        assert a is b
+        assert factory.calls == 1
+        assert cache.hits == 1
+
+    def test_key_ignores_dict_order(self):
+        assert DetectorCache.key({'a': 1, 'b': 2}) == DetectorCache.key({'b': 2, 'a': 1})
+
+    def test_lru_eviction(self):
+        cache, factory = DetectorCache(2), _Factory()
+        first = cache.get({'m': 1}, factory)
+        cache.get({'m': 2}, factory)
+        cache.get({'m': 1}, factory)  # touch 1 so 2 becomes least recently used
+        cache.get({'m': 3}, factory)
+        assert len(cache) == 2
+        assert cache.evictions == 1
+        assert cache.get({'m': 1}, factory) is first
+        cache.get({'m': 2}, factory)
+        assert factory.calls == 4
+
+    def test_monitors_share_detector(self):
+        cache, factory = DetectorCache(2), _Factory()
+        a = cache.get({'general': {'model_sequence': 'object', 'monitor_id': '1', 'image_path': '/a'}}, factory)
+        b = cache.get({'general': {'model_sequence': 'object', 'monitor_id': '2', 'image_path': '/b'}}, factory)
+        assert a is b and factory.calls == 1
+
+    def test_scope_sets_monitor(self):
+        class _Config:
+            monitor_id, image_path = '1', '/a'
+        det = type('D', (), {'_config': _Config()})()
+        assert server.scope(det, {'general': {'monitor_id': '2', 'image_path': '/b'}})
+        assert (det._config.monitor_id, det._config.image_path) == ('2', '/b')
+        assert server.scope(det, {'general': {}})
+        assert (det._config.monitor_id, det._config.image_path) == (None, '/b')
+        assert not server.scope(object(), {'general': {'monitor_id': '2'}})
+
+    def test_get_detector_without_server_builds_fresh(self):
+        factory = _Factory()
+        server.get_detector({'m': 1}, factory)
+        server.get_detector({'m': 1}, factory)
+        assert factory.calls == 2
+
+
+class TestClientArgs:
+    def test_strip_socket(self):
+        argv = ['-e', '1', '--socket', '/tmp/s.sock', '-m', '2', '--socket=/x', '--socket-timeout', '3',
+                '--socket-result-timeout=9']
+        assert strip_client_args(argv) == ['-e', '1', '-m', '2']
+
+
+class TestForward:
+    def test_no_server_returns_none(self):
+        assert forward('/nonexistent/zm_detect.sock', ['-e', '1']) is None
+
+    def test_round_trip(self):
+        sock_path = os.path.join(tempfile.mkdtemp(), 'zm_detect.sock')
+        seen = []
+
+        def handler(argv, out):
+            seen.append(argv)
+            return 0, '[a] detected:person:90%--SPLIT--{}\n'
+
+        import socketserver
+        srv = socketserver.UnixStreamServer(sock_path, server._RequestHandler)
+        srv.handler = handler
+        t = threading.Thread(target=srv.serve_forever, daemon=True)
+        t.start()
+        try:
+            code, out = forward(sock_path, ['-e', '5', '--socket', sock_path])
+        finally:
+            srv.shutdown()
+            srv.server_close()
+        assert code == 0
+        assert out.startswith('[a] detected:person')
+        assert seen == [['-e', '5']]
+
+    def test_queue_timeout_and_skipped_request(self):
+        sock_path = os.path.join(tempfile.mkdtemp(), 'zm_detect.sock')
+        seen = []
+        srv = server._Server(sock_path, server._RequestHandler)
+        srv.handler = lambda argv, out: seen.append(argv) or (0, '')
+        try:
+            # the server is busy (not accepting): the client gives up
+            with pytest.raises(server.Unavailable):
+                forward(sock_path, ['-e', '5'], queue_timeout=0.2)
+            srv.handle_request()
+        finally:
+            srv.server_close()
+        assert seen == []
+
+    def test_result_timeout(self):
+        sock_path = os.path.join(tempfile.mkdtemp(), 'zm_detect.sock')
+        srv = server._Server(sock_path, server._RequestHandler)
+        srv.handler = lambda argv, out: time.sleep(0.5) or (0, '')
+        t = threading.Thread(target=srv.serve_forever, daemon=True)
+        t.start()
+        try:
+            with pytest.raises(server.Unavailable):
+                forward(sock_path, ['-e', '5'], queue_timeout=1, result_timeout=0.1)
+        finally:
+            srv.shutdown()
+            srv.server_close()
+
+    def test_lines_streamed_before_the_result(self):
+        sock_path = os.path.join(tempfile.mkdtemp(), 'zm_detect.sock')
+        got = []
+
+        def handler(argv, out):
+            print('{"type": "provisional"}', file=out)
+            time.sleep(0.2)
+            out.write('{"type": "result"}\n{"tail"')
+            return 0, out.getvalue()
+
+        srv = server._Server(sock_path, server._RequestHandler)
+        srv.handler = handler
+        t = threading.Thread(target=srv.serve_forever, daemon=True)
+        t.start()
+        try:
+            code, out = forward(sock_path, ['-e', '5'], on_output=lambda text: got.append((text, time.monotonic())))
+            done = time.monotonic()
+            assert forward(sock_path, ['-e', '5'])[1] == '{"type": "provisional"}\n{"type": "result"}\n{"tail"'
+        finally:
+            srv.shutdown()
+            srv.server_close()
+        assert code == 0 and out == '{"tail"'
+        assert [text for text, _ in got] == ['{"type": "provisional"}\n', '{"type": "result"}\n']
+        assert done - got[0][1] >= 0.15
@@ -0,0 +1,137 @@
+"""Tests for zmes_hook_helpers.shm_frames, against a stand-in shared memory segment."""
+import datetime
+import struct
+
+import numpy as np
+import pytest
+
+from zmes_hook_helpers import frame_sources, shm_frames
+
+cv2 = pytest.importorskip('cv2')
+
+W, H = 64, 48
+NOW = 1700000000.0
+
+
+def _image(value):
+    img = np.zeros((H, W, 3), dtype=np.uint8)
+    img[:, :, 2] = value  # red in BGR, so a channel swap shows
+    return img
+
+
+def _segment(tmp_path, values, stamps, count=8, colours=3, mid=3):
+    images = [_image(v) for v in values]
+    return shm_frames.write_standin(str(tmp_path / 'zm.mmap.{}'.format(mid)), images, stamps,
+                                    count=count, colours=colours)
+
+
+class _Monitor:
+    width, height = W, H
+
+    def __init__(self, colours=3, count=8, pre=0):
+        self._raw = {'Monitor': {'Colours': str(colours), 'ImageBufferCount': str(count), 'PreEventCount': str(pre)}}
+
+    def raw(self):
+        return self._raw
+
+
+class _ZM:
+    def __init__(self, monitor):
+        self._monitor = monitor
+
+    def monitor(self, mid):
+        return self._monitor
+
+
+class _Event:
+    monitor_id = 3
+
+    def __init__(self, start):
+        self.start_time = datetime.datetime.fromtimestamp(start)
+        self.requested = []
+
+    def extract_frames(self, stream_config=None):
+        self.requested.append(list(stream_config.frame_set))
+        return [], {}
+
+
+class _StreamConfig:
+    frame_set = ['snapshot', 'alarm', '1']
+    max_frames, resize, convert_snapshot_to_fid = 0, None, False
+
+    def model_copy(self, update):
+        copy = _StreamConfig()
+        copy.__dict__.update(update)
+        return copy
+
+
+class TestReadFrames:
+    def test_newest_first_since_event_start(self, tmp_path):
+        _segment(tmp_path, [10, 20, 30, 40], [NOW, NOW + 1, NOW + 2, NOW + 3])
+        frames = shm_frames.read_frames(3, W, H, 3, 8, since=NOW + 1, shm_path=str(tmp_path))
+        assert [t for t, _ in frames] == [NOW + 3, NOW + 2, NOW + 1]
+        assert frames[0][1].shape == (H, W, 3)
+        assert frames[0][1][0, 0].tolist() == [0, 0, 40]
+
+    def test_ring_wraps(self, tmp_path):
+        path = _segment(tmp_path, [10, 20, 30, 40], [NOW + 4, NOW + 5, NOW + 2, NOW + 3], count=4)
+        # newest is slot 1; going back: 1, 0, 3, 2
+        with open(path, 'r+b') as f:
+            f.write(struct.pack('@Ii', 760, 1))
+        frames = shm_frames.read_frames(3, W, H, 3, 4, shm_path=str(tmp_path))
+        assert [t for t, _ in frames] == [NOW + 5, NOW + 4, NOW + 3, NOW + 2]
+
+    def test_rgba(self, tmp_path):
+        _segment(tmp_path, [99], [NOW], colours=4)
+        (frame,) = shm_frames.read_frames(3, W, H, 4, 8, shm_path=str(tmp_path))
+        assert frame[1][0, 0].tolist() == [0, 0, 99]
+
+    def test_limit(self, tmp_path):
+        _segment(tmp_path, [10, 20, 30], [NOW, NOW + 1, NOW + 2])
+        assert len(shm_frames.read_frames(3, W, H, 3, 8, limit=1, shm_path=str(tmp_path))) == 1
+
+    def test_geometry_mismatch(self, tmp_path):
+        _segment(tmp_path, [10], [NOW])
+        assert shm_frames.read_frames(3, W * 2, H, 3, 8, shm_path=str(tmp_path)) == []
+        assert shm_frames.read_frames(4, W, H, 3, 8, shm_path=str(tmp_path)) == []
+
+    def test_other_layout_not_used(self, tmp_path):
+        path = _segment(tmp_path, [10], [NOW])
+        with open(path, 'ab') as f:
+            f.write(b'\0' * 256)  # e.g. fields a newer ZM adds after VideoStoreData
+        assert shm_frames.read_frames(3, W, H, 3, 8, shm_path=str(tmp_path)) == []
+
+    def test_geometry(self):
+        assert shm_frames.geometry(_Monitor(colours=4, count=50)) == (W, H, 4, 50)
+        assert shm_frames.geometry({'Monitor': {'Width': '640', 'Height': '480'}}) == (640, 480, 4, 0)
+
+
+class TestFrameSource:
+    def test_snapshot_and_alarm_from_shm(self, tmp_path):
+        _segment(tmp_path, [10, 20, 30, 40], [NOW - 10, NOW + 1, NOW + 2, NOW + 3])
+        ev = _Event(NOW)
+        frames, dims = frame_sources.extract(ev, _StreamConfig(), 'mmap', zm=_ZM(_Monitor()), shm_path=str(tmp_path))
+        assert [(fid, int(img[0, 0, 2])) for fid, img in frames] == [('snapshot', 40), ('alarm', 20)]
+        assert ev.requested == [['1']]
+        assert dims == {'original': (H, W), 'resized': None}
+
+    def test_alarm_skips_pre_event_images(self, tmp_path):
+        _segment(tmp_path, [10, 20, 30, 40], [NOW - 10, NOW + 1, NOW + 2, NOW + 3])
+        ev = _Event(NOW)
+        frames, _ = frame_sources.extract(ev, _StreamConfig(), 'mmap', zm=_ZM(_Monitor(pre=1)),
+                                          shm_path=str(tmp_path))
+        assert [(fid, int(img[0, 0, 2])) for fid, img in frames] == [('snapshot', 40), ('alarm', 30)]
+
+    def test_alarm_left_to_next_source(self, tmp_path):
+        # the event filled the whole ring: its first images are gone
+        _segment(tmp_path, [10, 20, 30, 40], [NOW + 1, NOW + 2, NOW + 3, NOW + 4], count=4)
+        ev = _Event(NOW)
+        frames, _ = frame_sources.extract(ev, _StreamConfig(), 'mmap', zm=_ZM(_Monitor(count=4, pre=1)),
+                                          shm_path=str(tmp_path))
+        assert [fid for fid, _ in frames] == ['snapshot']
+        assert ev.requested == [['alarm', '1']]
+
+    def test_no_segment_downloads(self, tmp_path):
+        ev = _Event(NOW)
+        frame_sources.extract(ev, _StreamConfig(), 'mmap', zm=_ZM(_Monitor()), shm_path=str(tmp_path))
+        assert ev.requested == [['snapshot', 'alarm', '1']]
@@ -0,0 +1,423 @@
+"""Tests for zmes_hook_helpers.stages (stage timing and ZM/model overlap)."""
+import json
+import threading
+import time
+
+import pytest
+
+from zmes_hook_helpers import stages
+
+
+class _Event:
+    def __init__(self):
+        self.extract_calls = 0
+        self.notes = 'Motion: All'
+
+    def extract_frames(self, stream_config=None):
+        self.extract_calls += 1
+        return [('snapshot', 'img')], {'original': (480, 640)}
+
+
+class _ZM:
+    def __init__(self, fail=False):
+        self.event_calls = 0
+        self.fail = fail
+        self.ev = _Event()
+
+    def event(self, eid):
+        self.event_calls += 1
+        if self.fail:
+            raise RuntimeError('boom')
+        return self.ev
+
+    def monitor(self, mid):
+        return 'monitor-{}'.format(mid)
+
+
+class TestStageTimer:
+    def test_records_and_accumulates(self):
+        t = stages.StageTimer()
+        with t.stage('a'):
+            time.sleep(0.01)
+        t.add('a', 0.5)
+        assert t.stages['a'] >= 0.51
+        assert 'a=' in t.summary() and 'total=' in t.summary()
+
+    def test_records_on_exception(self):
+        t = stages.StageTimer()
+        with pytest.raises(ValueError):
+            with t.stage('bad'):
+                raise ValueError()
+        assert 'bad' in t.stages
+
+
+class TestRunParallel:
+    def test_runs_concurrently(self):
+        barrier = threading.Barrier(2, timeout=2)
+        # Both functions must be running at once for the barrier to release
+        a, b = stages.run_parallel(lambda: (barrier.wait(), 'zm')[1], lambda: (barrier.wait(), 'model')[1])
+        assert (a, b) == ('zm', 'model')
+
+    def test_wall_time_is_max_not_sum(self):
+        t0 = time.perf_counter()
+        stages.run_parallel(lambda: time.sleep(0.2), lambda: time.sleep(0.2))
+        assert time.perf_counter() - t0 < 0.35
+
+    def test_reraises(self):
+        def bad():
+            raise RuntimeError('login failed')
+        with pytest.raises(RuntimeError, match='login failed'):
+            stages.run_parallel(bad, lambda: 1)
+
+
+class TestPreload:
+    def test_calls_ensure_pipeline(self):
+        class D:
+            loaded = False
+            def _ensure_pipeline(self):
+                self.loaded = True
+        d = D()
+        stages.preload(d)
+        assert d.loaded
+
+    def test_tolerates_missing_hook(self):
+        stages.preload(object())
+
+    def test_lazy_loads_only_ungated_types(self):
+        class MC:
+            def __init__(self, type, pre=None, name=None):
+                self.type, self.pre_existing_labels, self.name, self.framework = type, pre, name, 'x'
+
+        class Backend:
+            def __init__(self, fail=False):
+                self.is_loaded, self.fail = False, fail
+            def load(self):
+                if self.fail:
+                    raise RuntimeError('no weights')
+                self.is_loaded = True
+
+        obj, face, alpr, broken = Backend(), Backend(), Backend(), Backend(fail=True)
+        pipeline = type('P', (), {})()
+        pipeline._backends = [(MC('object'), obj), (MC('face', ['person']), face),
+                              (MC('alpr', ['car']), alpr), (MC('object', name='tiny'), broken)]
+
+        class D:
+            lazy = None
+            def _ensure_pipeline(self, lazy=False):
+                self.lazy = lazy
+                return pipeline
+
+        d = D()
+        stages.preload(d, lazy=True)
+        assert d.lazy is True
+        assert obj.is_loaded and not face.is_loaded and not alpr.is_loaded
+        assert [b for _, b in pipeline._backends] == [obj, face, alpr]
+
+
+    def test_lazy_with_old_pyzm_loads_all(self):
+        class D:
+            calls = 0
+            def _ensure_pipeline(self):
+                self.calls += 1
+        d, log = D(), _Log()
+        stages.preload(d, lazy=True, logger=log)
+        assert d.calls == 1 and 'lazy_model_load' in log.warnings[0]
+
+    def test_lazy_without_backends_loads_pipeline(self):
+        class P:
+            loaded = False
+            def load(self):
+                self.loaded = True
+        p, log = P(), _Log()
+        d = type('D', (), {'_ensure_pipeline': lambda self, lazy=False: p})()
+        stages.preload(d, lazy=True, logger=log)
+        assert p.loaded and '_backends' in log.warnings[0]
+
+
+class _Log:
+    def __init__(self):
+        self.warnings, self.debug = [], []
+
+    def Warning(self, msg):
+        self.warnings.append(msg)
+
+    def Debug(self, level, msg):
+        self.debug.append(msg)
+
+    def Error(self, msg):
+        self.warnings.append(msg)
+
+
+class TestPrefetchEvent:
+    def test_frames_reused_by_detector(self):
+        zm, sc = _ZM(), object()
+        proxy = stages.prefetch_event(zm, '12', sc)
+        assert zm.event_calls == 1 and zm.ev.extract_calls == 1
+        # what Detector.detect_event does
+        ev = proxy.event(12)
+        assert ev.extract_frames(stream_config=sc)[0] == [('snapshot', 'img')]
+        assert ev.extract_frames(stream_config=sc)[0] == [('snapshot', 'img')]
+        assert zm.event_calls == 1 and zm.ev.extract_calls == 1
+        assert ev.notes == 'Motion: All'
+        assert proxy.monitor(3) == 'monitor-3'
+
+    def test_other_stream_config_fetches(self):
+        zm, sc = _ZM(), object()
+        ev = stages.prefetch_event(zm, 12, sc).event(12)
+        ev.extract_frames(stream_config=object())
+        assert zm.ev.extract_calls == 2
+
+    def test_without_frames(self):
+        zm = _ZM()
+        proxy = stages.prefetch_event(zm, 12, object(), frames=False)
+        assert zm.ev.extract_calls == 0
+        assert proxy.event(12) is zm.ev
+
+    def test_other_event_id_passes_through(self):
+        zm = _ZM()
+        proxy = stages.prefetch_event(zm, 12, object(), frames=False)
+        proxy.event(13)
+        assert zm.event_calls == 2
+
+    def test_custom_extract(self):
+        zm, sc = _ZM(), object()
+        ev = stages.prefetch_event(zm, 12, sc, extract=lambda e, c: ([('alarm', 'local')], {})).event(12)
+        assert ev.extract_frames(stream_config=sc)[0] == [('alarm', 'local')]
+        assert zm.ev.extract_calls == 0
+
+    def test_failure_returns_client(self):
+        zm = _ZM(fail=True)
+        assert stages.prefetch_event(zm, 12, object()) is zm
+
+
+class _Result:
+    def __init__(self, labels):
+        self.labels = labels
+        self.matched = bool(labels)
+        self.frame_id = None
+
+    def to_dict(self):
+        n = len(self.labels)
+        return {'labels': self.labels, 'boxes': [[0, 0, 1, 1]] * n, 'confidences': [0.9] * n,
+                'model_names': ['yolo'] * n, 'frame_id': self.frame_id, 'image_dimensions': None}
+
+
+class _Pipeline:
+    """Per-frame results keyed by image; like ModelPipeline.run after zone/pattern filtering."""
+    _backends = []
+
+    def __init__(self, results):
+        self.results = results
+
+    def run(self, image, zones=None, original_shape=None):
+        return _Result(self.results[image])
+
+
+class _Detector:
+    """Mimics pyzm's Detector: every frame through the pipeline, best picked at the end."""
+
+    def __init__(self, results):
+        self.pipeline = _Pipeline(results)
+        self.seen = []
+
+    def _detect_multi_frame(self, frames, zones, pipeline, original_shape=None):
+        best = None
+        for frame_id, image in frames:
+            self.seen.append(frame_id)
+            result = pipeline.run(image, zones=zones, original_shape=original_shape)
+            result.frame_id = frame_id
+            if best is None or len(result.labels) > len(best.labels):
+                best = result
+        return best
+
+    def detect_event(self, frames):
+        return self._detect_multi_frame(frames, None, self.pipeline)
+
+
+class TestWatchMatches:
+    def test_first_match_reported_before_the_end(self):
+        d = _Detector({'a': [], 'b': ['person'], 'c': ['person', 'car']})
+        early = []
+        with stages.watch_matches(d, lambda r: early.append((r.frame_id, r.labels, list(d.seen)))):
+            best = d.detect_event([('snapshot', 'a'), ('alarm', 'b'), ('7', 'c')])
+        assert early == [('alarm', ['person'], ['snapshot', 'alarm'])]
+        assert best.frame_id == '7' and best.labels == ['person', 'car']
+        assert '_detect_multi_frame' not in vars(d)
+
+    def test_no_match_no_call(self):
+        d = _Detector({'a': []})
+        early = []
+        with stages.watch_matches(d, early.append):
+            d.detect_event([('snapshot', 'a')])
+        assert early == []
+
+    def test_callback_errors_dont_stop_detection(self):
+        d = _Detector({'a': ['person']})
+
+        def boom(result):
+            raise RuntimeError('boom')
+
+        with stages.watch_matches(d, boom):
+            assert d.detect_event([('snapshot', 'a')]).labels == ['person']
+
+    def test_detector_without_multi_frame(self):
+        log = _Log()
+        with stages.watch_matches(object(), lambda r: None, log):
+            pass
+        assert 'no _detect_multi_frame' in log.warnings[0]
+
+
+class TestDeadline:
+    def test_no_limit(self):
+        d = stages.Deadline(0)
+        assert d.remaining() == float('inf') and not d.expired()
+        d.sleep(0.01, 'wait')
+        assert d.cut is None
+
+    def test_sleep_stops_at_deadline(self):
+        d = stages.Deadline(0.05)
+        start = time.perf_counter()
+        d.sleep(5, 'wait')
+        assert time.perf_counter() - start < 1
+        assert d.expired() and d.cut == 'wait'
+
+    def test_first_cut_is_kept(self):
+        d = stages.Deadline(1)
+        d.mark('frames')
+        d.mark('model:yolo')
+        assert d.cut == 'frames'
+
+
+class _StreamConfig:
+    def __init__(self, **kw):
+        self.__dict__.update(dict(delay=0, max_attempts=1, sleep_between_attempts=3), **kw)
+
+    def model_copy(self, update):
+        return _StreamConfig(**dict(self.__dict__, **update))
+
+
+class TestFitRetries:
+    def test_retries_cut_to_what_is_left(self):
+        cfg = _StreamConfig(delay=20, max_attempts=5, sleep_between_attempts=3)
+        fitted = stages.fit_retries(cfg, stages.Deadline(7))
+        assert (fitted.delay, fitted.max_attempts) == (6, 3)
+        assert cfg.max_attempts == 5
+
+    def test_unchanged_when_it_fits(self):
+        cfg = _StreamConfig(max_attempts=3, sleep_between_attempts=1)
+        assert stages.fit_retries(cfg, stages.Deadline(10)) is cfg
+        assert stages.fit_retries(cfg, stages.Deadline(0)) is cfg
+
+
+class _Backend:
+    def __init__(self, labels, delay=0):
+        self.labels, self.delay, self.calls = labels, delay, 0
+
+    def detect(self, image):
+        self.calls += 1
+        time.sleep(self.delay)
+        return list(self.labels)
+
+
+class _ModelPipeline:
+    """Every backend on every frame, like ModelPipeline.run with union matching."""
+
+    def __init__(self, backends):
+        self._backends = backends
+
+    def run(self, image, zones=None, original_shape=None):
+        return _Result([l for _, b in self._backends for l in b.detect(image)])
+
+
+class _Model:
+    def __init__(self, name):
+        self.name, self.framework = name, 'opencv'
+
+
+class TestBudget:
+    def _detector(self, yolo, alpr):
+        d = _Detector({})
+        d.pipeline = _ModelPipeline([(_Model('yolo'), yolo), (_Model('alpr'), alpr)])
+        d._ensure_pipeline = lambda: d.pipeline
+        return d
+
+    def test_best_so_far_when_time_runs_out(self):
+        yolo, alpr = _Backend(['person'], delay=0.1), _Backend(['plate'])
+        d = self._detector(yolo, alpr)
+        originals = list(d.pipeline._backends)
+        deadline = stages.Deadline(0.05)
+        with stages.budget(d, deadline):
+            best = d.detect_event([('snapshot', 'a'), ('alarm', 'b'), ('3', 'c')])
+        # the first frame gets every model, the rest none
+        assert best.labels == ['person', 'plate'] and d.seen == ['snapshot']
+        assert (yolo.calls, alpr.calls) == (1, 1)
+        assert deadline.cut == 'detect'
+        assert d.pipeline._backends == originals
+        assert '_detect_multi_frame' not in vars(d)
+
+    def test_models_skipped_after_first_frame(self):
+        yolo, alpr = _Backend(['person'], delay=0.04), _Backend(['plate'])
+        d = self._detector(yolo, alpr)
+        deadline = stages.Deadline(0.06)
+        with stages.budget(d, deadline):
+            d.detect_event([('snapshot', 'a'), ('alarm', 'b'), ('3', 'c')])
+        assert d.seen == ['snapshot', 'alarm']
+        assert (yolo.calls, alpr.calls) == (2, 1)
+        assert deadline.cut == 'model:alpr'
+
+    def test_expired_before_detection_still_detects(self):
+        yolo = _Backend(['person'])
+        d = self._detector(yolo, _Backend([]))
+        deadline = stages.Deadline(0.01)
+        time.sleep(0.02)
+        with stages.budget(d, deadline):
+            best = d.detect_event([('snapshot', 'a'), ('alarm', 'b')])
+        assert best.labels == ['person'] and d.seen == ['snapshot']
+        assert deadline.cut == 'detect' and yolo.calls == 1
+
+    def test_no_effect_in_time(self):
+        d = self._detector(_Backend(['person']), _Backend(['plate']))
+        deadline = stages.Deadline(60)
+        with stages.budget(d, deadline):
+            best = d.detect_event([('snapshot', 'a'), ('alarm', 'b')])
+        assert best.labels == ['person', 'plate'] and d.seen == ['snapshot', 'alarm']
+        assert deadline.cut is None
+
+    def test_old_pyzm_logged_and_unbudgeted(self):
+        log = _Log()
+        d = _Detector({'a': ['person']})
+        with stages.budget(d, stages.Deadline(0.01), log):
+            assert d.detect_event([('snapshot', 'a')]).labels == ['person']
+        assert '_ensure_pipeline' in log.warnings[0] and '_detect_multi_frame' not in log.warnings[0]
+
+
+class _EventDetector(_Detector):
+    """_Detector as zm_detect calls it: 'snapshot' finds a person, 'alarm' a person and a car."""
+
+    def __init__(self):
+        super().__init__({'a': ['person'], 'b': ['person', 'car']})
+
+    def detect_event(self, zm, eid, zones=None, stream_config=None):
+        return self._detect_multi_frame([('snapshot', 'a'), ('alarm', 'b')], zones, self.pipeline)
+
+
+class TestMaxEventLatency:
+    def _run(self, make_config, capsys, monkeypatch, **general):
+        cfg = make_config(**general)
+        from zmes_hook_helpers import detect
+        monkeypatch.setattr(detect.server, 'get_detector', lambda *a, **kw: _EventDetector())
+        detect.main_handler(['-c', cfg, '-e', '7', '-m', '1', '--output-format', 'jsonl'])
+        (line,) = capsys.readouterr().out.splitlines()
+        return json.loads(line)
+
+    def test_cut_stage_recorded(self, make_config, capsys, monkeypatch):
+        start = time.perf_counter()
+        rec = self._run(make_config, capsys, monkeypatch, wait='5', max_event_latency='0.2')
+        assert time.perf_counter() - start < 4
+        # the deadline was gone before detection: the first frame is still analysed
+        assert rec['cut_stage'] == 'wait' and rec['detected'] is True
+        assert rec['labels'] == ['person'] and rec['frame_id'] == 'snapshot'
+
+    def test_no_cut_in_time(self, make_config, capsys, monkeypatch):
+        rec = self._run(make_config, capsys, monkeypatch, max_event_latency='60')
+        assert rec['labels'] == ['person', 'car'] and 'cut_stage' not in rec
@@ -130,6 +130,77 @@ class TestProcessConfig:
         assert g.config.get("ml_password") == "mlpass"
 
 
+class TestMonitorsDir:
+    """Per-monitor YAML files in general.monitors_dir."""
+
+    @pytest.fixture
+    def split_config(self, patched_config, tmp_path):
+        with open(patched_config) as f:
+            data = yaml.safe_load(f)
+        data["general"]["monitors_dir"] = str(tmp_path / "monitors.d")
+        (tmp_path / "monitors.d").mkdir()
+        path = tmp_path / "objectconfig.yml"
+        path.write_text(yaml.dump(data))
+        return path, tmp_path / "monitors.d"
+
+    def test_fragment_only(self, split_config, ctx):
+        cfg, mdir = split_config
+        (mdir / "7.yml").write_text(
+            "poly_thickness: 9\n"
+            "zones:\n  porch:\n    coords: 0,0 10,0 10,10 0,10\n    detection_pattern: person\n"
+            "ml_sequence:\n  object:\n    general:\n      pattern: (dog)\n")
+        process_config({"config": str(cfg), "monitorid": "7"}, ctx)
+        assert g.config["poly_thickness"] == 9
+        assert g.polygons == [{"name": "porch", "value": [(0, 0), (10, 0), (10, 10), (0, 10)],
+                               "pattern": "person", "ignore_pattern": None}]
+        # deep-merged, not replaced
+        assert g.config["ml_sequence"]["object"]["general"]["pattern"] == "(dog)"
+        assert g.config["ml_sequence"]["general"]["model_sequence"] == "object"
+
+    def test_fragment_merges_over_inline(self, split_config, ctx):
+        cfg, mdir = split_config
+        (mdir / "1.yml").write_text("poly_thickness: 6\n")
+        process_config({"config": str(cfg), "monitorid": "1"}, ctx)
+        assert g.config["poly_thickness"] == 6
+        assert "front_yard" in [p["name"] for p in g.polygons]
+
+    def test_other_fragments_not_read(self, split_config, ctx):
+        cfg, mdir = split_config
+        (mdir / "8.yml").write_text(": not valid yaml : [")
+        process_config({"config": str(cfg), "monitorid": "1"}, ctx)
+        assert g.config["poly_thickness"] == 4
+
+    def test_fragment_secrets_resolved(self, split_config, ctx):
+        cfg, mdir = split_config
+        (mdir / "7.yml").write_text("ml_user: \"!ML_USER\"\n")
+        process_config({"config": str(cfg), "monitorid": "7"}, ctx)
+        assert g.config["ml_user"] == "mluser"
+
+    @pytest.mark.parametrize("form", ["${base_data_path}", "{{base_data_path}}"])
+    def test_base_data_path_substituted(self, split_config, ctx, tmp_path, form):
+        cfg, _ = split_config
+        data = yaml.safe_load(cfg.read_text())
+        data["general"].update(base_data_path=str(tmp_path), monitors_dir=form + "/per_monitor")
+        cfg.write_text(yaml.dump(data))
+        (tmp_path / "per_monitor").mkdir()
+        (tmp_path / "per_monitor" / "7.yml").write_text("poly_thickness: 5\n")
+        process_config({"config": str(cfg), "monitorid": "7"}, ctx)
+        assert g.config["poly_thickness"] == 5
+
+    def test_new_fragment_invalidates_compiled_cache(self, split_config, ctx, config_cache_dir):
+        cfg, mdir = split_config
+        data = yaml.safe_load(cfg.read_text())
+        data["general"]["config_cache"] = "yes"
+        cfg.write_text(yaml.dump(data))
+        process_config({"config": str(cfg), "monitorid": "7"}, ctx)
+        assert len(os.listdir(config_cache_dir)) == 1
+        assert g.config["poly_thickness"] == 2
+        (mdir / "7.yml").write_text("poly_thickness: 3\n")
+        g.config = {}
+        process_config({"config": str(cfg), "monitorid": "7"}, ctx)
+        assert g.config["poly_thickness"] == 3
+
+
 class TestRecursiveSecretResolution:
     """Verify that secrets inside ml_sequence/stream_sequence are resolved."""
 
@@ -0,0 +1,261 @@
+"""Tests for the writeback journal and detach_writeback."""
+import fcntl
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import numpy as np
+import pytest
+
+import zmes_hook_helpers.common_params as g
+from zmes_hook_helpers import writeback
+
+
+def _args(eid='7', **kw):
+    args = {'config': '/etc/zm/objectconfig.yml', 'eventid': eid, 'monitorid': '1', 'notes': True}
+    args.update(kw)
+    return args
+
+
+def _dead_pid():
+    p = subprocess.Popen([sys.executable, '-c', 'pass'])
+    p.wait()
+    return p.pid
+
+
+class TestJournal:
+    def test_submit_and_claim(self, tmp_path):
+        image = np.zeros((4, 4, 3), dtype=np.uint8)
+        path = writeback.submit(_args(), 'person:97%', {'labels': ['person'], 'image': image,
+                                                        'confidences': [np.float32(0.97)]},
+                                jpg=b'\xff\xd8jpeg', d=str(tmp_path))
+        assert path.endswith('.job')
+        assert writeback.pending(str(tmp_path)) == [os.path.basename(path)]
+
+        claimed = writeback.claim(str(tmp_path))
+        assert claimed.endswith('.run-{}'.format(os.getpid()))
+        assert writeback.pending(str(tmp_path)) == []
+        job = writeback.load_job(claimed)
+        assert job['pred'] == 'person:97%'
+        assert 'image' not in job['matched_data']
+        assert job['matched_data']['confidences'] == [pytest.approx(0.97)]
+        assert writeback.load_jpg(claimed) == b'\xff\xd8jpeg'
+
+    def test_no_image(self, tmp_path):
+        path = writeback.submit(_args(), 'x', {}, d=str(tmp_path))
+        assert writeback.load_jpg(path) is None
+
+    def test_oldest_first(self, tmp_path):
+        first = writeback.submit(_args('1'), 'a', {}, d=str(tmp_path))
+        writeback.submit(_args('2'), 'b', {}, d=str(tmp_path))
+        assert writeback.claim(str(tmp_path)).startswith(first[:-len('.job')])
+
+
+class TestRecover:
+    def test_requeues_dead_worker(self, tmp_path):
+        path = writeback.submit(_args(), 'x', {}, d=str(tmp_path))
+        os.rename(path, path[:-len('.job')] + '.run-{}'.format(_dead_pid()))
+        assert writeback.recover(str(tmp_path)) == 1
+        (name,) = writeback.pending(str(tmp_path))
+        assert writeback.load_job(os.path.join(str(tmp_path), name))['attempts'] == 1
+
+    def test_leaves_live_worker(self, tmp_path):
+        writeback.submit(_args(), 'x', {}, d=str(tmp_path))
+        writeback.claim(str(tmp_path))
+        assert writeback.recover(str(tmp_path)) == 0
+        assert writeback.pending(str(tmp_path)) == []
+
+    def test_drops_after_max_attempts(self, tmp_path):
+        path = writeback.submit(_args(), 'x', {}, d=str(tmp_path))
+        job = writeback.load_job(path)
+        job['attempts'] = writeback._MAX_ATTEMPTS - 1
+        writeback._write_job(path, job)
+        run = path[:-len('.job')] + '.run-{}'.format(_dead_pid())
+        os.rename(path, run)
+        assert writeback.recover(str(tmp_path)) == 0
+        assert not os.path.exists(run)
+
+    def test_removes_half_written(self, tmp_path):
+        tmp = tmp_path / '1-7.tmp-{}'.format(_dead_pid())
+        tmp.mkdir()
+        writeback.recover(str(tmp_path))
+        assert not tmp.exists()
+
+
+class TestWork:
+    def test_runs_all_jobs(self, tmp_path):
+        for eid in ('1', '2', '3'):
+            writeback.submit(_args(eid), 'x', {}, d=str(tmp_path))
+        seen = []
+        assert writeback.work(lambda path, job: seen.append(job['args']['eventid']), d=str(tmp_path)) == 3
+        assert seen == ['1', '2', '3']
+        assert [n for n in os.listdir(tmp_path) if not n.startswith('slot-')] == []
+
+    def test_failed_job_does_not_stop_queue(self, tmp_path):
+        writeback.submit(_args('1'), 'x', {}, d=str(tmp_path))
+        writeback.submit(_args('2'), 'x', {}, d=str(tmp_path))
+        seen = []
+
+        def handler(path, job):
+            seen.append(job['args']['eventid'])
+            raise RuntimeError('ZM down')
+
+        assert writeback.work(handler, d=str(tmp_path)) == 2
+        assert seen == ['1', '2']
+        assert writeback.pending(str(tmp_path)) == []
+
+    def test_bounded_by_slots(self, tmp_path):
+        writeback.submit(_args(), 'x', {}, d=str(tmp_path))
+        held = []
+        for i in range(2):
+            fd = os.open(str(tmp_path / 'slot-{}.lock'.format(i)), os.O_RDWR | os.O_CREAT)
+            # flock is per open file description, so this blocks our own worker too
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            held.append(fd)
+        try:
+            assert writeback.work(lambda p, j: None, workers=2, d=str(tmp_path)) == 0
+            assert len(writeback.pending(str(tmp_path))) == 1
+            assert writeback.work(lambda p, j: None, workers=3, d=str(tmp_path)) == 1
+        finally:
+            for fd in held:
+                os.close(fd)
+
+
+class TestRun:
+    def test_notes_tag_and_push(self, tmp_path, monkeypatch):
+        g.config = {'tag_detected_objects': 'yes', 'write_image_to_zm': 'yes', 'write_debug_image': 'yes',
+                    'image_path': str(tmp_path)}
+        calls = []
+
+        class Ev:
+            notes = 'Motion: Front'
+            def path(self): return str(tmp_path / 'event')
+            def update_notes(self, notes): calls.append(notes)
+            def tag(self, labels): calls.append(labels)
+
+        class ZM:
+            def event(self, eid): return Ev()
+
+        monkeypatch.setattr(writeback, 'try_push', lambda zm, args, cause, **kw: calls.append(('push', cause)))
+        writeback.run(ZM(), _args(), '[a] person:97%', {'labels': ['person'], 'frame_id': 1}, jpg=b'JPG')
+        assert sorted(map(str, calls)) == sorted(map(str, ['[a] person:97%| Motion: Front', ['person'],
+                                                          ('push', '[a] person:97%')]))
+        # the same bytes go to both destinations
+        assert (tmp_path / 'event' / 'objdetect.jpg').read_bytes() == b'JPG'
+        assert (tmp_path / '7-1-debug.jpg').read_bytes() == b'JPG'
+        with open(tmp_path / 'event' / 'objects.json') as f:
+            assert json.load(f) == {'labels': ['person'], 'frame_id': 1}
+
+    def test_event_fetched_once(self, monkeypatch):
+        g.config = {'tag_detected_objects': 'yes'}
+        fetched = []
+
+        class ZM:
+            def event(self, eid):
+                fetched.append(eid)
+                return type('E', (), {'notes': '', 'update_notes': lambda s, n: None, 'tag': lambda s, l: None})()
+
+        monkeypatch.setattr(writeback, 'try_push', lambda *a, **kw: None)
+        timer = writeback.run(ZM(), _args(), 'x', {'labels': ['person']})
+        assert fetched == [7]
+        assert {'event', 'notes', 'tag', 'push'} <= set(timer.stages)
+
+    def test_slow_notes_do_not_delay_push(self, monkeypatch):
+        g.config = {}
+        notes_started, push_done = threading.Event(), threading.Event()
+
+        class Ev:
+            notes = ''
+            def update_notes(self, notes):
+                notes_started.set()
+                assert push_done.wait(5)
+
+        monkeypatch.setattr(writeback, 'try_push', lambda *a, **kw: notes_started.wait(5) and push_done.set())
+        timer = writeback.run(None, _args(), 'x', {'labels': ['person']}, ev=Ev())
+        assert push_done.is_set()
+        assert set(timer.stages) == {'notes', 'push'}
+
+    def test_push_with_picture_waits_for_image(self, tmp_path, monkeypatch):
+        g.config = {'write_image_to_zm': 'yes', 'push': {'include_picture': 'yes'}}
+        events = []
+        real_write = writeback.jpeg.write_objdetect
+
+        def slow_write(*a, **kw):
+            time.sleep(0.2)
+            events.append('image')
+            return real_write(*a, **kw)
+
+        monkeypatch.setattr(writeback.jpeg, 'write_objdetect', slow_write)
+        monkeypatch.setattr(writeback, 'try_push',
+                            lambda zm, args, cause, no_match=False, event_path=None: events.append(('push', event_path)))
+        path = tmp_path / '1' / '2024-01-31' / '7'
+        writeback.run(None, _args(eventpath=str(path)), 'x', {'labels': ['person']}, jpg=b'J', thumb=b'T')
+        assert events == ['image', ('push', '1/2024-01-31/7')]
+        assert (path / 'objdetect_thumb.jpg').read_bytes() == b'T'
+
+    def test_failing_step_is_isolated(self, monkeypatch):
+        g.config = {'tag_detected_objects': 'yes'}
+        tagged = []
+
+        class Ev:
+            notes = ''
+            def update_notes(self, notes): raise RuntimeError('ZM notes API down')
+            def tag(self, labels): tagged.append(labels)
+
+        monkeypatch.setattr(writeback, 'try_push', lambda *a, **kw: tagged.append('push'))
+        writeback.run(None, _args(), 'x', {'labels': ['person']}, ev=Ev())
+        assert sorted(map(str, tagged)) == ["['person']", 'push']
+
+    def test_no_match_only_pushes(self, monkeypatch):
+        pushed = []
+        monkeypatch.setattr(writeback, 'try_push', lambda zm, args, cause, no_match=False, **kw: pushed.append(no_match))
+        writeback.run(None, _args(reason='Motion: All'), '', {}, no_match=True)
+        writeback.run(None, _args(), '', {}, no_match=True, es_mute='es_rules')
+        assert pushed == [True]
+
+
+class TestDetachedMainHandler:
+    def test_prints_then_queues(self, tmp_path, make_config, capsys, monkeypatch):
+        cfg = make_config(detach_writeback='yes', write_image_to_zm='yes')
+        from zmes_hook_helpers import detect
+        spawned = []
+        monkeypatch.setattr(writeback, 'spawn_worker', lambda command, config: spawned.append((command, config)))
+        detect.main_handler(['-c', cfg, '-e', '7', '-m', '1', '-n', '--fakeit', 'person'])
+        assert 'person' in capsys.readouterr().out
+        assert spawned == [([sys.executable, '-m', 'zmes_hook_helpers.detect'], cfg)]
+        d = str(tmp_path / 'misc' / 'writeback')
+        (name,) = writeback.pending(d)
+        job = writeback.load_job(os.path.join(d, name))
+        assert job['args']['eventid'] == '7' and job['matched_data']['labels'] == ['person']
+
+        # the worker replays it against ZM
+        notes = []
+        monkeypatch.setattr(sys.modules['pyzm'].ZMClient, 'event',
+                            lambda self, eid: type('E', (), {'notes': '', 'update_notes': lambda s, n: notes.append(n),
+                                                             'tag': lambda s, l: None})())
+        detect.main_handler(['-c', cfg, '--writeback-worker'])
+        assert notes and 'person' in notes[0]
+        assert writeback.pending(d) == []
+
+    def test_animation_always_queued(self, tmp_path, make_config, capsys, monkeypatch):
+        cfg = make_config(create_animation='yes')
+        from zmes_hook_helpers import detect
+        monkeypatch.setattr(writeback, 'spawn_worker', lambda command, config: None)
+        monkeypatch.setattr(sys.modules['pyzm'].ZMClient, 'event',
+                            lambda self, eid: type('E', (), {'notes': '', 'update_notes': lambda s, n: None,
+                                                             'tag': lambda s, l: None})())
+        detect.main_handler(['-c', cfg, '-e', '7', '-m', '1', '--fakeit', 'person'])
+        assert 'person' in capsys.readouterr().out
+        d = str(tmp_path / 'misc' / 'writeback')
+        (name,) = writeback.pending(d)
+        job = writeback.load_job(os.path.join(d, name))
+        assert job['animation_only'] and job['animation']
+
+        made, ran = [], []
+        monkeypatch.setattr(detect.animation, 'create', lambda zm, args, md: made.append(md['labels']))
+        monkeypatch.setattr(writeback, 'run', lambda *a, **kw: ran.append(a))
+        detect.main_handler(['-c', cfg, '--writeback-worker'])
+        assert made == [['person']] and ran == []
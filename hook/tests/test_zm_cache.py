@@ -0,0 +1,84 @@
+"""Tests for the per-invocation ZM API cache."""
+from zmes_hook_helpers import zm_cache
+
+API = 'https://zm/zm/api'
+
+
+class FakeAPI:
+    api_url = API
+
+    def __init__(self):
+        self.sent = []
+
+    def request(self, url, method='get', params=None, payload=None, reauth=True):
+        self.sent.append((method, url))
+        return {'n': len(self.sent)}
+
+    def get(self, endpoint, params=None):
+        return self.request('{}/{}'.format(API, endpoint), params=params)
+
+    def put(self, endpoint, data=None):
+        return self.request('{}/{}'.format(API, endpoint), method='put', payload=data)
+
+
+class FakeZM:
+    def __init__(self):
+        self.api = FakeAPI()
+
+
+class TestCallCache:
+    def test_repeat_gets_served_from_cache(self):
+        zm = FakeZM()
+        calls = zm_cache.attach(zm)
+        zm_cache.settle(zm)
+        first = zm.api.get('events/7.json')
+        assert zm.api.get('events/7.json') is first
+        zm.api.get('monitors.json')
+        zm.api.get('monitors.json')
+        assert len(zm.api.sent) == 2
+        assert calls.api_calls() == 2
+        assert sum(calls.hits.values()) == 2
+
+    def test_event_not_cached_until_settled(self):
+        zm = FakeZM()
+        calls = zm_cache.attach(zm)
+        zm.api.get('events/7.json')
+        assert zm.api.get('events/7.json') == {'n': 2}
+        zm_cache.settle(zm)
+        assert zm.api.get('events/7.json') is zm.api.get('events/7.json')
+        assert calls.calls == {'GET events': 3}
+
+    def test_write_drops_same_kind(self):
+        zm = FakeZM()
+        calls = zm_cache.attach(zm)
+        zm_cache.settle(zm)
+        zm.api.get('events/7.json')
+        zm.api.get('notifications.json')
+        zm.api.put('events/7.json', {'Event[Notes]': 'x'})
+        zm.api.get('events/7.json')
+        zm.api.get('notifications.json')
+        assert calls.calls == {'GET events': 2, 'PUT events': 1, 'GET notifications': 1}
+
+    def test_not_cached(self):
+        zm = FakeZM()
+        calls = zm_cache.attach(zm)
+        zm.api.get('frames/index/EventId:7.json')
+        zm.api.get('frames/index/EventId:7.json')
+        zm.api.get('events/7.json', params={'x': '1'})
+        zm.api.get('events/7.json', params={'x': '1'})
+        zm.api.request('https://zm/zm/index.php?view=image&eid=7&fid=1')
+        assert calls.calls == {'GET frames': 2, 'GET events': 2, 'GET portal': 1}
+        assert calls.api_calls() == 4
+        assert calls.summary().endswith('portal requests: 1')
+
+    def test_attach_is_idempotent(self):
+        zm = FakeZM()
+        calls = zm_cache.attach(zm)
+        assert zm_cache.attach(zm) is calls
+        assert zm_cache.of(zm) is calls
+        zm.api.get('monitors.json')
+        assert len(zm.api.sent) == 1
+
+    def test_no_api(self):
+        assert zm_cache.attach(None) is None
+        assert zm_cache.of(type('ZM', (), {'api': None})()) is None
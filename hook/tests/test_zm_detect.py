@@ -76,3 +76,40 @@ class TestMainHandlerArgs:
         finally:
             sys.argv = old_argv
             os.unlink(config_file)
+
+    def test_serve_request_captures_output(self):
+        """Server-side handler captures stdout and the exit code of one invocation."""
+        from zmes_hook_helpers.detect import _serve_request
+        code, out = _serve_request(['--bareversion'])
+        assert code == 0
+        assert out.strip() and 'app:' not in out
+
+    def test_import_profile_flag(self, capsys):
+        """--import-profile prints per-module import times and exits."""
+        old_argv = sys.argv
+        sys.argv = ['zm_detect.py', '--import-profile']
+        try:
+            main_handler = self._import_main_handler()
+            with pytest.raises(SystemExit) as exc_info:
+                main_handler()
+            assert exc_info.value.code == 0
+            out = capsys.readouterr().out
+            assert 'cv2' in out
+            assert out.strip().splitlines()[-1].startswith('total')
+        finally:
+            sys.argv = old_argv
+
+    def test_version_does_not_import_cv2(self, capsys):
+        """The version fast path must not pull in OpenCV."""
+        saved = sys.modules.pop('cv2', None)
+        old_argv = sys.argv
+        sys.argv = ['zm_detect.py', '--bareversion']
+        try:
+            main_handler = self._import_main_handler()
+            with pytest.raises(SystemExit):
+                main_handler()
+            assert 'cv2' not in sys.modules
+        finally:
+            sys.argv = old_argv
+            if saved is not None:
+                sys.modules['cv2'] = saved
@@ -9,233 +9,22 @@
 #      Configure in ZM Options -> Config -> EventStartCommand:
 #        /path/to/zm_detect.py -c /path/to/config.yml -e %EID% -m %MID% -r "%EC%" -n
 #      ZM substitutes %EID%, %MID%, %EC% tokens at runtime (same as zmfilter.pl).
+#
+# Persistent server: `zm_detect.py --serve --socket <path>` keeps models warm
+# between events. Any invocation with `--socket <path>` is forwarded to that
+# server and prints the same output; it falls back to running in-process when
+# no server is listening.
+#
+# The code is in zmes_hook_helpers.detect, so the zm_detect_hook entry point
+# runs the installed package rather than this file.
 
-import argparse, ast, os, ssl, sys, time, traceback
-
-import cv2
-
-from pyzm import __version__ as pyzm_version
-from pyzm import Detector, ZMClient
-from pyzm.models.config import StreamConfig
-from pyzm.models.detection import DetectionResult
-from pyzm.models.zm import Zone
-import zmes_hook_helpers.common_params as g
-from zmes_hook_helpers import __version__ as __app_version__
-import zmes_hook_helpers.utils as utils
-
-
-def _try_push(zm, args, cause, no_match=False):
-    """Send FCM push if push is enabled and eventid/monitorid are available."""
-    if not (g.config.get('push', {}).get('enabled') == 'yes'
-            and args.get('eventid') and args.get('monitorid')):
-        return
-    try:
-        from zmes_hook_helpers.push import send_push_notifications
-        mon_name = 'Monitor {}'.format(args['monitorid'])
-        try:
-            mon = zm.monitor(int(args['monitorid']))
-            if mon:
-                mon_name = mon.name
-        except Exception:
-            pass
-        send_push_notifications(
-            zm, g.config, args['monitorid'], args['eventid'],
-            mon_name, cause, g.logger, no_match=no_match)
-    except Exception as e:
-        g.logger.Error('Push notification error: {}'.format(e))
-
-
-def main_handler():
-    ap = argparse.ArgumentParser()
-    ap.add_argument('-c', '--config', default='/etc/zm/objectconfig.yml', help='config file with path')
-    ap.add_argument('-e', '--eventid', help='event ID to retrieve')
-    ap.add_argument('-p', '--eventpath', help='path to store object image file', default='')
-    ap.add_argument('-m', '--monitorid', help='monitor id - needed for mask')
-    ap.add_argument('-v', '--version', action='store_true')
-    ap.add_argument('--bareversion', action='store_true')
-    ap.add_argument('-o', '--output-path', help='path for debug images')
-    ap.add_argument('-O', '--override', action='append', default=[], help='override config value using dot notation (e.g. -O show_percent=20 -O ml_sequence.object.sequence[0].object_min_confidence=0.5)')
-    ap.add_argument('-f', '--file', help='skip event download, use local file')
-    ap.add_argument('-r', '--reason', help='reason for event')
-    ap.add_argument('-n', '--notes', action='store_true', help='update ZM notes')
-    ap.add_argument('-d', '--debug', action='store_true')
-    ap.add_argument('--fakeit', help='override detection results with fake labels for testing (comma-separated, e.g. "dog,person")')
-    args = vars(ap.parse_known_args()[0])
-
-    if args.get('version'):  print('app:{}, pyzm:{}'.format(__app_version__, pyzm_version)); sys.exit(0)
-    if args.get('bareversion'): print(__app_version__); sys.exit(0)
-    if not os.path.isfile(args['config']):
-        print('Config file not found: {}'.format(args['config'])); sys.exit(1)
-    if not args.get('file') and not args.get('eventid'): print('--eventid required'); sys.exit(1)
-
-    # Config + logging
-    from pyzm.log import setup_zm_logging, get_log_file
-    utils.get_pyzm_config(args)
-    if args.get('debug'):
-        g.config['pyzm_overrides'].update(dump_console=True, log_debug=True, log_level_debug=5, log_debug_target=None)
-    mid = args.get('monitorid')
-    g.logger = setup_zm_logging(name='zmesdetect_m{}'.format(mid) if mid else 'zmesdetect', override=g.config['pyzm_overrides'])
-
-    g.logger.Debug(1, 'zm_detect invoked: {}'.format(' '.join(sys.argv)))
-    g.logger.Debug(1, 'Log file: {}'.format(get_log_file() or '(file logging disabled)'))
-    g.logger.Debug(1, '---------| app:{}, pyzm:{}, OpenCV:{}|------------'.format(__app_version__, pyzm_version, cv2.__version__))
-
-    g.polygons, g.ctx = [], ssl.create_default_context()
-    utils.process_config(args, g.ctx)
-    os.makedirs(g.config['base_data_path'] + '/misc/', exist_ok=True)
-
-    if not g.config['ml_sequence']:  g.logger.Error('ml_sequence missing'); sys.exit(1)
-    if not g.config['stream_sequence']: g.logger.Error('stream_sequence missing'); sys.exit(1)
-
-    ml_options = g.config['ml_sequence']
-    stream_options = g.config['stream_sequence']
-    if isinstance(stream_options, str): stream_options = ast.literal_eval(stream_options)
-
-    # Connect to ZM via pyzm v2
-    zm = ZMClient(api_url=g.config['api_portal'], user=g.config['user'], password=g.config['password'],
-                  portal_url=g.config['portal'], verify_ssl=(g.config['allow_self_signed'] != 'yes'))
-
-    # Import ZM zones via pyzm client (ref: ZoneMinder/zmeventnotificationNg#18)
-    if g.config.get('import_zm_zones') == 'yes':
-        mid = args.get('monitorid')
-        if mid:
-            utils.import_zm_zones(mid, args.get('reason'), zm)
-
-    stream = (args.get('eventid') or args.get('file') or '').strip()
-
-    # --- Detection ---
-    stream_cfg = StreamConfig.from_dict(stream_options)
-    zones = [Zone(name=p['name'], points=p['value'], pattern=p.get('pattern'), ignore_pattern=p.get('ignore_pattern')) for p in g.polygons]
-    matched_data = None
-
-    # Inject remote gateway settings into ml_options so Detector.from_dict() picks them up
-    if g.config.get('ml_gateway'):
-        ml_options.setdefault('general', {})['ml_gateway'] = g.config['ml_gateway']
-        ml_options['general']['ml_user'] = g.config.get('ml_user')
-        ml_options['general']['ml_password'] = g.config.get('ml_password')
-        ml_options['general']['ml_timeout'] = g.config.get('ml_timeout', 60)
-        ml_options['general']['ml_gateway_mode'] = g.config.get('ml_gateway_mode', 'url')
-
-    # Inject monitor_id for per-monitor past detection scoping
-    mid = args.get('monitorid')
-    if mid:
-        ml_options.setdefault('general', {})['monitor_id'] = str(mid)
-
-    # Inject image_path from config so past-detection files land in the right place
-    ml_options.setdefault('general', {})['image_path'] = g.config.get('image_path', '/var/lib/zmeventnotification/images')
-
-    wait_secs = int(g.config.get('wait', 0))
-    if wait_secs > 0:
-        g.logger.Debug(1, 'Waiting {} seconds before detection...'.format(wait_secs))
-        time.sleep(wait_secs)
-    detector = Detector.from_dict(ml_options)
-
-    try:
-        if args.get('file'):
-            result = detector.detect(args['file'], zones=zones)
-        else:
-            result = detector.detect_event(zm, int(stream), zones=zones, stream_config=stream_cfg)
-        matched_data = result.to_dict(); matched_data['polygons'] = g.polygons
-    except Exception as e:
-        if g.config.get('ml_gateway') and g.config.get('ml_fallback_local') == 'yes':
-            g.logger.Debug(1, 'Remote failed ({}), falling back to local'.format(e))
-            ml_options['general']['ml_gateway'] = None
-            local = Detector.from_dict(ml_options)
-            if args.get('file'):
-                result = local.detect(args['file'], zones=zones)
-            else:
-                result = local.detect_event(zm, int(stream), zones=zones, stream_config=stream_cfg)
-            matched_data = result.to_dict(); matched_data['polygons'] = g.polygons
-        else:
-            raise
-
-    if not matched_data: g.logger.Debug(1, 'No detection data'); matched_data = {}
-
-    # Fetch event once and reuse for write_image, notes, tagging
-    ev = None
-    if args.get('eventid'):
-        try:
-            ev = zm.event(int(args['eventid']))
-        except Exception as e:
-            g.logger.Error('Error fetching event: {}'.format(e))
-
-    # --- Fake override ---
-    if args.get('fakeit'):
-        fake_labels = [l.strip() for l in args['fakeit'].split(',') if l.strip()]
-        g.logger.Debug(1, 'Overriding detection with fake labels: {}'.format(fake_labels))
-        matched_data['labels'] = fake_labels
-        matched_data['boxes'] = [[50 + i * 100, 50, 150 + i * 100, 200] for i in range(len(fake_labels))]
-        matched_data['confidences'] = [0.996] * len(fake_labels)
-        matched_data.setdefault('frame_id', 'snapshot')
-        matched_data.setdefault('polygons', g.polygons)
-        matched_data.setdefault('image_dimensions', {})
-        # Rebuild DetectionResult from overridden data
-        result = DetectionResult.from_dict(matched_data)
-        result.image = matched_data.get('image')
-
-    if not matched_data.get('labels'):
-        g.logger.Debug(1, 'No detection data')
-        if g.config.get('push', {}).get('send_push_on_no_match') == 'yes':
-            g.logger.Info('No detections but send_push_on_no_match is yes, sending push')
-            _try_push(zm, args, args.get('reason') or '', no_match=True)
-        return
-
-    # --- Output ---
-    output = utils.format_detection_output(matched_data, g.config)
-    if not output: return
-    pred, jos = output.split('--SPLIT--', 1)
-    g.logger.Info('Prediction string:{}'.format(pred)); print(output)
-
-    # --- Write images ---
-    if matched_data.get('image') is not None and (g.config['write_image_to_zm'] == 'yes' or g.config['write_debug_image'] == 'yes'):
-        draw_errors = g.config['write_debug_image'] == 'yes'
-        debug_image = result.annotate(
-            polygons=matched_data.get('polygons', []),
-            poly_color=ast.literal_eval(g.config['poly_color']) if isinstance(g.config.get('poly_color'), str) else g.config.get('poly_color', (255, 255, 255)),
-            poly_thickness=g.config['poly_thickness'],
-            write_conf=(g.config['show_percent'] == 'yes'),
-            draw_error_boxes=draw_errors,
-        )
-        if g.config['write_debug_image'] == 'yes':
-            cv2.imwrite(os.path.join(g.config['image_path'], '{}-{}-debug.jpg'.format(os.path.basename(stream), matched_data['frame_id'])), debug_image)
-        if g.config['write_image_to_zm'] == 'yes':
-            if ev:
-                try:
-                    written = ev.save_objdetect(debug_image, matched_data, path_override=args.get('eventpath') or None)
-                    if written:
-                        g.logger.Debug(1, 'Wrote objdetect artifacts to {}'.format(written))
-                    else:
-                        g.logger.Debug(1, 'No event path available, skipping write_image_to_zm')
-                except Exception as e: g.logger.Error('Error writing objdetect: {}'.format(e))
-            else:
-                g.logger.Debug(1, 'No event path available, skipping write_image_to_zm')
-
-    # --- Update ZM event notes ---
-    if args.get('notes') and args.get('eventid') and ev:
-        try:
-            old = ev.notes or ''
-            parts = old.split('Motion:') if old else ['']
-            ev.update_notes(pred + ('| Motion:' + parts[1] if len(parts) > 1 else ''))
-        except Exception as e: g.logger.Error('Error updating notes: {}'.format(e))
-
-    # --- Tag detected objects in ZM ---
-    if g.config.get('tag_detected_objects') == 'yes' and args.get('eventid') and ev and matched_data.get('labels'):
-        try:
-            g.logger.Debug(1, 'Tagging event {} with labels: {}'.format(args['eventid'], matched_data['labels']))
-            ev.tag(matched_data['labels'])
-            g.logger.Debug(1, 'Tagging complete for event {}'.format(args['eventid']))
-        except Exception as e: g.logger.Error('Error tagging event: {}'.format(e))
-
-    # --- Push notifications ---
-    _try_push(zm, args, pred)
+import sys
 
+from zmes_hook_helpers.detect import main
+# zm_detect.main_handler was importable before the code moved to the package
+from zmes_hook_helpers.detect import main_handler
 
+__all__ = ['main', 'main_handler']
 
 if __name__ == '__main__':
-    try:
-        main_handler()
-        if g.logger: g.logger.Debug(1, 'Closing logs'); g.logger.close()
-    except Exception as e:
-        if g.logger: g.logger.Fatal('Unrecoverable error:{} Traceback:{}'.format(e, traceback.format_exc())); g.logger.close()
-        else: print('Unrecoverable error:{} Traceback:{}'.format(e, traceback.format_exc()))
-        sys.exit(1)
+    sys.exit(main())
@@ -28,6 +28,11 @@ CONFIG_FILE="/etc/zm/objectconfig.yml"
 EVENT_PATH="$5"
 REASON="$4"
 
+# Socket of a running detection server (zm_detect.py --serve, see zm_detect.service).
+# When set, detection is forwarded to it so models stay loaded between events.
+# If the server is not running, zm_detect.py falls back to in-process detection.
+DETECT_SOCKET=""
+
 
 # use arrays instead of strings to avoid quote hell
 if [[ ! -z "${2}" ]]
@@ -37,6 +42,27 @@ else
    DETECTION_SCRIPT=(/var/lib/zmeventnotification/bin/zm_detect.py  --eventid $1 --config "${CONFIG_FILE}" --eventpath "${EVENT_PATH}" --reason "${REASON}"  )
 
 fi
+if [[ ! -z "${DETECT_SOCKET}" ]]
+then
+   DETECTION_SCRIPT+=(--socket "${DETECT_SOCKET}")
+fi
+
+# zmeventnotification.pl sets this to jsonl when hook_output_format is jsonl:
+# zm_detect.py then prints one versioned JSON record instead of
+# "detected:...--SPLIT--{json}". Records are passed on as they arrive, so
+# the ES sees a progressive_results provisional record right away.
+# zm_detect.py exits 0 if its final record reports a detection, else 1, and
+# that is passed on as is.
+if [[ "${ZMES_HOOK_OUTPUT_FORMAT}" == "jsonl" ]]
+then
+   DETECTION_SCRIPT+=(--output-format jsonl)
+   "${DETECTION_SCRIPT[@]}" | while IFS= read -r LINE
+   do
+      [[ "${LINE}" == '{"zmes_hook":'* ]] && printf '%s\n' "${LINE}"
+   done
+   exit ${PIPESTATUS[0]}
+fi
+
 RESULTS=$("${DETECTION_SCRIPT[@]}" | grep "detected:")
 
 _RETVAL=1
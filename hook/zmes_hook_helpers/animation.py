@@ -0,0 +1,277 @@
+"""Short annotated clip around the matched frame (``objdetect.gif`` / ``.mp4``).
+
+With ``create_animation: yes`` zm_detect queues the clip as a job for the
+``--writeback-worker`` (see :mod:`zmes_hook_helpers.writeback`), so making it
+never delays the hook's result.
+
+Frames are fetched from ZM one at a time (``index.php?view=image``), every
+``animation_stride``-th frame over ``animation_duration`` seconds centred on
+the matched frame. Each is scaled to ``animation_width``, the matched boxes
+are drawn on it and it is handed to the writers before the next one is
+fetched, so only one full-size frame is decoded at any time. MP4 frames go
+straight to ``cv2.VideoWriter`` as H.264 (``avc1``), the only MP4 codec
+browsers and the push apps play inline. The opencv-python wheels come
+without an H.264 encoder; with those the MP4 is written as GIF instead
+(see :func:`_writers`). GIF frames are kept as palette images at
+the output size (Pillow writes a GIF in one go). Files are written under a
+temporary name and renamed, so a plugin never sends a half-written
+``objdetect.gif``.
+
+The hook usually runs while the event is still recording, so a frame that
+isn't there yet is retried a few times before the clip is cut short.
+"""
+
+import functools
+import os
+import tempfile
+import time
+
+import zmes_hook_helpers.common_params as g
+
+_FETCH_TRIES = 3
+_RETRY_SLEEP = 2
+_DEFAULT_FPS = 5
+# fourcc of objdetect.mp4
+_MP4_CODEC = 'avc1'
+
+
+def anchor_frame(frame_id, ev=None):
+    """Numeric frame id of the matched frame.
+
+    ``snapshot`` is the event's max score frame and ``alarm`` its first
+    alarm frame; anything else falls back to frame 1.
+    """
+    if str(frame_id).isdigit():
+        return int(frame_id)
+    if ev is not None:
+        if frame_id == 'snapshot' and getattr(ev, 'max_score_frame_id', None):
+            return int(ev.max_score_frame_id)
+        if frame_id == 'alarm':
+            try:
+                fid = ev.raw().get('Event', {}).get('AlarmFrameId')
+                if fid and str(fid).isdigit():
+                    return int(fid)
+            except Exception:
+                pass
+    return 1
+
+
+def event_fps(ev=None):
+    try:
+        if ev.frames and ev.length:
+            return max(1.0, float(ev.frames) / float(ev.length))
+    except (AttributeError, TypeError, ValueError, ZeroDivisionError):
+        pass
+    return float(_DEFAULT_FPS)
+
+
+def frame_ids(anchor, fps, duration, stride):
+    """Frame ids covering *duration* seconds centred on *anchor*, every *stride*-th frame.
+
+    The anchor itself is always included.
+    """
+    stride = max(1, int(stride))
+    half = int(round(fps * float(duration) / 2))
+    first = anchor - (min(half, anchor - 1) // stride) * stride
+    return list(range(first, anchor + half + 1, stride))
+
+
+def fetch_frame(api, eid, fid):
+    """Decoded BGR frame *fid* of event *eid*, or None if ZM doesn't have it (yet)."""
+    import cv2
+    import numpy as np
+    url = '{}/index.php?view=image&eid={}&fid={}'.format(api.portal_url, eid, fid)
+    for attempt in range(_FETCH_TRIES):
+        try:
+            resp = api.request(url)
+            content = getattr(resp, 'content', None)
+            if content:
+                img = cv2.imdecode(np.frombuffer(content, dtype=np.uint8), cv2.IMREAD_COLOR)
+                if img is not None:
+                    return img
+        except Exception as e:
+            g.logger.Debug(2, 'Frame {} of event {} not available: {}'.format(fid, eid, e))
+        if attempt + 1 < _FETCH_TRIES:
+            time.sleep(_RETRY_SLEEP)
+    return None
+
+
+def stream_frames(fetch, fids):
+    """Yield ``(fid, image)`` for *fids*, fetching each only when asked for.
+
+    Stops at the first frame *fetch* can't get.
+    """
+    for fid in fids:
+        img = fetch(fid)
+        if img is None:
+            g.logger.Debug(1, 'Animation stops before frame {}: not available'.format(fid))
+            return
+        yield fid, img
+
+
+def draw(image, matched_data, width):
+    """*image* scaled to *width* with the matched boxes and labels drawn on it."""
+    import cv2
+    from zmes_hook_helpers import jpeg
+    h, w = image.shape[:2]
+    out = jpeg.thumbnail(image, width)
+    if out is image:
+        out = image.copy()
+    dims = matched_data.get('image_dimensions') or {}
+    ref = dims.get('resized') or dims.get('original') or (h, w)
+    scale = out.shape[1] / float(ref[1])
+    labels = matched_data.get('labels') or []
+    for i, box in enumerate(matched_data.get('boxes') or []):
+        x1, y1, x2, y2 = [int(round(v * scale)) for v in box]
+        cv2.rectangle(out, (x1, y1), (x2, y2), (0, 255, 0), 2)
+        if i < len(labels):
+            cv2.putText(out, str(labels[i]), (x1 + 2, max(12, y1 - 4)),
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 1)
+    return out
+
+
+@functools.lru_cache(maxsize=None)
+def _encoder_works(fourcc):
+    """Whether this OpenCV build can write MP4 with *fourcc* (tried once on a scratch file)."""
+    import cv2
+    fd, path = tempfile.mkstemp(suffix='.mp4')
+    os.close(fd)
+    try:
+        out = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*fourcc), _DEFAULT_FPS, (64, 64))
+        ok = out.isOpened()
+        out.release()
+        return ok
+    except Exception:
+        return False
+    finally:
+        os.remove(path)
+
+
+class _Mp4Writer:
+    def __init__(self, path, fps):
+        self.path = path
+        self.fps = fps
+        self._tmp = os.path.join(os.path.dirname(path), '.objdetect-{}.mp4'.format(os.getpid()))
+        self._out = None
+
+    def add(self, image):
+        import cv2
+        if self._out is None:
+            h, w = image.shape[:2]
+            self._out = cv2.VideoWriter(self._tmp, cv2.VideoWriter_fourcc(*_MP4_CODEC), self.fps, (w, h))
+            if not self._out.isOpened():
+                raise OSError('cannot open MP4 writer for {}'.format(self._tmp))
+        self._out.write(image)
+
+    def close(self):
+        if self._out is None:
+            return False
+        self._out.release()
+        os.replace(self._tmp, self.path)
+        return True
+
+    def discard(self):
+        if self._out is not None:
+            self._out.release()
+        if os.path.exists(self._tmp):
+            os.remove(self._tmp)
+
+
+class _GifWriter:
+    def __init__(self, path, fps):
+        from PIL import Image
+        self._image = Image
+        self.path = path
+        self.duration = int(round(1000 / fps))
+        self._tmp = os.path.join(os.path.dirname(path), '.objdetect-{}.gif'.format(os.getpid()))
+        self._frames = []
+
+    def add(self, image):
+        rgb = image[:, :, ::-1]
+        self._frames.append(self._image.fromarray(rgb).convert('P', palette=self._image.ADAPTIVE))
+
+    def close(self):
+        if not self._frames:
+            return False
+        first, rest = self._frames[0], self._frames[1:]
+        first.save(self._tmp, format='GIF', save_all=True, append_images=rest,
+                   duration=self.duration, loop=0)
+        self._frames = []
+        os.replace(self._tmp, self.path)
+        return True
+
+    def discard(self):
+        self._frames = []
+        if os.path.exists(self._tmp):
+            os.remove(self._tmp)
+
+
+_WRITERS = {'mp4': _Mp4Writer, 'gif': _GifWriter}
+
+
+def _writers(eventpath, types, fps):
+    """Writers for *types*; ``mp4`` becomes ``gif`` when OpenCV can't encode H.264."""
+    writers = []
+    types = [t.strip().lower() for t in types]
+    for t in types:
+        if t not in _WRITERS:
+            g.logger.Error('Unknown animation type {}, skipping it'.format(t))
+            continue
+        if t == 'mp4' and not _encoder_works(_MP4_CODEC):
+            g.logger.Warning('OpenCV has no {} (H.264) encoder, writing objdetect.gif instead of objdetect.mp4'.format(
+                _MP4_CODEC))
+            if 'gif' in types:
+                continue
+            t = 'gif'
+        try:
+            writers.append(_WRITERS[t](os.path.join(eventpath, 'objdetect.{}'.format(t)), fps))
+        except ImportError as e:
+            g.logger.Error('Cannot write objdetect.{}: {}'.format(t, e))
+    return writers
+
+
+def write(frames, matched_data, eventpath, types, fps, width):
+    """Draw and write *frames* (``(fid, image)`` pairs) as ``objdetect.<type>``.
+
+    Returns the paths written.
+    """
+    writers = _writers(eventpath, types, fps)
+    if not writers:
+        return []
+    count = 0
+    try:
+        for fid, img in frames:
+            out = draw(img, matched_data, width)
+            for w in writers:
+                w.add(out)
+            count += 1
+        written = [w.path for w in writers if w.close()]
+    except Exception:
+        for w in writers:
+            w.discard()
+        raise
+    g.logger.Debug(1, 'Animation: {} frames, {}'.format(count, ', '.join(written) or 'nothing written'))
+    return written
+
+
+def create(zm, args, matched_data, eventpath=None):
+    """Write the configured animations for event ``args['eventid']``; returns the paths written."""
+    eid = args.get('eventid')
+    if not eid or zm is None or not matched_data.get('labels'):
+        return []
+    start = time.perf_counter()
+    ev = zm.event(int(eid))
+    eventpath = eventpath or args.get('eventpath') or ev.path()
+    if not eventpath:
+        g.logger.Debug(1, 'No event path available, skipping animation')
+        return []
+    fps = event_fps(ev)
+    stride = max(1, int(g.config.get('animation_stride', 2)))
+    fids = frame_ids(anchor_frame(matched_data.get('frame_id'), ev), fps,
+                     g.config.get('animation_duration', 4), stride)
+    g.logger.Debug(1, 'Animation for event {}: frames {}-{} every {}'.format(eid, fids[0], fids[-1], stride))
+    frames = stream_frames(lambda fid: fetch_frame(zm.api, eid, fid), fids)
+    written = write(frames, matched_data, eventpath, g.config.get('animation_types') or ['gif'],
+                    max(1.0, fps / stride), g.config.get('animation_width', 400))
+    g.logger.Debug(1, 'Animation for event {} took {:.0f}ms'.format(eid, (time.perf_counter() - start) * 1000))
+    return written
@@ -0,0 +1,195 @@
+"""On-disk cache of ZM API tokens shared between hook invocations.
+
+A full ZM login checks the password server-side, which can take hundreds of
+milliseconds on a busy system. Tokens from the last login are kept in
+``<base_data_path>/misc/zm_auth/`` (one file per api_portal + user, mode 0600)
+and reused while the access token has more than pyzm's refresh grace period
+left. If only the refresh token is still good, it is used for the login
+instead of the password. Legacy (API < 2.0) credentials are never cached.
+
+pyzm's ZMAPI always logs in from its constructor, so :func:`connect` seeds
+``AuthManager.login`` for the duration of the ``ZMClient(...)`` call only.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+# pyzm refreshes tokens with less than this many seconds left
+_GRACE_SECONDS = 5 * 60
+# AuthManager internals read and seeded here (pyzm 2.5.4); without them there is no caching
+_TOKEN_ATTRS = ('_access_token', '_access_token_expires_at', '_refresh_token', '_refresh_token_expires_at',
+                '_initial_token', '_is_token_api')
+
+_patch_lock = threading.Lock()
+
+
+def cache_path(base_data_path, api_url, user):
+    key = '{}|{}'.format(api_url.rstrip('/'), user or '')
+    name = hashlib.sha256(key.encode('utf-8')).hexdigest()[:32] + '.json'
+    return os.path.join(base_data_path, 'misc', 'zm_auth', name)
+
+
+def _ts(dt):
+    return dt.timestamp() if dt else None
+
+
+def _dt(ts):
+    return datetime.fromtimestamp(ts) if ts else None
+
+
+def load(path, now=None):
+    """Return the cached token entry at *path*, or None if missing or fully expired."""
+    now = time.time() if now is None else now
+    try:
+        with open(path) as f:
+            entry = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if (entry.get('access_expires') or 0) - now >= _GRACE_SECONDS:
+        return entry
+    if entry.get('refresh_token') and (entry.get('refresh_expires') or 0) - now >= _GRACE_SECONDS:
+        return entry
+    return None
+
+
+def supported(auth):
+    """True if pyzm AuthManager *auth* has the token fields this cache reads and seeds."""
+    return all(hasattr(auth, a) for a in _TOKEN_ATTRS)
+
+
+def save(path, auth):
+    """Write the tokens held by pyzm AuthManager *auth* to *path* (best effort).
+
+    Returns True if a file was written.
+    """
+    if not supported(auth) or not auth.auth_enabled or not auth._is_token_api() or not auth._access_token:
+        return False
+    entry = {
+        'api_version': auth.api_version,
+        'zm_version': auth.zm_version,
+        'access_token': auth._access_token,
+        'access_expires': _ts(auth._access_token_expires_at),
+        'refresh_token': auth._refresh_token,
+        'refresh_expires': _ts(auth._refresh_token_expires_at),
+    }
+    d = os.path.dirname(path)
+    os.makedirs(d, mode=0o700, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=d, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(entry, f)
+        os.replace(tmp, path)
+    except Exception:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+    return True
+
+
+def seed(auth, entry, login, now=None):
+    """Log *auth* in from *entry* instead of calling *login* when possible.
+
+    Returns 'access' if the cached access token was installed without any
+    network call, 'refresh' if the refresh token was used to log in,
+    'unsupported' if this pyzm's AuthManager can't be seeded, or None if a
+    normal login was done.
+    """
+    now = time.time() if now is None else now
+    if not supported(auth):
+        login(auth)
+        return 'unsupported'
+    if entry and (entry.get('access_expires') or 0) - now >= _GRACE_SECONDS:
+        auth.api_version = entry.get('api_version')
+        auth.zm_version = entry.get('zm_version')
+        auth._access_token = entry['access_token']
+        auth._access_token_expires_at = _dt(entry.get('access_expires'))
+        auth._refresh_token = entry.get('refresh_token') or ''
+        auth._refresh_token_expires_at = _dt(entry.get('refresh_expires'))
+        return 'access'
+    if entry and entry.get('refresh_token') and (entry.get('refresh_expires') or 0) - now >= _GRACE_SECONDS:
+        # falls back to user/password inside pyzm if ZM rejects the token
+        auth._initial_token = entry['refresh_token']
+        login(auth)
+        return 'refresh'
+    login(auth)
+    return None
+
+
+@contextmanager
+def _seeded_login(entry, outcome):
+    from pyzm.zm.auth import AuthManager
+    real_login = AuthManager.login
+
+    def login(self):
+        # only the first login (from ZMAPI.__init__) is seeded
+        AuthManager.login = real_login
+        outcome.append(seed(self, entry, real_login))
+
+    with _patch_lock:
+        AuthManager.login = login
+        try:
+            yield
+        finally:
+            AuthManager.login = real_login
+
+
+def _path_for(config):
+    return cache_path(config['base_data_path'], config['api_portal'], config['user'])
+
+
+def _enabled(config):
+    return config.get('auth_token_cache') == 'yes' and bool(config.get('user'))
+
+
+def connect(config, logger=None):
+    """Return a ZMClient for *config* (g.config), reusing cached tokens if enabled."""
+    from pyzm import ZMClient
+    kwargs = dict(api_url=config['api_portal'], user=config['user'], password=config['password'],
+                  portal_url=config['portal'], verify_ssl=(config['allow_self_signed'] != 'yes'))
+    if not _enabled(config):
+        return ZMClient(**kwargs)
+
+    outcome = []
+    with _seeded_login(load(_path_for(config)), outcome):
+        zm = ZMClient(**kwargs)
+    used = outcome[0] if outcome else None
+    if logger and used == 'unsupported':
+        logger.Warning('ZM auth: this pyzm has no token fields to cache (needs pyzm 2.5.4 internals), '
+                       'did a full login; set auth_token_cache=no to silence this')
+    elif logger:
+        logger.Debug(1, 'ZM auth: {}'.format({'access': 'reused cached access token',
+                                             'refresh': 'logged in with cached refresh token'}.get(used, 'full login')))
+    if used not in ('access', 'unsupported'):
+        remember(zm, config, logger)
+    return zm
+
+
+def remember(zm, config, logger=None):
+    """Cache *zm*'s current tokens if they differ from what is on disk.
+
+    Called after connect() and again at the end of a run, so a token that
+    pyzm had to renew (expiry or a 401) replaces the stale one.
+    """
+    if zm is None or not _enabled(config):
+        return
+    path = _path_for(config)
+    try:
+        auth = zm.api.auth
+        if not supported(auth):
+            return
+        cached = load(path)
+        if cached and cached.get('access_token') == auth._access_token:
+            return
+        if save(path, auth) and logger:
+            logger.Debug(2, 'ZM auth: cached tokens in {}'.format(path))
+    except Exception as e:
+        if logger:
+            logger.Debug(1, 'ZM auth: could not cache tokens in {}: {}'.format(path, e))
@@ -55,12 +55,152 @@ config_vals = {
             'default':'0',
             'type': 'int'
         },
+        'wait_mode': {
+            'section': 'general',
+            'default': 'fixed',
+            'type': 'string'
+        },
 
         'show_percent':{
             'section': 'general',
             'default': 'no',
             'type': 'string'
         },
+        'monitors_dir':{
+            'section': 'general',
+            'default': None,
+            'type': 'string'
+        },
+        'lazy_model_load':{
+            'section': 'general',
+            'default': 'no',
+            'type': 'string'
+        },
+        'early_exit_gates':{
+            'section': 'general',
+            'default': 'no',
+            'type': 'string'
+        },
+        'es_mute_check':{
+            'section': 'general',
+            'default': 'no',
+            'type': 'string'
+        },
+        'es_rules_file':{
+            'section': 'general',
+            'default': '/etc/zm/es_rules.yml',
+            'type': 'string'
+        },
+        'escontrol_interface_file':{
+            'section': 'general',
+            'default': '${base_data_path}/misc/escontrol_interface.dat',
+            'type': 'string'
+        },
+        'es_mute_detect_for_notes':{
+            'section': 'general',
+            'default': 'no',
+            'type': 'string'
+        },
+        'zm_zones_cache_ttl':{
+            'section': 'general',
+            'default': '0',
+            'type': 'int'
+        },
+        'jpeg_quality':{
+            'section': 'general',
+            'default': '95',
+            'type': 'int'
+        },
+        'jpeg_encoder':{
+            'section': 'general',
+            'default': 'opencv',
+            'type': 'string'
+        },
+        'detach_writeback':{
+            'section': 'general',
+            'default': 'no',
+            'type': 'string'
+        },
+        'writeback_workers':{
+            'section': 'general',
+            'default': '2',
+            'type': 'int'
+        },
+        'max_event_latency':{
+            'section': 'general',
+            'default': '0',
+            'type': 'float'
+        },
+        'http_pool_size':{
+            'section': 'general',
+            'default': '10',
+            'type': 'int'
+        },
+        'http_connect_timeout':{
+            'section': 'general',
+            'default': '5',
+            'type': 'float'
+        },
+        'http_read_timeout':{
+            'section': 'general',
+            'default': '30',
+            'type': 'float'
+        },
+        'http_retries':{
+            'section': 'general',
+            'default': '3',
+            'type': 'int'
+        },
+        'http_backoff':{
+            'section': 'general',
+            'default': '0.5',
+            'type': 'float'
+        },
+        'http_backoff_max':{
+            'section': 'general',
+            'default': '10',
+            'type': 'float'
+        },
+        'progressive_results':{
+            'section': 'general',
+            'default': 'no',
+            'type': 'string'
+        },
+        'create_animation':{
+            'section': 'general',
+            'default': 'no',
+            'type': 'string'
+        },
+        'animation_types':{
+            'section': 'general',
+            'default': 'gif',
+            'type': 'str_split'
+        },
+        'animation_width':{
+            'section': 'general',
+            'default': '400',
+            'type': 'int'
+        },
+        'animation_stride':{
+            'section': 'general',
+            'default': '2',
+            'type': 'int'
+        },
+        'animation_duration':{
+            'section': 'general',
+            'default': '4',
+            'type': 'float'
+        },
+        'auth_token_cache':{
+            'section': 'general',
+            'default': 'no',
+            'type': 'string'
+        },
+        'config_cache':{
+            'section': 'general',
+            'default': 'no',
+            'type': 'string'
+        },
         'allow_self_signed':{
             'section': 'general',
             'default': 'yes',
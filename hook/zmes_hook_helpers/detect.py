@@ -0,0 +1,527 @@
+"""Main detection run for ZoneMinder events: ``main_handler`` and what it calls.
+
+``zm_detect.py`` (installed to ``/var/lib/zmeventnotification/bin``) and the
+``zm_detect_hook`` console entry point both call :func:`main_handler` from
+here; see zm_detect.py for the invocation modes. The detached writeback
+worker is started as ``python -m zmes_hook_helpers.detect --writeback-worker``.
+"""
+
+import argparse, ast, contextlib, functools, io, json, os, sys, time, traceback
+
+# cv2 and the pyzm ML/model modules are imported on the code paths that use
+# them, so --version, early exits and the socket client start fast.
+import zmes_hook_helpers.common_params as g
+from zmes_hook_helpers import __version__ as __app_version__
+import zmes_hook_helpers.utils as utils
+import zmes_hook_helpers.server as server
+import zmes_hook_helpers.stages as stages
+import zmes_hook_helpers.auth_cache as auth_cache
+import zmes_hook_helpers.gates as gates
+import zmes_hook_helpers.writeback as writeback
+import zmes_hook_helpers.animation as animation
+import zmes_hook_helpers.frame_sources as frame_sources
+import zmes_hook_helpers.http_pool as http_pool
+import zmes_hook_helpers.readiness as readiness
+import zmes_hook_helpers.zm_cache as zm_cache
+import zmes_hook_helpers.jpeg as jpeg
+
+# Heavy modules in the order a detection run loads them (see --import-profile)
+_HEAVY_IMPORTS = ('pyzm.log', 'pyzm', 'pyzm.models.config', 'pyzm.models.zm',
+                  'pyzm.models.detection', 'cv2', 'pyzm.ml.detector')
+
+# Exit code of the run. With --output-format jsonl it is the hook's answer:
+# 0 once the final record reports a detection, else 1. Text output exits 0
+# and the hook script greps for "detected:".
+_status = {'exit': 0}
+
+# Command that runs the queued detach_writeback jobs (see writeback.spawn_worker)
+WORKER = [sys.executable, '-m', 'zmes_hook_helpers.detect']
+
+
+def _pyzm_version():
+    """pyzm version from package metadata, without importing pyzm."""
+    try:
+        from importlib.metadata import version
+        return version('pyzm')
+    except Exception:
+        from pyzm import __version__
+        return __version__
+
+
+def _import_profile():
+    """Print the import time of each heavy module, in load order."""
+    import importlib
+    total = 0.0
+    for name in _HEAVY_IMPORTS:
+        loaded = name in sys.modules
+        start = time.perf_counter()
+        try:
+            importlib.import_module(name)
+            status = ' (already loaded)' if loaded else ''
+        except ImportError as e:
+            status = ' (failed: {})'.format(e)
+        elapsed = (time.perf_counter() - start) * 1000
+        total += elapsed
+        print('{:<24} {:>9.1f} ms{}'.format(name, elapsed, status))
+    print('{:<24} {:>9.1f} ms'.format('total', total))
+
+
+def _connect(deadline=None):
+    """ZMClient for g.config, with the per-invocation API cache and call counter and the tuned HTTP pool."""
+    zm = auth_cache.connect(g.config, g.logger)
+    zm_cache.attach(zm)
+    http_pool.tune_zm(zm, g.config, deadline)
+    return zm
+
+
+def _log_api_calls(zm, eid):
+    calls = zm_cache.of(zm)
+    if calls is not None:
+        g.logger.Debug(1, 'ZM API calls for event {}: {}'.format(eid, calls.summary()))
+    g.logger.Debug(1, 'HTTP time for event {}: {}'.format(eid, http_pool.stats.summary()))
+    http_pool.stats.reset()
+
+
+def _artifacts(args, matched_data):
+    """Files the writeback (and the animation worker) write for this result, by name."""
+    art = {}
+    eventpath = args.get('eventpath')
+    if matched_data.get('image') is not None:
+        if eventpath and g.config.get('write_image_to_zm') == 'yes':
+            art['objdetect_jpg'] = os.path.join(eventpath, 'objdetect.jpg')
+            art['objects_json'] = os.path.join(eventpath, 'objects.json')
+            if int(g.config.get('push', {}).get('thumbnail_width') or 0) > 0:
+                art['objdetect_thumb_jpg'] = os.path.join(eventpath, 'objdetect_thumb.jpg')
+        if g.config.get('write_debug_image') == 'yes':
+            art['debug_image'] = writeback.debug_image_path(args, matched_data)
+    if eventpath and args.get('eventid') and g.config.get('create_animation') == 'yes':
+        for t in g.config.get('animation_types') or []:
+            art['objdetect_{}'.format(t)] = os.path.join(eventpath, 'objdetect.{}'.format(t))
+    return art
+
+
+def _encode(result, matched_data):
+    """Annotate *result*'s image and encode it: ``(jpg, thumb)``, thumb None unless written to ZM."""
+    debug_image = result.annotate(
+        polygons=matched_data.get('polygons', []),
+        poly_color=ast.literal_eval(g.config['poly_color']) if isinstance(g.config.get('poly_color'), str) else g.config.get('poly_color', (255, 255, 255)),
+        poly_thickness=g.config['poly_thickness'],
+        write_conf=(g.config['show_percent'] == 'yes'),
+        draw_error_boxes=(g.config['write_debug_image'] == 'yes'),
+    )
+    jpg, thumb = jpeg.encode(debug_image), None
+    thumb_width = int(g.config.get('push', {}).get('thumbnail_width') or 0)
+    if thumb_width > 0 and g.config['write_image_to_zm'] == 'yes':
+        small = jpeg.thumbnail(debug_image, thumb_width)
+        thumb = jpg if small is debug_image else jpeg.encode(small, quality=g.config['push'].get('thumbnail_quality', 80))
+        g.logger.Debug(1, 'Push thumbnail: {}px wide, {} bytes'.format(small.shape[1], len(thumb)))
+    return jpg, thumb
+
+
+def _print_record(args, matched_data, text='', timer=None, artifacts=None, **extra):
+    """Print the result line of --output-format jsonl (nothing in the default text format)."""
+    if args.get('output_format') != 'jsonl':
+        return
+    timings = dict(timer.stages, total=timer.elapsed()) if timer else {}
+    record = utils.format_detection_record(matched_data, text, timings, artifacts,
+                                           event_id=args.get('eventid'), monitor_id=args.get('monitorid'), **extra)
+    if record['type'] == 'result':
+        _status['exit'] = 0 if record['detected'] else 1
+    print(json.dumps(record, default=writeback._jsonable), flush=True)
+
+
+def _cut(deadline):
+    """Record keys naming the stage max_event_latency cut short (logged), or none."""
+    if not deadline.cut:
+        return {}
+    g.logger.Info('max_event_latency of {:g}s reached: {} was cut short, using the best result so far'.format(deadline.seconds, deadline.cut))
+    return {'cut_stage': deadline.cut}
+
+
+def _gate_exit(gate, args, zm=None, push=True, timer=None):
+    """Finish an event rejected by an early-exit gate like any other no-detection event."""
+    count = gates.record(gate)
+    g.logger.Info('Early exit: gate {} fired ({} times so far), skipping detection'.format(gate, count))
+    _print_record(args, {}, timer=timer, gate=gate)
+    if push and g.config.get('push', {}).get('send_push_on_no_match') == 'yes':
+        g.logger.Info('No detections but send_push_on_no_match is yes, sending push')
+        if zm is None and args.get('eventid'):
+            zm = _connect()
+        writeback.try_push(zm, args, args.get('reason') or '', no_match=True)
+
+
+def _writeback_job(path, job):
+    """Replay one journaled writeback job (runs in the --writeback-worker process)."""
+    args = job['args']
+    g.config, g.polygons = {}, []
+    utils.process_config(args, None, cache_entry=utils.get_pyzm_config(args))
+    g.logger.Debug(1, 'Writeback for event {} queued {:.1f}s ago'.format(args.get('eventid'), time.time() - job.get('created', time.time())))
+    zm = _connect() if args.get('eventid') else None
+    zm_cache.settle(zm)
+    if not job.get('animation_only'):
+        writeback.run(zm, args, job.get('pred') or '', job.get('matched_data') or {}, writeback.load_jpg(path),
+                      es_mute=job.get('es_mute'), no_match=job.get('no_match', False),
+                      thumb=writeback.load_jpg(path, 'objdetect_thumb.jpg'))
+    if job.get('animation'):
+        try:
+            animation.create(zm, args, job.get('matched_data') or {})
+        except Exception as e:
+            g.logger.Error('Animation for event {} failed: {}'.format(args.get('eventid'), e))
+    auth_cache.remember(zm, g.config, g.logger)
+    _log_api_calls(zm, args.get('eventid'))
+
+
+def _serve_request(argv, out=None):
+    """Run one forwarded invocation inside the server with its stdout going to *out*."""
+    g.config, g.polygons, g.logger = {}, [], None
+    out, code = out or io.StringIO(), 0
+    with contextlib.redirect_stdout(out):
+        try:
+            code = main_handler(argv)
+        except SystemExit as e:
+            code = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+        except Exception as e:
+            code = 1
+            if g.logger: g.logger.Error('Unrecoverable error:{} Traceback:{}'.format(e, traceback.format_exc()))
+    if g.logger: g.logger.close()
+    return code, out.getvalue()
+
+
+def _echo(text):
+    sys.stdout.write(text); sys.stdout.flush()
+
+
+def main_handler(argv=None):
+    ap = argparse.ArgumentParser()
+    ap.add_argument('-c', '--config', default='/etc/zm/objectconfig.yml', help='config file with path')
+    ap.add_argument('-e', '--eventid', help='event ID to retrieve')
+    ap.add_argument('-p', '--eventpath', help='path to store object image file', default='')
+    ap.add_argument('-m', '--monitorid', help='monitor id - needed for mask')
+    ap.add_argument('-v', '--version', action='store_true')
+    ap.add_argument('--bareversion', action='store_true')
+    ap.add_argument('-o', '--output-path', help='path for debug images')
+    ap.add_argument('-O', '--override', action='append', default=[], help='override config value using dot notation (e.g. -O show_percent=20 -O ml_sequence.object.sequence[0].object_min_confidence=0.5)')
+    ap.add_argument('-f', '--file', help='skip event download, use local file')
+    ap.add_argument('-r', '--reason', help='reason for event')
+    ap.add_argument('-n', '--notes', action='store_true', help='update ZM notes')
+    ap.add_argument('-d', '--debug', action='store_true')
+    ap.add_argument('--fakeit', help='override detection results with fake labels for testing (comma-separated, e.g. "dog,person")')
+    ap.add_argument('--serve', action='store_true', help='run as a persistent detection server listening on --socket')
+    ap.add_argument('--socket', help='unix socket of the detection server (with --serve: socket to listen on)')
+    ap.add_argument('--cache-size', type=int, default=4, help='max warm Detector instances kept by --serve (LRU)')
+    ap.add_argument('--socket-timeout', type=float, default=server.DEFAULT_QUEUE_TIMEOUT, help='seconds to wait for the --socket server to start on the event before running it in-process (default: %(default)s)')
+    ap.add_argument('--socket-result-timeout', type=float, default=server.DEFAULT_RESULT_TIMEOUT, help='seconds to wait for the --socket server\'s result once it started, before running the event in-process (default: %(default)s)')
+    ap.add_argument('--flush-zone-cache', action='store_true', help='drop cached ZM zones (for --monitorid, or all monitors) before running; exits if no --eventid/--file')
+    ap.add_argument('--writeback-worker', action='store_true', help='run queued detach_writeback jobs and exit (started by zm_detect itself)')
+    ap.add_argument('--import-profile', action='store_true', help='print per-module import time of the heavy dependencies and exit')
+    ap.add_argument('--output-format', choices=('text', 'jsonl'), default='text', help='text: "detected:...--SPLIT--{json}" (default); jsonl: one versioned JSON record per line')
+    args = vars(ap.parse_known_args(argv)[0])
+    _status['exit'] = 1 if args.get('output_format') == 'jsonl' else 0
+    _run(args, argv)
+    return _status['exit']
+
+
+def _run(args, argv):
+    if args.get('version'):  print('app:{}, pyzm:{}'.format(__app_version__, _pyzm_version())); sys.exit(0)
+    if args.get('bareversion'): print(__app_version__); sys.exit(0)
+    if args.get('import_profile'): _import_profile(); sys.exit(0)
+    if args.get('serve'):
+        server.serve(args.get('socket') or server.DEFAULT_SOCKET, _serve_request, cache_size=args['cache_size']); sys.exit(0)
+    server_error = None
+    if args.get('socket'):
+        try:
+            response = server.forward(args['socket'], server.strip_client_args(sys.argv[1:] if argv is None else argv),
+                                      queue_timeout=args['socket_timeout'], result_timeout=args['socket_result_timeout'],
+                                      on_output=_echo)
+        except server.Unavailable as e:
+            response, server_error = None, e
+        if response is not None:
+            code, out = response
+            sys.stdout.write(out); sys.exit(code)
+    if not os.path.isfile(args['config']):
+        print('Config file not found: {}'.format(args['config'])); sys.exit(1)
+    if not args.get('file') and not args.get('eventid') and not args.get('flush_zone_cache') and not args.get('writeback_worker'): print('--eventid required'); sys.exit(1)
+
+    # Config + logging
+    from pyzm.log import setup_zm_logging, get_log_file
+    cache_entry = utils.get_pyzm_config(args)
+    if args.get('debug'):
+        g.config['pyzm_overrides'].update(dump_console=True, log_debug=True, log_level_debug=5, log_debug_target=None)
+    mid = args.get('monitorid')
+    log_name = 'zmesdetect_writeback' if args.get('writeback_worker') else 'zmesdetect_m{}'.format(mid) if mid else 'zmesdetect'
+    g.logger = setup_zm_logging(name=log_name, override=g.config['pyzm_overrides'])
+
+    g.logger.Debug(1, 'zm_detect invoked: {}'.format(' '.join(sys.argv if argv is None else ['zm_detect.py'] + list(argv))))
+    g.logger.Debug(1, 'Log file: {}'.format(get_log_file() or '(file logging disabled)'))
+    g.logger.Debug(1, '---------| app:{}, pyzm:{}|------------'.format(__app_version__, _pyzm_version()))
+    if server_error:
+        g.logger.Info('Detection server not used ({}), running in-process'.format(server_error))
+
+    # zm_detect never uses the SSL context; ZMClient verifies via allow_self_signed
+    g.polygons, g.ctx = [], None
+    timer = stages.StageTimer()
+    with timer.stage('config'):
+        utils.process_config(args, g.ctx, cache_entry=cache_entry)
+    deadline = stages.Deadline(g.config.get('max_event_latency', 0), start=timer.start)
+    http_pool.stats.reset()
+    os.makedirs(g.config['base_data_path'] + '/misc/', exist_ok=True)
+    if args.get('flush_zone_cache'):
+        utils.flush_zm_zones_cache(args.get('monitorid'))
+        if not args.get('file') and not args.get('eventid'): return
+    if args.get('writeback_worker'):
+        done = writeback.work(_writeback_job, workers=int(g.config.get('writeback_workers', 2)))
+        g.logger.Debug(1, 'Writeback worker ran {} job(s)'.format(done)); return
+
+    if not g.config['ml_sequence']:  g.logger.Error('ml_sequence missing'); sys.exit(1)
+    if not g.config['stream_sequence']: g.logger.Error('stream_sequence missing'); sys.exit(1)
+
+    ml_options = g.config['ml_sequence']
+    stream_options = g.config['stream_sequence']
+    if isinstance(stream_options, str): stream_options = ast.literal_eval(stream_options)
+
+    stream = (args.get('eventid') or args.get('file') or '').strip()
+    mid = args.get('monitorid')
+    import_zones = bool(mid) and g.config.get('import_zm_zones') == 'yes'
+    use_gates = g.config.get('early_exit_gates') == 'yes'
+
+    # --- ES mutes: no notification can come of this event ---
+    es_mute = gates.es_muted(mid)
+    if es_mute:
+        if g.config.get('es_mute_detect_for_notes') == 'yes' and (args.get('notes') or g.config.get('tag_detected_objects') == 'yes'):
+            g.logger.Info('Monitor {} is muted ({}), detecting only for notes/tags'.format(mid, es_mute))
+        else:
+            g.logger.Info('Monitor {} is muted ({})'.format(mid, es_mute))
+            _gate_exit('es_muted', args, push=False, timer=timer); return
+
+    # --- Early-exit gates: config, reason and (cached) zones only ---
+    zm_zones = None
+    if use_gates:
+        if import_zones:
+            zm_zones = utils.import_zm_zones(mid, args.get('reason'), None)
+        gate = gates.check(args.get('reason'), ml_options, zm_zones)
+        if gate:
+            _gate_exit(gate, args, timer=timer); return
+
+    # --- Detection ---
+    import cv2
+    from pyzm import Detector
+    from pyzm.models.config import StreamConfig
+    from pyzm.models.zm import Zone
+    g.logger.Debug(1, 'OpenCV:{}'.format(cv2.__version__))
+    stream_cfg = StreamConfig.from_dict(stream_options)
+    frame_source = str(stream_options.get('frame_source', frame_sources.DEFAULT_SOURCE)).lower()
+    matched_data = None
+
+    # Inject remote gateway settings into ml_options so Detector.from_dict() picks them up
+    if g.config.get('ml_gateway'):
+        ml_options.setdefault('general', {})['ml_gateway'] = g.config['ml_gateway']
+        ml_options['general']['ml_user'] = g.config.get('ml_user')
+        ml_options['general']['ml_password'] = g.config.get('ml_password')
+        ml_options['general']['ml_timeout'] = g.config.get('ml_timeout', 60)
+        ml_options['general']['ml_gateway_mode'] = g.config.get('ml_gateway_mode', 'url')
+
+    # Inject monitor_id for per-monitor past detection scoping
+    if mid:
+        ml_options.setdefault('general', {})['monitor_id'] = str(mid)
+
+    # Inject image_path from config so past-detection files land in the right place
+    ml_options.setdefault('general', {})['image_path'] = g.config.get('image_path', '/var/lib/zmeventnotification/images')
+
+    # ZM login, zone import, wait and frame download run alongside model loading
+    gate_hit, frame_cfg = [], [stream_cfg]
+    def _zm_stage():
+        zm = None
+        # Connect to ZM via pyzm v2 (--file without --eventid only needs it for zone import)
+        if args.get('eventid') or (import_zones and zm_zones is None and not utils.zm_zones_cached(mid)):
+            with timer.stage('zm_login'):
+                zm = _connect(deadline)
+
+        # Import ZM zones via pyzm client (ref: ZoneMinder/zmeventnotificationNg#18)
+        if import_zones and zm_zones is None:
+            with timer.stage('zm_zones'):
+                imported = utils.import_zm_zones(mid, args.get('reason'), zm)
+                if imported is None:
+                    # the cached zones that let us skip the login expired since
+                    g.logger.Debug(1, 'Cached ZM zones of monitor {} expired, logging in to fetch them'.format(mid))
+                    zm = _connect(deadline)
+                    imported = utils.import_zm_zones(mid, args.get('reason'), zm)
+            if use_gates and gates.no_triggered_zone(args.get('reason'), imported):
+                gate_hit.append('no_triggered_zone')
+                return zm
+
+        wait_secs = int(g.config.get('wait', 0))
+        # adaptive: the frame download below polls for up to wait_secs instead
+        poll = wait_secs > 0 and g.config.get('wait_mode') == 'adaptive' and bool(args.get('eventid')) and not args.get('file')
+        if wait_secs > 0 and not poll:
+            g.logger.Debug(1, 'Waiting {} seconds before detection...'.format(wait_secs))
+            with timer.stage('wait'):
+                deadline.sleep(wait_secs, 'wait')
+
+        if args.get('eventid') and not args.get('file'):
+            # URL-mode gateways fetch frames themselves
+            fetch_frames = not (g.config.get('ml_gateway') and g.config.get('ml_gateway_mode', 'url') == 'url')
+            # detect_event() must get the same StreamConfig to use the prefetched frames
+            frame_cfg[0] = stages.fit_retries(stream_cfg, deadline, g.logger)
+            extract = functools.partial(frame_sources.extract, source=frame_source, eventpath=args.get('eventpath'), logger=g.logger,
+                                        digits=int(stream_options.get('event_image_digits', frame_sources.DEFAULT_IMAGE_DIGITS)),
+                                        zm=zm, shm_path=stream_options.get('shm_path', frame_sources.shm_frames.DEFAULT_PATH))
+            poller = None
+            if poll and fetch_frames:
+                poller = readiness.Poller(extract, wait_secs, expected=readiness.expected(mid), deadline=deadline, logger=g.logger)
+                extract = poller
+            elif poll:
+                g.logger.Debug(1, 'Waiting {} seconds before detection...'.format(wait_secs))
+                with timer.stage('wait'):
+                    deadline.sleep(wait_secs, 'wait')
+            with timer.stage('frames'):
+                zm = stages.prefetch_event(zm, stream, frame_cfg[0], frames=fetch_frames, logger=g.logger, extract=extract)
+            if poller and poller.polls:
+                readiness.learn(mid, wait_secs if poller.ready_after is None else poller.ready_after)
+            if fetch_frames and deadline.expired():
+                deadline.mark('frames')
+        return zm
+
+    def _model_stage():
+        with timer.stage('model_load'):
+            detector = server.get_detector(ml_options, Detector.from_dict, g.logger)
+            stages.preload(detector, lazy=(g.config.get('lazy_model_load') == 'yes'), logger=g.logger)
+        return detector
+
+    init_start, before = time.perf_counter(), sum(timer.stages.values())
+    zm, detector = stages.run_parallel(_zm_stage, _model_stage)
+    init_secs, serial_secs = time.perf_counter() - init_start, sum(timer.stages.values()) - before
+    g.logger.Debug(1, 'ZM/model init took {:.0f}ms, overlap saved {:.0f}ms'.format(init_secs * 1000, max(0, serial_secs - init_secs) * 1000))
+    if gate_hit:
+        _gate_exit(gate_hit[0], args, zm, timer=timer); return
+    zones = [Zone(name=p['name'], points=p['value'], pattern=p.get('pattern'), ignore_pattern=p.get('ignore_pattern')) for p in g.polygons]
+    detect_start = time.perf_counter()
+
+    # --- Progressive: report the first matching frame while the rest are analysed ---
+    def _provisional(res):
+        md = res.to_dict(); md['polygons'] = g.polygons
+        output = utils.format_detection_output(md, g.config)
+        if output:
+            g.logger.Debug(1, 'Provisional result from frame {}: {}'.format(res.frame_id, output.split('--SPLIT--', 1)[0]))
+            # the ES pushes on this record, with objdetect.jpg as the picture: have it there first.
+            # The final result overwrites it.
+            eventpath = args.get('eventpath')
+            if eventpath and g.config.get('write_image_to_zm') == 'yes' and getattr(res, 'image', None) is not None:
+                jpg, thumb = _encode(res, md)
+                jpeg.write_objdetect(eventpath, jpg, md, thumb)
+                g.logger.Debug(1, 'Wrote provisional objdetect image for frame {}'.format(res.frame_id))
+            _print_record(args, md, output.split('--SPLIT--', 1)[0], timer, type='provisional')
+    progressive = g.config.get('progressive_results') == 'yes' and args.get('output_format') == 'jsonl'
+
+    def _watched(det):
+        watched = contextlib.ExitStack()
+        if deadline.seconds > 0:
+            watched.enter_context(stages.budget(det, deadline, g.logger))
+        if progressive:
+            watched.enter_context(stages.watch_matches(det, _provisional, g.logger))
+        return watched
+
+    try:
+        with _watched(detector):
+            if args.get('file'):
+                result = detector.detect(args['file'], zones=zones)
+            else:
+                result = detector.detect_event(zm, int(stream), zones=zones, stream_config=frame_cfg[0])
+        matched_data = result.to_dict(); matched_data['polygons'] = g.polygons
+    except Exception as e:
+        if g.config.get('ml_gateway') and g.config.get('ml_fallback_local') == 'yes':
+            g.logger.Debug(1, 'Remote failed ({}), falling back to local'.format(e))
+            ml_options['general']['ml_gateway'] = None
+            local = server.get_detector(ml_options, Detector.from_dict, g.logger)
+            with _watched(local):
+                if args.get('file'):
+                    result = local.detect(args['file'], zones=zones)
+                else:
+                    result = local.detect_event(zm, int(stream), zones=zones, stream_config=frame_cfg[0])
+            matched_data = result.to_dict(); matched_data['polygons'] = g.polygons
+        else:
+            raise
+
+    timer.add('detect', time.perf_counter() - detect_start)
+    zm_cache.settle(zm)
+    auth_cache.remember(zm, g.config, g.logger)
+    g.logger.Debug(1, 'Stage timings: {}'.format(timer.summary()))
+    if not matched_data: g.logger.Debug(1, 'No detection data'); matched_data = {}
+    detach = g.config.get('detach_writeback') == 'yes' and bool(args.get('eventid'))
+    # out of time: the hook exits now and the worker writes the image, notes and push
+    late = deadline.expired() and not detach and bool(args.get('eventid'))
+
+    # --- Fake override ---
+    if args.get('fakeit'):
+        fake_labels = [l.strip() for l in args['fakeit'].split(',') if l.strip()]
+        g.logger.Debug(1, 'Overriding detection with fake labels: {}'.format(fake_labels))
+        matched_data['labels'] = fake_labels
+        matched_data['boxes'] = [[50 + i * 100, 50, 150 + i * 100, 200] for i in range(len(fake_labels))]
+        matched_data['confidences'] = [0.996] * len(fake_labels)
+        matched_data.setdefault('frame_id', 'snapshot')
+        matched_data.setdefault('polygons', g.polygons)
+        matched_data.setdefault('image_dimensions', {})
+        # Rebuild DetectionResult from overridden data
+        from pyzm.models.detection import DetectionResult
+        result = DetectionResult.from_dict(matched_data)
+        result.image = matched_data.get('image')
+
+    if not matched_data.get('labels'):
+        g.logger.Debug(1, 'No detection data')
+        push_no_match = g.config.get('push', {}).get('send_push_on_no_match') == 'yes' and not es_mute
+        if late and push_no_match: deadline.mark('writeback')
+        _print_record(args, matched_data, timer=timer, **_cut(deadline))
+        if push_no_match:
+            g.logger.Info('No detections but send_push_on_no_match is yes, sending push')
+            if not ((detach or late) and writeback.detach(WORKER, args, '', matched_data, no_match=True)):
+                writeback.run(zm, args, '', matched_data, no_match=True)
+        _log_api_calls(zm, stream)
+        return
+
+    # --- Output ---
+    output = utils.format_detection_output(matched_data, g.config)
+    if not output: return
+    pred, jos = output.split('--SPLIT--', 1)
+    g.logger.Info('Prediction string:{}'.format(pred))
+    if late:
+        deadline.mark('writeback'); detach = True
+    cut = _cut(deadline)
+    if args.get('output_format') == 'jsonl':
+        _print_record(args, matched_data, pred, timer, _artifacts(args, matched_data), **cut)
+    else:
+        print(output)
+
+    # --- Annotate and encode once; writing it out is part of the writeback ---
+    jpg = thumb = None
+    if matched_data.get('image') is not None and (g.config['write_image_to_zm'] == 'yes' or g.config['write_debug_image'] == 'yes'):
+        with timer.stage('encode'):
+            jpg, thumb = _encode(result, matched_data)
+        g.logger.Debug(1, 'Encoded annotated image: {} bytes in {:.0f}ms'.format(len(jpg), timer.stages['encode'] * 1000))
+
+    # --- Image, notes, tag and push: in the background with detach_writeback ---
+    animate = g.config.get('create_animation') == 'yes' and bool(args.get('eventid'))
+    if detach:
+        sys.stdout.flush()
+        if writeback.detach(WORKER, args, pred, matched_data, jpg, es_mute, thumb=thumb, animation=animate):
+            _log_api_calls(zm, stream); return
+    if animate:
+        # the clip takes seconds of frame fetches: always in the background
+        sys.stdout.flush()
+        writeback.detach(WORKER, args, pred, matched_data, animation_only=True)
+    writeback.run(zm, args, pred, matched_data, jpg, es_mute, thumb=thumb)
+    _log_api_calls(zm, stream)
+
+
+def main(argv=None):
+    """Run :func:`main_handler` as a script does and return its exit code."""
+    try:
+        code = main_handler(argv)
+        if g.logger: g.logger.Debug(1, 'Closing logs'); g.logger.close()
+        return code
+    except Exception as e:
+        if g.logger: g.logger.Fatal('Unrecoverable error:{} Traceback:{}'.format(e, traceback.format_exc())); g.logger.close()
+        else: print('Unrecoverable error:{} Traceback:{}'.format(e, traceback.format_exc()))
+        return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,91 @@
+"""Pre-detection view of the ES notification mutes.
+
+The ES decides whether to notify only after the hook has run: es_rules.yml
+(``Rules.pm isAllowedInRules``) and ESControl force-mute
+(``getNotificationStatusEsControl``). This module answers the narrower
+question "is monitor X certainly muted right now, whatever the hook finds?"
+so zm_detect can skip inference for it.
+
+Only rules whose outcome doesn't depend on the detection are conclusive: a
+time/day window that matches now and has no ``cause_has``. The first rule
+whose time and day match decides, as in Rules.pm. If that rule has a
+``cause_has``, the answer is "not known" and detection runs.
+"""
+
+import json
+import os
+from datetime import datetime, timedelta
+
+import yaml
+
+ESCONTROL_FORCE_MUTE = -1
+
+# Time::Piece->wdayname, indexed by datetime.weekday()
+_WDAYNAMES = ('Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun')
+
+
+def load_rules(path):
+    with open(path) as f:
+        return yaml.safe_load(f) or {}
+
+
+def escontrol_state(path, mid):
+    """ESControl notification state of *mid* from the ES's JSON copy of *path*, or None."""
+    try:
+        with open(path + '.json') as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return None
+    val = (state.get('notifications') or {}).get(str(mid))
+    try:
+        return int(val)
+    except (TypeError, ValueError):
+        return None
+
+
+def _window_matches(rule, now):
+    # Same comparison as Rules.pm: from/to and "now" are all parsed with
+    # time_format, so only the time of day counts, and a window that wraps
+    # midnight has "from" moved back a day.
+    fmt = rule.get('time_format', '%I:%M %p')
+    d_from = datetime.strptime(str(rule['from']), fmt)
+    d_to = datetime.strptime(str(rule['to']), fmt)
+    if d_to < d_from:
+        d_from -= timedelta(days=1)
+    t = datetime.strptime(now.strftime(fmt), fmt)
+    return d_from <= t <= d_to
+
+
+def rule_mutes(rules, mid, now=None):
+    """Return the es_rules entry that mutes *mid* at *now* regardless of cause, else None."""
+    now = now or datetime.now()
+    monitors = (rules.get('notifications') or {}).get('monitors') or {}
+    entry = monitors.get(int(mid)) if str(mid).isdigit() else None
+    if entry is None:
+        entry = monitors.get(str(mid))
+    rule_list = (entry or {}).get('rules')
+    if not isinstance(rule_list, list):
+        return None
+    for rule in rule_list:
+        if rule.get('action') not in ('mute', 'critical_notify'):
+            # Rules.pm allows on an unknown action
+            return None
+        if not _window_matches(rule, now):
+            continue
+        if 'daysofweek' in rule and _WDAYNAMES[now.weekday()] not in str(rule['daysofweek']):
+            continue
+        if 'cause_has' in rule:
+            # depends on what the hook detects
+            return None
+        return rule if rule['action'] == 'mute' else None
+    return None
+
+
+def muted(mid, rules_file=None, escontrol_file=None, now=None):
+    """Return why *mid* is muted now ('escontrol' or 'es_rules'), or None."""
+    if escontrol_file and escontrol_state(escontrol_file, mid) == ESCONTROL_FORCE_MUTE:
+        return 'escontrol'
+    if rules_file and os.path.isfile(rules_file):
+        if rule_mutes(load_rules(rules_file), mid, now) is not None:
+            return 'es_rules'
+    return None
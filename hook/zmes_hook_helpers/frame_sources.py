@@ -0,0 +1,237 @@
+"""Where zm_detect gets an event's frames from (``frame_source`` in ``stream_sequence``).
+
+``http`` (the default) leaves it to pyzm, which downloads every frame
+through ZM's ``index.php?view=image``. When zm_detect runs on the ZM host it
+can read them from the event directory instead, so neither the web server
+nor its JPEG re-encode is involved:
+
+``local``
+    the JPEGs ZM has already written (``snapshot.jpg``, ``alarm.jpg``,
+    ``00042-capture.jpg``).
+``video``
+    the event's mp4 (passthrough / H.264 storage), opened with OpenCV. Only
+    the wanted frames are decoded: far-apart frames are reached by seeking,
+    which lands on the keyframe before them, close ones by decoding on.
+``mmap``
+    ``snapshot`` and ``alarm`` straight from the monitor's shared memory
+    ring buffer while the event is running (see
+    :mod:`zmes_hook_helpers.shm_frames`).
+
+``frame_source`` may list several, tried in order (``local,video``: the
+JPEGs ZM writes even for video events, then the mp4 for the rest). Frames
+none of them has, e.g. not completely written yet, are downloaded as
+before, with pyzm's retries.
+
+Either way the result has the shape of pyzm's ``Event.extract_frames()``:
+``(frames, image_dimensions)``, frames in ``frame_set`` order and resized to
+``resize`` the way pyzm does it.
+"""
+
+import functools
+import glob
+import os
+
+import zmes_hook_helpers.shm_frames as shm_frames
+
+DEFAULT_SOURCE = 'http'
+DEFAULT_IMAGE_DIGITS = 5  # ZM_EVENT_IMAGE_DIGITS
+
+_JPEG_END = b'\xff\xd9'
+# frames closer than this after the current position are decoded on instead of seeking
+_SEEK_GAP = 25
+
+
+def frame_ids(stream_cfg, event=None):
+    """Frame ids *stream_cfg* asks for, or None if they depend on how long the event is.
+
+    ``snapshot`` becomes the event's max score frame with
+    ``convert_snapshot_to_fid``, as in pyzm.
+    """
+    if stream_cfg.frame_set:
+        ids = [str(f) for f in stream_cfg.frame_set]
+    elif stream_cfg.max_frames:
+        ids = [str(stream_cfg.start_frame + i * stream_cfg.frame_skip) for i in range(stream_cfg.max_frames)]
+    else:
+        return None
+    snapshot_fid = getattr(event, 'max_score_frame_id', None)
+    if stream_cfg.convert_snapshot_to_fid and snapshot_fid:
+        ids = [str(snapshot_fid) if f == 'snapshot' else f for f in ids]
+    return ids
+
+
+def frame_file(eventpath, fid, digits=DEFAULT_IMAGE_DIGITS):
+    """Path of frame *fid* in the event directory."""
+    if fid in ('snapshot', 'alarm'):
+        return os.path.join(eventpath, '{}.jpg'.format(fid))
+    return os.path.join(eventpath, '{:0{}d}-capture.jpg'.format(int(fid), digits))
+
+
+def read_jpeg(path):
+    """Decoded BGR image at *path*, or None if it's missing or still being written."""
+    import cv2
+    import numpy as np
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+    except OSError:
+        return None
+    # ZM writes in place: a file without the end marker is only partly there
+    if not data.rstrip(b'\0').endswith(_JPEG_END):
+        return None
+    return cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+
+
+def resize(image, width):
+    """*image* scaled down to *width*, as pyzm's frame extractor does."""
+    import cv2
+    h, w = image.shape[:2]
+    if not width or w <= width:
+        return image
+    return cv2.resize(image, (width, int(h * width / w)), interpolation=cv2.INTER_AREA)
+
+
+def read_event_dir(event, eventpath, ids, logger=None, digits=DEFAULT_IMAGE_DIGITS):
+    """``local``: frame id -> image for the *ids* whose JPEG is in *eventpath*."""
+    found = {}
+    if not eventpath:
+        return found
+    for fid in ids:
+        image = read_jpeg(frame_file(eventpath, fid, digits))
+        if image is not None:
+            found[fid] = image
+    return found
+
+
+def video_file(eventpath, eid=None):
+    """The event's mp4 in *eventpath* (``<eid>-video.mp4`` if there is one), or None."""
+    if eid is not None:
+        path = os.path.join(eventpath, '{}-video.mp4'.format(eid))
+        if os.path.isfile(path):
+            return path
+    paths = sorted(glob.glob(os.path.join(eventpath, '*.mp4')))
+    return paths[0] if paths else None
+
+
+def frame_number(fid, event=None):
+    """1-based frame number of *fid* (``snapshot``, ``alarm`` or numeric), or None if unknown."""
+    if str(fid).isdigit():
+        return int(fid)
+    if fid == 'snapshot':
+        number = getattr(event, 'max_score_frame_id', None)
+    elif fid == 'alarm':
+        try:
+            number = event.raw().get('Event', {}).get('AlarmFrameId')
+        except Exception:
+            number = None
+    else:
+        number = None
+    return int(number) if number and str(number).isdigit() else None
+
+
+def decode_frames(path, numbers):
+    """Frame number -> image for the 1-based *numbers* in video *path*, decoding as little as possible."""
+    import cv2
+    cap = cv2.VideoCapture(path)
+    found = {}
+    try:
+        if not cap.isOpened():
+            return found
+        pos = 1  # number of the frame the next read() returns
+        for number in sorted(set(numbers)):
+            if number < pos or number - pos > _SEEK_GAP:
+                # FFmpeg seeks to the keyframe before and decodes up to the frame
+                cap.set(cv2.CAP_PROP_POS_FRAMES, number - 1)
+                pos = number
+            while pos < number and cap.grab():
+                pos += 1
+            ok, image = cap.read()
+            if not ok:
+                break
+            found[number] = image
+            pos = number + 1
+    finally:
+        cap.release()
+    return found
+
+
+def read_event_video(event, eventpath, ids, logger=None):
+    """``video``: frame id -> image for the *ids* decoded from the event's mp4."""
+    path = video_file(eventpath, getattr(event, 'id', None)) if eventpath else None
+    numbers = dict((fid, frame_number(fid, event)) for fid in ids)
+    wanted = [n for n in numbers.values() if n]
+    if not path or not wanted:
+        return {}
+    # an mp4 still being recorded has no index yet and doesn't open
+    decoded = decode_frames(path, wanted)
+    if logger and len(decoded) < len(wanted):
+        logger.Debug(2, 'Decoded {} of {} frames from {}'.format(len(decoded), len(wanted), path))
+    return dict((fid, decoded[n]) for fid, n in numbers.items() if n in decoded)
+
+
+def _event_path(event, logger=None):
+    try:
+        return event.path()
+    except Exception as e:
+        if logger:
+            logger.Debug(1, 'Cannot get the event path: {}'.format(e))
+        return None
+
+
+def unpack(fetched):
+    """``(frames, image_dimensions)`` of an ``extract_frames()`` result (older pyzm returns just the frames)."""
+    if isinstance(fetched, tuple):
+        return fetched[0] or [], fetched[1] or {}
+    return fetched or [], {}
+
+
+def extract(event, stream_cfg, source=DEFAULT_SOURCE, eventpath=None, logger=None, digits=DEFAULT_IMAGE_DIGITS,
+            zm=None, shm_path=shm_frames.DEFAULT_PATH):
+    """The event's frames from *source*, like ``event.extract_frames(stream_config=stream_cfg)``.
+
+    *source* is a ``frame_source`` value; *eventpath* defaults to the event's
+    storage path and *zm* (the ZMClient) is needed for ``mmap``. Frames none
+    of the sources has are fetched with ``event.extract_frames()`` for just
+    those ids.
+    """
+    readers = {'local': functools.partial(read_event_dir, digits=digits), 'video': read_event_video,
+               'mmap': functools.partial(shm_frames.read_event, zm=zm, shm_path=shm_path)}
+    sources = [s.strip().lower() for s in str(source or DEFAULT_SOURCE).split(',') if s.strip()]
+    for s in sources:
+        if s != DEFAULT_SOURCE and s not in readers and logger:
+            logger.Error('Unknown frame_source {}, ignoring it'.format(s))
+    sources = [s for s in sources if s in readers]
+    ids = frame_ids(stream_cfg, event) if sources else None
+    if not ids:
+        return event.extract_frames(stream_config=stream_cfg)
+    if 'local' in sources or 'video' in sources:
+        eventpath = eventpath or _event_path(event, logger)
+        if eventpath and not os.path.isdir(eventpath):
+            if logger:
+                logger.Debug(1, 'Event directory {} not available'.format(eventpath))
+            eventpath = None
+
+    found = {}
+    for s in sources:
+        todo = [fid for fid in ids if fid not in found]
+        if not todo:
+            break
+        got = readers[s](event, eventpath, todo, logger)
+        if logger and got:
+            logger.Debug(1, 'Got frame(s) {} from {}'.format(list(got), s))
+        found.update(got)
+    original = next((found[fid].shape[:2] for fid in ids if fid in found), None)
+    found = dict((fid, resize(image, stream_cfg.resize)) for fid, image in found.items())
+
+    missing = [fid for fid in ids if fid not in found]
+    fetched, dims = {}, {}
+    if missing:
+        if logger:
+            logger.Debug(1, 'Frame(s) {} not found locally, downloading them'.format(missing))
+        frames, dims = unpack(event.extract_frames(stream_config=stream_cfg.model_copy(update={'frame_set': missing})))
+        fetched = dict((str(fid), image) for fid, image in frames)
+    frames = [(fid, found[fid] if fid in found else fetched[fid]) for fid in ids if fid in found or fid in fetched]
+
+    if original is None:
+        return frames, dims
+    resized = frames[0][1].shape[:2]
+    return frames, {'original': original, 'resized': resized if resized != original else None}
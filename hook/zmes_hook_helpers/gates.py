@@ -0,0 +1,154 @@
+"""Early-exit gates for zm_detect.
+
+A gate looks only at the parsed config (and the models' label files), the
+alarm cause (``--reason``) and the zone list, and decides that an event cannot produce a detection before
+any frame is downloaded or model loaded. zm_detect then exits with the
+normal "no detection" result. Each firing is logged and counted in
+``<base_data_path>/misc/gate_counts.json``.
+"""
+
+import fcntl
+import json
+import os
+import re
+
+import zmes_hook_helpers.common_params as g
+
+_MODEL_TYPES = ('object', 'face', 'alpr', 'audio')
+
+
+def _enabled(val):
+    # same rules as pyzm's config parser
+    if isinstance(val, bool):
+        return val
+    if isinstance(val, str):
+        return val.lower() in ('yes', 'true', '1')
+    return True
+
+
+def _enabled_models(ml_options):
+    general = ml_options.get('general') or {}
+    for mtype in str(general.get('model_sequence', 'object')).split(','):
+        mtype = mtype.strip()
+        if mtype not in _MODEL_TYPES:
+            continue
+        section = ml_options.get(mtype) or {}
+        for seq in section.get('sequence') or []:
+            if _enabled(seq.get('enabled', True)):
+                yield mtype, section.get('general') or {}, seq
+
+
+def no_enabled_models(ml_options):
+    """True if no model in ml_sequence's model_sequence is enabled."""
+    return next(_enabled_models(ml_options), None) is None
+
+
+def _model_labels(mtype, seq):
+    """Labels model *seq* can report, from its ``<type>_labels`` file; None if unknown."""
+    path = seq.get('{}_labels'.format(mtype))
+    if not path:
+        return None
+    try:
+        with open(path) as f:
+            return [l.strip() for l in f if l.strip()]
+    except OSError:
+        return None
+
+
+def _zone_accepts(zone, label):
+    ignore = zone.get('ignore_pattern')
+    if ignore and re.match(ignore, label):
+        return False
+    return bool(re.match(zone.get('pattern') or '.*', label))
+
+
+def no_matching_pattern(ml_options):
+    """True if no label any enabled model can report gets past the patterns.
+
+    A label has to match ml_sequence's ``pattern``, the ``pattern`` of its
+    model type and, when the monitor has zones from the config file and
+    no ZM zones are imported, be accepted by one of those zones
+    (``detection_pattern`` / ``ignore_pattern``). The labels come from each
+    model's ``<type>_labels`` file. If any enabled model has none (remote,
+    face, ALPR and audio models, or labels embedded in the weights), or a
+    pattern doesn't compile, the gate doesn't fire.
+    """
+    top = (ml_options.get('general') or {}).get('pattern') or '.*'
+    zones = g.polygons if g.config.get('import_zm_zones') != 'yes' else []
+    found_model = False
+    try:
+        for mtype, section, seq in _enabled_models(ml_options):
+            found_model = True
+            labels = _model_labels(mtype, seq)
+            if labels is None:
+                return False
+            pattern = section.get('pattern') or top
+            for label in labels:
+                if (re.match(top, label) and re.match(pattern, label)
+                        and (not zones or any(_zone_accepts(z, label) for z in zones))):
+                    return False
+    except re.error:
+        return False
+    return found_model
+
+
+def no_triggered_zone(reason, zm_zones):
+    """True if only_triggered_zm_zones is on and the alarm cause named none of the ZM zones.
+
+    *zm_zones* is what import_zm_zones() returned: how many ZM zones named
+    in *reason* it imported, or None if it couldn't read them. Zones from
+    the config file don't count.
+    """
+    return bool(reason) and g.config.get('only_triggered_zm_zones') == 'yes' and zm_zones == 0
+
+
+def es_muted(mid):
+    """Return 'escontrol' or 'es_rules' if the ES will not notify for *mid* now, else None.
+
+    Only consulted with es_mute_check: yes. Unreadable or malformed files
+    never mute.
+    """
+    if g.config.get('es_mute_check') != 'yes' or not mid:
+        return None
+    from zmes_hook_helpers import es_rules
+    try:
+        return es_rules.muted(mid, g.config.get('es_rules_file'), g.config.get('escontrol_interface_file'))
+    except Exception as e:
+        g.logger.Debug(1, 'Could not evaluate ES mutes for monitor {}: {}'.format(mid, e))
+        return None
+
+
+def check(reason, ml_options, zm_zones=None):
+    """Return the name of the first gate that fires, or None.
+
+    Zone gates are skipped unless *zm_zones*, the import_zm_zones() result,
+    is known.
+    """
+    if no_enabled_models(ml_options):
+        return 'no_enabled_models'
+    if no_matching_pattern(ml_options):
+        return 'no_matching_pattern'
+    if no_triggered_zone(reason, zm_zones):
+        return 'no_triggered_zone'
+    return None
+
+
+def record(gate):
+    """Count a firing of *gate*; returns how often it has fired so far (0 if the count can't be kept)."""
+    path = os.path.join(g.config['base_data_path'], 'misc', 'gate_counts.json')
+    try:
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        with os.fdopen(fd, 'r+') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                counts = json.load(f)
+            except ValueError:
+                counts = {}
+            counts[gate] = counts.get(gate, 0) + 1
+            f.seek(0)
+            f.truncate()
+            json.dump(counts, f)
+        return counts[gate]
+    except Exception as e:
+        g.logger.Debug(1, 'Could not update gate counts in {}: {}'.format(path, e))
+        return 0
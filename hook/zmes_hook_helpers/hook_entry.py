@@ -0,0 +1,152 @@
+"""``zm_detect_hook``: the ES hook without the bash wrapper.
+
+``zm_event_start.sh`` starts bash, runs ``zm_detect.py`` and pipes it
+through ``grep``. This console entry point takes the same positional
+arguments (event id, monitor id, monitor name, cause, event path), runs
+:func:`zmes_hook_helpers.detect.main_handler` in its own process and prints
+and exits exactly like the script: the ``detected:`` line(s) and 0, or nothing and 1.
+It is meant to be set as ``event_start_hook`` directly::
+
+    event_start_hook: '/opt/zmes_venv/bin/zm_detect_hook --config /etc/zm/objectconfig.yml'
+
+``ZMES_HOOK_OUTPUT_FORMAT=jsonl`` (set by the ES for
+``hook_output_format: jsonl``) is handled as in ``zm_event_start.sh``:
+records are passed on as soon as zm_detect.py prints them, so the ES sees a
+``progressive_results`` provisional record before detection has finished.
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import signal
+import sys
+import traceback
+
+DEFAULT_CONFIG = '/etc/zm/objectconfig.yml'
+_RECORD_PREFIX = '{"zmes_hook":'
+
+
+def _abort(signum, frame):
+    # like the shell wrapper's trap: no output, so no notification
+    os._exit(1)
+
+
+def build_argv(args):
+    """zm_detect.py argv for the parsed hook arguments (what zm_event_start.sh builds)."""
+    argv = []
+    if args.monitorid:
+        argv += ['--monitorid', args.monitorid]
+    argv += ['--eventid', args.eventid, '--config', args.config,
+             '--eventpath', args.eventpath or '', '--reason', args.cause or '']
+    if args.socket:
+        argv += ['--socket', args.socket]
+    if args.output_format == 'jsonl':
+        argv += ['--output-format', 'jsonl']
+    return argv
+
+
+def filter_output(out):
+    """``(stdout, exit code)`` of the hook for zm_detect.py's text output *out*.
+
+    The ``detected:`` lines as ``echo ${RESULTS}`` prints them, and 0 if
+    there were any.
+    """
+    lines = [l for l in out.splitlines() if 'detected:' in l]
+    return ' '.join(' '.join(lines).split()) + '\n', 0 if lines else 1
+
+
+class RecordStream:
+    """zm_detect.py's stdout in jsonl mode: passes each record line on to *dest* as it is printed.
+
+    The exit code is main_handler's, which sets it from the final record.
+    """
+
+    def __init__(self, dest):
+        self._dest = dest
+        self._buf = ''
+
+    def write(self, s):
+        self._buf += s
+        *lines, self._buf = self._buf.split('\n')
+        for line in lines:
+            self._line(line)
+        return len(s)
+
+    def _line(self, line):
+        if not line.startswith(_RECORD_PREFIX):
+            return
+        self._dest.write(line + '\n')
+        self._dest.flush()
+
+    def flush(self):
+        pass
+
+    def close(self):
+        if self._buf:
+            self._line(self._buf)
+            self._buf = ''
+
+
+def run(argv, out=None):
+    """Run zm_detect's main_handler on *argv* with stdout going to *out*.
+
+    Returns ``(what it printed, exit code)``; the text is None when *out* is given.
+    """
+    # imported here so a broken install is reported like a failed run
+    from zmes_hook_helpers import detect
+    import zmes_hook_helpers.common_params as g
+    captured = out is None
+    out = io.StringIO() if captured else out
+    code = 1
+    with contextlib.redirect_stdout(out):
+        try:
+            code = detect.main_handler(argv)
+        except SystemExit as e:
+            code = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+        except Exception as e:
+            msg = 'Unrecoverable error:{} Traceback:{}'.format(e, traceback.format_exc())
+            if g.logger: g.logger.Error(msg)
+            else: sys.stderr.write(msg + '\n')
+        finally:
+            if g.logger: g.logger.close()
+    return (out.getvalue() if captured else None), code
+
+
+def main(argv=None):
+    signal.signal(signal.SIGINT, _abort)
+    signal.signal(signal.SIGTERM, _abort)
+    ap = argparse.ArgumentParser(prog='zm_detect_hook',
+                                 description='Object detection hook for zmeventnotification (zm_event_start.sh without bash)')
+    ap.add_argument('eventid')
+    ap.add_argument('monitorid', nargs='?', default='')
+    ap.add_argument('name', nargs='?', default='')
+    ap.add_argument('cause', nargs='?', default='')
+    ap.add_argument('eventpath', nargs='?', default='')
+    ap.add_argument('--config', default=DEFAULT_CONFIG, help='objectconfig.yml (default: %(default)s)')
+    ap.add_argument('--socket', help='detection server socket, as DETECT_SOCKET in zm_event_start.sh')
+    args = ap.parse_args(argv)
+    args.output_format = 'jsonl' if os.environ.get('ZMES_HOOK_OUTPUT_FORMAT') == 'jsonl' else 'text'
+
+    if args.output_format == 'jsonl':
+        records, code = RecordStream(sys.stdout), 1
+        try:
+            code = run(build_argv(args), records)[1]
+        except Exception as e:
+            sys.stderr.write('Cannot run zm_detect: {}\n'.format(e))
+        records.close()
+        return code
+
+    try:
+        out = run(build_argv(args))[0]
+    except Exception as e:
+        sys.stderr.write('Cannot run zm_detect: {}\n'.format(e))
+        out = ''
+    text, code = filter_output(out)
+    sys.stdout.write(text)
+    sys.stdout.flush()
+    return code
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,225 @@
+"""Shared HTTP connection pool, retries and per-endpoint timings for zm_detect and push.py.
+
+pyzm's ZMAPI keeps one ``requests.Session`` per ZMClient; every ZM call of
+a run goes through it (event and monitor reads, frame downloads, notes,
+token refreshes, the notification list). pyzm mounts its own adapter on it
+(3 retries, 0.5s backoff, default pool). :func:`tune` replaces that adapter
+with one that has
+
+- a keep-alive pool of ``http_pool_size`` connections per host, so the
+  parallel writeback steps don't open and drop connections of their own;
+- ``(http_connect_timeout, http_read_timeout)`` on every call;
+- retries of connection errors and 502/503/504 answers (idempotent methods
+  only, as in pyzm) after ``http_backoff * 2**n`` seconds, at most
+  ``http_backoff_max``, with full jitter so hooks started by the same alarm
+  don't hit ZM again in lockstep.
+
+push.py gets a session set up the same way from :func:`session`; it is
+kept for the life of the process, so ``--serve`` reuses its connection to
+the FCM proxy.
+
+With a *deadline* (``max_event_latency``, a :class:`stages.Deadline`),
+timeouts are cut to what is left of it, but never below
+:data:`MIN_TIMEOUT`. A backoff never sleeps past it, and once it has
+passed, failed calls are not retried.
+
+Each call is counted and timed by endpoint (``GET events``, ``GET
+portal:image``, ``POST <host>``) in :data:`stats`; zm_detect logs the
+totals with the ZM API call count and starts over for the next event.
+"""
+
+import random
+import threading
+import time
+from collections import defaultdict
+from urllib.parse import parse_qs, urlsplit
+
+DEFAULTS = {
+    'http_pool_size': 10,
+    'http_connect_timeout': 5.0,
+    'http_read_timeout': 30.0,
+    'http_retries': 3,
+    'http_backoff': 0.5,
+    'http_backoff_max': 10.0,
+}
+_STATUS_RETRY = (502, 503, 504)
+# shortest timeout a call gets from a deadline that (almost) passed
+MIN_TIMEOUT = 1.0
+
+_lock = threading.Lock()
+_session = None
+
+
+def settings(config=None):
+    """The ``http_*`` values of *config* (g.config), with :data:`DEFAULTS` for those missing."""
+    config = config or {}
+    opts = {}
+    for key, default in DEFAULTS.items():
+        val = config.get(key)
+        opts[key] = type(default)(val) if val not in (None, '') else default
+    return opts
+
+
+def endpoint(method, url):
+    """Name the timings of a *method* request to *url* are kept under."""
+    parts = urlsplit(url)
+    path = parts.path
+    if '/api/' in path:
+        # .../api/events/123.json -> events
+        name = path.split('/api/', 1)[1].split('/', 1)[0].split('.', 1)[0] or 'api'
+    elif path.endswith('index.php'):
+        name = 'portal:{}'.format(parse_qs(parts.query).get('view', ['?'])[0])
+    elif path.endswith('zms'):
+        name = 'zms'
+    else:
+        name = parts.netloc or 'local'
+    return '{} {}'.format(method.upper(), name)
+
+
+class Stats:
+    """Calls, errors and time per endpoint, plus retries; thread safe."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.calls = defaultdict(int)
+            self.errors = defaultdict(int)
+            self.seconds = defaultdict(float)
+            self.slowest = defaultdict(float)
+            self.retries = 0
+
+    def record(self, name, seconds, failed=False):
+        with self._lock:
+            self.calls[name] += 1
+            self.seconds[name] += seconds
+            self.slowest[name] = max(self.slowest[name], seconds)
+            if failed:
+                self.errors[name] += 1
+
+    def retried(self):
+        with self._lock:
+            self.retries += 1
+
+    def summary(self):
+        """``GET events 2x 84ms (max 61ms), ...; 0 errors, 0 retries``, slowest endpoint first."""
+        with self._lock:
+            names = sorted(self.calls, key=lambda n: -self.seconds[n])
+            parts = ['{} {}x {:.0f}ms (max {:.0f}ms)'.format(n, self.calls[n], self.seconds[n] * 1000,
+                                                            self.slowest[n] * 1000) for n in names]
+            return '{}; {} errors, {} retries'.format(', '.join(parts) or 'none', sum(self.errors.values()), self.retries)
+
+
+stats = Stats()
+
+
+def _no_limit():
+    return float('inf')
+
+
+def _retry_class(backoff_max, remaining=_no_limit):
+    from urllib3.util.retry import Retry
+
+    class JitteredRetry(Retry):
+        """urllib3 Retry sleeping a random time up to the exponential backoff ("full jitter").
+
+        Sleeps are cut to ``remaining()`` seconds and there are no more
+        retries once that is 0.
+        """
+
+        def get_backoff_time(self):
+            # from the closure: Retry.new() copies only its constructor arguments
+            backoff = min(backoff_max, super().get_backoff_time(), remaining())
+            return random.uniform(0, backoff) if backoff > 0 else 0
+
+        def is_exhausted(self):
+            return super().is_exhausted() or remaining() <= 0
+
+        def increment(self, *args, **kwargs):
+            retry = super().increment(*args, **kwargs)
+            stats.retried()
+            return retry
+
+    return JitteredRetry
+
+
+def adapter(opts, remaining=_no_limit):
+    """``HTTPAdapter`` with the pool size and retries of *opts* (see :func:`settings`).
+
+    *remaining* returns the seconds retries may still take.
+    """
+    from requests.adapters import HTTPAdapter
+    retries = max(0, int(opts['http_retries']))
+    retry = _retry_class(opts['http_backoff_max'], remaining)(total=retries, connect=retries, read=retries, status=retries,
+                                                   backoff_factor=opts['http_backoff'],
+                                                   status_forcelist=_STATUS_RETRY, raise_on_status=False)
+    size = max(1, int(opts['http_pool_size']))
+    return HTTPAdapter(pool_connections=size, pool_maxsize=size, max_retries=retry)
+
+
+def tune(sess, config=None, deadline=None):
+    """Set up ``requests.Session`` *sess* as described above and return it.
+
+    Safe to call again, e.g. to add the *deadline* of the event.
+    """
+    opts = settings(config)
+    send = sess.request.send if isinstance(sess.request, _Timed) else sess.request
+    timed = _Timed(send, (opts['http_connect_timeout'], opts['http_read_timeout']), deadline)
+    http = adapter(opts, timed.remaining)
+    sess.mount('http://', http)
+    sess.mount('https://', http)
+    sess.request = timed
+    return sess
+
+
+class _Timed:
+    """``Session.request`` with the default timeouts, cut to *deadline*, that records every call in :data:`stats`."""
+
+    def __init__(self, send, timeout, deadline=None):
+        self.send = send
+        self.timeout = timeout
+        self.deadline = deadline
+
+    def remaining(self):
+        return self.deadline.remaining() if self.deadline is not None else float('inf')
+
+    def __call__(self, method, url, *args, **kwargs):
+        # a (connect, read) tuple from the caller is kept; a single number is pyzm's default
+        if not isinstance(kwargs.get('timeout'), tuple):
+            kwargs['timeout'] = self.timeout
+        left = self.remaining()
+        if left != float('inf'):
+            left = max(MIN_TIMEOUT, left)
+            kwargs['timeout'] = tuple(left if t is None else min(t, left) for t in kwargs['timeout'])
+        start, failed = time.perf_counter(), True
+        try:
+            resp = self.send(method, url, *args, **kwargs)
+            failed = resp.status_code >= 400
+            return resp
+        finally:
+            stats.record(endpoint(method, url), time.perf_counter() - start, failed)
+
+
+def tune_zm(zm, config=None, deadline=None):
+    """Tune the session of ZMClient *zm*'s ZMAPI (no-op if it has none)."""
+    sess = getattr(getattr(zm, 'api', None), 'session', None)
+    if sess is not None and hasattr(sess, 'mount'):
+        tune(sess, config, deadline)
+    return zm
+
+
+def session(config=None):
+    """The process-wide session for calls outside pyzm (push.py), created on first use."""
+    global _session
+    with _lock:
+        if _session is None:
+            import requests
+            _session = tune(requests.Session(), config)
+        return _session
+
+
+def timeout(read, config=None):
+    """``(connect, read)`` timeout with the configured connect timeout and *read* seconds."""
+    return settings(config)['http_connect_timeout'], float(read)
@@ -0,0 +1,102 @@
+"""Single JPEG encode of the annotated frame.
+
+zm_detect encodes the annotated frame once with :func:`encode` and writes
+the same bytes to the debug image and to ``objdetect.jpg`` (and queues them
+with a detached writeback), instead of letting each destination run its
+own ``cv2.imwrite``.
+
+``jpeg_encoder: turbojpeg`` uses libjpeg-turbo through the optional
+PyTurboJPEG package; when that isn't installed (or libturbojpeg can't be
+loaded) OpenCV is used.
+"""
+
+import json
+import os
+import re
+
+import zmes_hook_helpers.common_params as g
+
+_turbo = None
+
+
+def _turbojpeg():
+    global _turbo
+    if _turbo is None:
+        try:
+            from turbojpeg import TurboJPEG
+            _turbo = TurboJPEG()
+        except (ImportError, OSError) as e:
+            g.logger.Debug(1, 'turbojpeg not available, encoding with OpenCV: {}'.format(e))
+            _turbo = False
+    return _turbo or None
+
+
+def encode(image, quality=None, encoder=None):
+    """Return *image* (BGR ndarray) as JPEG bytes.
+
+    *quality* and *encoder* default to ``jpeg_quality`` and ``jpeg_encoder``.
+    """
+    quality = int(g.config.get('jpeg_quality', 95) if quality is None else quality)
+    encoder = encoder or g.config.get('jpeg_encoder', 'opencv')
+    if encoder == 'turbojpeg':
+        tj = _turbojpeg()
+        if tj is not None:
+            return tj.encode(image, quality=quality)
+    import cv2
+    ok, buf = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    if not ok:
+        raise ValueError('could not JPEG-encode image of shape {}'.format(getattr(image, 'shape', None)))
+    return buf.tobytes()
+
+
+def thumbnail(image, width):
+    """*image* scaled down to *width* pixels wide, keeping the aspect ratio.
+
+    Returned unchanged if it is not wider than *width*.
+    """
+    h, w = image.shape[:2]
+    width = int(width)
+    if width <= 0 or w <= width:
+        return image
+    import cv2
+    return cv2.resize(image, (width, max(1, round(h * width / w))), interpolation=cv2.INTER_AREA)
+
+
+def relative_event_path(eventpath, mid):
+    """Part of *eventpath* below the ZM storage root (``<mid>/...``), or None.
+
+    ZM lays events out as ``<mid>/<eid>`` (shallow), ``<mid>/<date>/<eid>``
+    (medium) or ``<mid>/<yy>/<mm>/<dd>/<HH>/<MM>/<SS>`` (deep).
+    """
+    parts = os.path.normpath(eventpath).split(os.sep)
+    mid = str(mid)
+    tail = parts[-6:]
+    if len(parts) > 7 and parts[-7] == mid and all(len(p) == 2 and p.isdigit() for p in tail):
+        return '/'.join(parts[-7:])
+    if len(parts) > 3 and parts[-3] == mid and re.match(r'^\d{4}-\d{2}-\d{2}$', parts[-2]):
+        return '/'.join(parts[-3:])
+    if len(parts) > 2 and parts[-2] == mid:
+        return '/'.join(parts[-2:])
+    return None
+
+
+def write(path, data):
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+def write_objdetect(eventpath, data, matched_data, thumb=None):
+    """Write ``objdetect.jpg`` (*data*) and ``objects.json`` to *eventpath*.
+
+    Same files and ``objects.json`` keys as pyzm's ``Event.save_objdetect``,
+    without re-encoding the image. *thumb*, if given, is written as
+    ``objdetect_thumb.jpg``.
+    """
+    os.makedirs(eventpath, exist_ok=True)
+    write(os.path.join(eventpath, 'objdetect.jpg'), data)
+    if thumb is not None:
+        write(os.path.join(eventpath, 'objdetect_thumb.jpg'), thumb)
+    keys = ('labels', 'boxes', 'frame_id', 'confidences', 'image_dimensions')
+    with open(os.path.join(eventpath, 'objects.json'), 'w') as f:
+        json.dump({k: matched_data[k] for k in keys if k in matched_data}, f)
+    return eventpath
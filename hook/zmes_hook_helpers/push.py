@@ -1,15 +1,33 @@
 """Push notification sender for zm_detect.
 
 Reads registered tokens from ZM's Notifications table via pyzm,
-filters by monitor, checks throttle, and sends via FCM cloud function proxy.
+filters by monitor, checks throttle, and sends via FCM cloud function proxy
+over the shared keep-alive session of :mod:`zmes_hook_helpers.http_pool`.
 """
 
 import json
-import requests
 from datetime import datetime
 
+import zmes_hook_helpers.http_pool as http_pool
 
-def send_push_notifications(zm, config, monitor_id, event_id, monitor_name, cause, logger, no_match=False):
+
+def picture_url(template, event_id, no_match=False, event_path=None):
+    """Fill EVENTID and EVENTPATH in a picture_url template.
+
+    Returns None if the template needs EVENTPATH but no objdetect image was
+    written for this event.
+    """
+    url = template.replace('EVENTID', str(event_id))
+    if no_match:
+        url = url.replace('fid=objdetect', 'fid=alarm')
+    if 'EVENTPATH' in url:
+        if no_match or not event_path:
+            return None
+        url = url.replace('EVENTPATH', event_path)
+    return url
+
+
+def send_push_notifications(zm, config, monitor_id, event_id, monitor_name, cause, logger, no_match=False, event_path=None):
     """Send FCM push notifications to all qualifying registered tokens.
 
     Args:
@@ -21,6 +39,8 @@ def send_push_notifications(zm, config, monitor_id, event_id, monitor_name, caus
         cause: str, detection result string (e.g. "person detected").
         logger: pyzm logger instance.
         no_match: bool, if True use fid=alarm instead of objdetect in picture URL.
+        event_path: str, event directory below the ZM storage root, for EVENTPATH
+            in picture_url (e.g. to fetch objdetect_thumb.jpg).
     """
     push_cfg = config.get('push', {})
     if not push_cfg or push_cfg.get('enabled') != 'yes':
@@ -85,17 +105,18 @@ def send_push_notifications(zm, config, monitor_id, event_id, monitor_name, caus
         if push_cfg.get('include_picture') == 'yes':
             pic_url = push_cfg.get('picture_url', '')
             if pic_url:
-                image_url = pic_url.replace('EVENTID', str(event_id))
-                if no_match:
-                    image_url = image_url.replace('fid=objdetect', 'fid=alarm')
-                pic_user = push_cfg.get('picture_portal_username', '')
-                pic_pass = push_cfg.get('picture_portal_password', '')
-                if pic_user:
-                    image_url += '&username={}'.format(pic_user)
-                if pic_pass:
-                    image_url += '&password={}'.format(pic_pass)
-                payload['image_url'] = image_url
-                logger.Debug(1, 'push: image_url={}'.format(image_url.split('&password=')[0]))
+                image_url = picture_url(pic_url, event_id, no_match, event_path)
+                if image_url is None:
+                    logger.Debug(1, 'push: picture_url needs EVENTPATH but no objdetect image was written, sending without picture')
+                else:
+                    pic_user = push_cfg.get('picture_portal_username', '')
+                    pic_pass = push_cfg.get('picture_portal_password', '')
+                    if pic_user:
+                        image_url += '{}username={}'.format('&' if '?' in image_url else '?', pic_user)
+                    if pic_pass:
+                        image_url += '{}password={}'.format('&' if '?' in image_url else '?', pic_pass)
+                    payload['image_url'] = image_url
+                    logger.Debug(1, 'push: image_url={}'.format(image_url.split('password=')[0]))
             else:
                 logger.Debug(1, 'push: include_picture=yes but no picture_url configured')
 
@@ -135,14 +156,14 @@ def send_push_notifications(zm, config, monitor_id, event_id, monitor_name, caus
         try:
             logger.Debug(1, 'push: sending to token ...{} ({})'.format(token_suffix, notif.platform))
 
-            resp = requests.post(
+            resp = http_pool.session(config).post(
                 fcm_url,
                 headers={
                     'Content-Type': 'application/json',
                     'Authorization': fcm_key,
                 },
                 data=json.dumps(payload),
-                timeout=10,
+                timeout=http_pool.timeout(10, config),
             )
 
             body_text = resp.text
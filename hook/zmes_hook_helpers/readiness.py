@@ -0,0 +1,144 @@
+"""Adaptive ``wait`` (``wait_mode: adaptive``): poll for an event's frames instead of sleeping.
+
+With ``wait_mode: fixed`` zm_detect sleeps ``wait`` seconds and then
+downloads the frames, with pyzm's retries on top. In adaptive mode it asks
+for the frames right away; frames that are not there yet (typically
+``alarm`` in the first second of an event) are asked for again after a
+short pause that doubles each time, until all are there or ``wait`` seconds
+have passed. Only then are the rest downloaded the usual way, retries and
+all.
+
+How long each monitor took until all its frames were there is kept in
+``<base_data_path>/misc/frame_readiness.json`` as a moving average. The
+next event of that monitor sleeps most of that time before polling again,
+so a monitor that always needs three seconds isn't asked every quarter
+second.
+"""
+
+import fcntl
+import json
+import os
+import time
+
+import zmes_hook_helpers.common_params as g
+from zmes_hook_helpers import frame_sources, stages
+
+FIRST_STEP = 0.25
+MAX_STEP = 2.0
+# weight of the newest event in the learned time
+_ALPHA = 0.3
+# the learned time is slept minus this share, to be polling when the frames show up
+_LEAD = 0.8
+
+
+def _store_path():
+    return os.path.join(g.config['base_data_path'], 'misc', 'frame_readiness.json')
+
+
+def expected(mid):
+    """Learned seconds until monitor *mid*'s frames are there, or 0 if nothing is known yet."""
+    if not mid:
+        return 0
+    try:
+        with open(_store_path()) as f:
+            return float(json.load(f).get(str(mid), {}).get('seconds', 0))
+    except (OSError, ValueError, AttributeError, TypeError):
+        return 0
+
+
+def learn(mid, seconds):
+    """Fold *seconds* into monitor *mid*'s learned time; returns the new value (0 if it can't be kept)."""
+    if not mid:
+        return 0
+    path = _store_path()
+    try:
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        with os.fdopen(fd, 'r+') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                learned = json.load(f)
+            except ValueError:
+                learned = {}
+            entry = learned.get(str(mid)) or {}
+            if entry.get('events'):
+                seconds = (1 - _ALPHA) * float(entry['seconds']) + _ALPHA * seconds
+            learned[str(mid)] = {'seconds': round(seconds, 3), 'events': int(entry.get('events', 0)) + 1}
+            f.seek(0)
+            f.truncate()
+            json.dump(learned, f)
+        return learned[str(mid)]['seconds']
+    except Exception as e:
+        g.logger.Debug(1, 'Could not update frame readiness in {}: {}'.format(path, e))
+        return 0
+
+
+class Poller:
+    """``extract`` callable for :func:`stages.prefetch_event` that polls *extract* until every frame is there.
+
+    *ceiling* is the longest it polls (``wait``), *expected* the learned time
+    for the monitor. Afterwards ``ready_after`` holds the seconds it took
+    (None if the frames weren't all there by *ceiling*) and ``polls`` how
+    many times it asked.
+    """
+
+    def __init__(self, extract, ceiling, expected=0, deadline=None, logger=None):
+        self.extract = extract
+        self.ceiling = float(ceiling)
+        self.expected = float(expected or 0)
+        self.deadline = deadline or stages.Deadline()
+        self.logger = logger
+        self.ready_after = None
+        self.polls = 0
+
+    def _sleep(self, seconds):
+        self.deadline.sleep(seconds, 'wait')
+
+    def __call__(self, event, stream_cfg):
+        ids = frame_sources.frame_ids(stream_cfg, event)
+        if not ids:
+            # frames depend on the event's length: nothing to poll for
+            if self.logger:
+                self.logger.Debug(1, 'No fixed frame_set to poll for, waiting {:g} seconds'.format(self.ceiling))
+            self._sleep(self.ceiling)
+            return self.extract(event, stream_cfg)
+
+        start = time.perf_counter()
+        ceiling = min(self.ceiling, self.deadline.remaining())
+        found, dims, step, led = {}, {}, FIRST_STEP, False
+        while True:
+            todo = [fid for fid in ids if fid not in found]
+            cfg = stream_cfg.model_copy(update={'frame_set': todo, 'delay': 0, 'max_attempts': 1})
+            frames, got_dims = frame_sources.unpack(self.extract(event, cfg))
+            self.polls += 1
+            found.update((str(fid), image) for fid, image in frames)
+            dims = dims or got_dims
+            elapsed = time.perf_counter() - start
+            if all(fid in found for fid in ids):
+                self.ready_after = elapsed
+                break
+            if elapsed >= ceiling:
+                if self.deadline.expired():
+                    self.deadline.mark('wait')
+                break
+            pause = step
+            if not led and self.expected * _LEAD > elapsed:
+                pause, led = max(step, self.expected * _LEAD - elapsed), True
+            else:
+                step = min(step * 2, MAX_STEP)
+            self._sleep(min(pause, ceiling - elapsed))
+
+        missing = [fid for fid in ids if fid not in found]
+        if self.logger:
+            if missing:
+                self.logger.Debug(1, 'Frame(s) {} not there after {:.1f}s ({} polls), downloading them with retries'.format(
+                    missing, elapsed, self.polls))
+            else:
+                self.logger.Debug(1, 'Frames ready after {:.2f}s ({} polls, expected {:.2f}s)'.format(
+                    elapsed, self.polls, self.expected))
+        if missing:
+            cfg = stages.fit_retries(stream_cfg.model_copy(update={'frame_set': missing, 'delay': 0}),
+                                     self.deadline, self.logger)
+            frames, got_dims = frame_sources.unpack(self.extract(event, cfg))
+            found.update((str(fid), image) for fid, image in frames)
+            dims = dims or got_dims
+        return [(fid, found[fid]) for fid in ids if fid in found], dims
@@ -0,0 +1,275 @@
+"""Persistent detection server for zm_detect.
+
+``zm_detect.py --serve`` listens on a Unix socket and runs each forwarded
+invocation in-process, keeping ``Detector`` instances (and their loaded
+models) warm between events. ``zm_detect.py --socket <path> ...`` is the
+thin client: it sends its argv, prints the server's stdout and exits with
+the server's exit code, so the hook contract is unchanged. stdout is sent
+line by line as it is printed, so a ``progressive_results`` provisional
+record reaches the ES before detection is done, as it would in-process.
+
+Requests are handled one at a time because the hook keeps its state in
+``common_params``; the win comes from skipping interpreter start, imports
+and model load, not from parallelism. The wait is bounded on the client
+side: the server acknowledges a request when it starts on it, and a client
+that got no acknowledgement within ``queue_timeout`` (or no result within
+``result_timeout`` after it) closes the connection and runs the event
+in-process. A request whose client has gone is skipped.
+
+Detectors are cached by their model configuration only; the per-monitor
+settings (``monitor_id`` and ``image_path``, which pick the past-detection
+file) are set on the cached detector for each event by :func:`scope`.
+"""
+
+import io
+import json
+import os
+import signal
+import socket
+import socketserver
+import threading
+import time
+from collections import OrderedDict
+
+DEFAULT_SOCKET = '/run/zmeventnotification/zm_detect.sock'
+DEFAULT_QUEUE_TIMEOUT = 10
+DEFAULT_RESULT_TIMEOUT = 300
+# ml_sequence general keys that differ per monitor but don't change the loaded models
+_SCOPE_KEYS = ('monitor_id', 'image_path')
+# client-only options and whether they take a value
+_CLIENT_ARGS = {'--socket': True, '--socket-timeout': True, '--socket-result-timeout': True}
+
+# Set by serve(). When None, get_detector() builds a fresh Detector per call.
+detector_cache = None
+
+
+class DetectorCache:
+    """LRU cache of Detector instances keyed on the effective ml_sequence, without its per-monitor keys."""
+
+    def __init__(self, size=4):
+        self.size = max(1, int(size))
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(ml_options):
+        general = dict((k, v) for k, v in (ml_options.get('general') or {}).items() if k not in _SCOPE_KEYS)
+        return json.dumps(dict(ml_options, general=general), sort_keys=True, default=str)
+
+    def get(self, ml_options, factory, logger=None):
+        """Return the cached Detector for *ml_options*, building it with *factory* on a miss."""
+        key = self.key(ml_options)
+        with self._lock:
+            detector = self._entries.get(key)
+            if detector is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                if logger:
+                    logger.Debug(1, 'server: reusing warm detector (hits={} misses={})'.format(self.hits, self.misses))
+                return detector
+
+        detector = factory(ml_options)
+        with self._lock:
+            self._entries[key] = detector
+            self.misses += 1
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        if logger:
+            logger.Debug(1, 'server: built new detector ({} cached, {} evicted)'.format(len(self._entries), self.evictions))
+        return detector
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def scope(detector, ml_options, logger=None):
+    """Set *ml_options*' per-monitor settings on a cached *detector*; False if this pyzm can't."""
+    config = getattr(detector, '_config', None)
+    if config is None or not all(hasattr(config, k) for k in _SCOPE_KEYS):
+        if logger:
+            logger.Debug(1, 'server: cannot set monitor_id/image_path on this pyzm Detector, '
+                            'past detections are shared by monitors with the same ml_sequence')
+        return False
+    general = ml_options.get('general') or {}
+    config.monitor_id = general.get('monitor_id')
+    if general.get('image_path'):
+        config.image_path = general['image_path']
+    return True
+
+
+def get_detector(ml_options, factory, logger=None):
+    """Return a Detector for *ml_options*, from the server cache if one is active."""
+    if detector_cache is None:
+        return factory(ml_options)
+    detector = detector_cache.get(ml_options, factory, logger)
+    scope(detector, ml_options, logger)
+    return detector
+
+
+def strip_client_args(argv):
+    """Remove client-only options (--socket, --socket-timeout, ...) from *argv* before forwarding."""
+    out = []
+    skip = False
+    for a in argv:
+        if skip:
+            skip = False
+            continue
+        if a in _CLIENT_ARGS:
+            skip = _CLIENT_ARGS[a]
+            continue
+        if a.split('=', 1)[0] in _CLIENT_ARGS:
+            continue
+        out.append(a)
+    return out
+
+
+class Unavailable(Exception):
+    """The server could not be used for this event; the message says why."""
+
+
+def forward(socket_path, argv, queue_timeout=DEFAULT_QUEUE_TIMEOUT, result_timeout=DEFAULT_RESULT_TIMEOUT,
+            on_output=None):
+    """Send *argv* to a running server.
+
+    Returns ``(exit_code, stdout)``, or ``None`` when no server is listening
+    so the caller can fall back to running detection itself. Raises
+    :class:`Unavailable` when the server did not start on the event within
+    *queue_timeout* seconds or did not finish it *result_timeout* seconds
+    after that; the caller falls back the same way.
+
+    Lines the request prints before it is done are passed to *on_output* as
+    they arrive; without it they are part of the returned stdout.
+    """
+    streamed = []
+    on_output = on_output or streamed.append
+    try:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(queue_timeout)
+        sock.connect(socket_path)
+    except OSError:
+        return None
+    with sock:
+        try:
+            sock.sendall((json.dumps({'argv': list(argv)}) + '\n').encode('utf-8'))
+            with sock.makefile('rb') as f:
+                line = f.readline()
+                if line and json.loads(line.decode('utf-8')).get('started'):
+                    until = time.monotonic() + result_timeout
+                    try:
+                        while True:
+                            sock.settimeout(max(0.001, until - time.monotonic()))
+                            line = f.readline()
+                            resp = json.loads(line.decode('utf-8')) if line else None
+                            if not resp or 'exit' in resp:
+                                break
+                            on_output(resp.get('stdout', ''))
+                    except socket.timeout:
+                        raise Unavailable('no result from {} within {}s'.format(socket_path, result_timeout))
+        except socket.timeout:
+            raise Unavailable('{} did not start on the event within {}s'.format(socket_path, queue_timeout))
+        finally:
+            # tells a server that hasn't started yet that this request is gone
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+    if not line:
+        return None
+    resp = json.loads(line.decode('utf-8'))
+    return int(resp.get('exit', 1)), ''.join(streamed) + resp.get('stdout', '')
+
+
+class _Lines(io.TextIOBase):
+    """stdout of a served request: every complete line goes to *send* as soon as it is written."""
+
+    def __init__(self, send):
+        self._send = send
+        self._buf = ''
+
+    def writable(self):
+        return True
+
+    def write(self, text):
+        self._buf += text
+        if '\n' in self._buf:
+            done, self._buf = self._buf.rsplit('\n', 1)
+            self._send(done + '\n')
+        return len(text)
+
+    def getvalue(self):
+        """What was written after the last complete line."""
+        rest, self._buf = self._buf, ''
+        return rest
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        line = self.rfile.readline()
+        if not line:
+            return
+        try:
+            argv = json.loads(line.decode('utf-8')).get('argv', [])
+        except ValueError:
+            self.wfile.write(b'{"exit": 1, "stdout": ""}\n')
+            return
+        try:
+            self.wfile.write(b'{"started": true}\n')
+            self.wfile.flush()
+        except OSError:
+            return  # the client gave up waiting and runs the event itself
+
+        def send(text):
+            try:
+                self.wfile.write((json.dumps({'stdout': text}) + '\n').encode('utf-8'))
+                self.wfile.flush()
+            except OSError:
+                pass  # the client timed out; the event is finished all the same
+
+        code, out = self.server.handler(strip_client_args(argv), _Lines(send))
+        self.wfile.write((json.dumps({'exit': code, 'stdout': out}) + '\n').encode('utf-8'))
+
+
+class _Server(socketserver.UnixStreamServer):
+    # connections waiting for their turn; clients give up after their queue_timeout anyway
+    request_queue_size = 64
+
+
+def serve(socket_path, handler, cache_size=4):
+    """Serve forwarded invocations on *socket_path* until SIGTERM/SIGINT.
+
+    *handler* is called with each request's argv and a file to use as its
+    stdout, whose lines are sent to the client as they are written. It must
+    return ``(exit_code, rest)``, *rest* being whatever of the output has
+    not been sent yet (``out.getvalue()``).
+    """
+    global detector_cache
+    detector_cache = DetectorCache(cache_size)
+
+    sock_dir = os.path.dirname(socket_path)
+    if sock_dir:
+        os.makedirs(sock_dir, exist_ok=True)
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+
+    srv = _Server(socket_path, _RequestHandler)
+    srv.handler = handler
+    os.chmod(socket_path, 0o660)
+
+    def _stop(sig, frame):
+        # shutdown() blocks until serve_forever() returns, so it can't run on this thread
+        threading.Thread(target=srv.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, _stop)
+    signal.signal(signal.SIGINT, _stop)
+    try:
+        srv.serve_forever()
+    finally:
+        srv.server_close()
+        try:
+            os.unlink(socket_path)
+        except OSError:
+            pass
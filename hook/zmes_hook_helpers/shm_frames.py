@@ -0,0 +1,230 @@
+"""Live frames from a monitor's ZM shared memory (``frame_source: mmap``).
+
+zmc keeps the last ``ImageBufferCount`` images of a monitor in a ring
+buffer in ``/dev/shm/zm.mmap.<mid>``. Right after an event starts its alarm
+frames are still there, so they can be had without a web request, a JPEG
+encode/decode or a ``wait``. The segment is mapped read-only; an image is
+looked at in place and the only copy made of it is the BGR conversion
+detection needs anyway.
+
+Segment layout, as checked against ZM 1.36::
+
+    SharedData | TriggerData | VideoStoreData | timeval[count] | pad to 64 | image[count] [| alarm image]
+
+Each of the three structs starts with its own ``uint32`` size, and
+``SharedData`` has ``last_write_index`` (the newest slot) right after it.
+The segment's total size has to be exactly what this layout needs (zmc
+sizes it as the parts plus 64 bytes for the alignment). A ZM version that
+adds anything after ``VideoStoreData`` fails that check, and its segments
+are not used. Width, height, colours and ``ImageBufferCount`` come from the
+monitor's ZM settings; a segment that doesn't match them is not used
+either.
+
+:func:`write_standin` writes a segment with the same layout, for trying
+this without ZM.
+"""
+
+import mmap
+import os
+import struct
+import time
+
+DEFAULT_PATH = '/dev/shm'
+
+_TIMEVAL = struct.Struct('@qq')
+_ALIGN = 64
+_MAX_HEADER = 1 << 16
+# ZM colours -> cv2 conversion to BGR (ZM stores RGB24 and RGBA32)
+_CONVERSIONS = {1: 'COLOR_GRAY2BGR', 3: 'COLOR_RGB2BGR', 4: 'COLOR_RGBA2BGR'}
+
+
+def segment_path(mid, shm_path=DEFAULT_PATH):
+    return os.path.join(shm_path, 'zm.mmap.{}'.format(mid))
+
+
+def geometry(monitor):
+    """``(width, height, colours, image_buffer_count)`` from a pyzm Monitor (or its API dict)."""
+    raw = monitor.raw() if hasattr(monitor, 'raw') else monitor
+    raw = raw.get('Monitor', raw) if isinstance(raw, dict) else {}
+    width = int(getattr(monitor, 'width', 0) or raw.get('Width') or 0)
+    height = int(getattr(monitor, 'height', 0) or raw.get('Height') or 0)
+    return width, height, int(raw.get('Colours') or 4), int(raw.get('ImageBufferCount') or 0)
+
+
+def pre_event_count(monitor):
+    """The monitor's ``PreEventCount`` (0 if unknown)."""
+    raw = monitor.raw() if hasattr(monitor, 'raw') else monitor
+    raw = raw.get('Monitor', raw) if isinstance(raw, dict) else {}
+    return int(raw.get('PreEventCount') or 0)
+
+
+def _layout(mm, image_size, count):
+    """``(timestamps offset, images offset, last_write_index)`` of segment *mm*, or None if it doesn't fit."""
+    offset, sizes = 0, []
+    for _ in range(3):  # SharedData, TriggerData, VideoStoreData
+        if offset + 4 > len(mm):
+            return None
+        size = struct.unpack_from('@I', mm, offset)[0]
+        if not 4 <= size <= _MAX_HEADER:
+            return None
+        sizes.append(size)
+        offset += size
+    timestamps = offset
+    end = timestamps + count * _TIMEVAL.size
+    # with and without the alarm image zmc keeps after the ring
+    if len(mm) not in (end + count * image_size + _ALIGN, end + (count + 1) * image_size + _ALIGN):
+        return None
+    images = end + -end % _ALIGN
+    last_write_index = struct.unpack_from('@i', mm, 4)[0]
+    if not 0 <= last_write_index < count:
+        return None
+    return timestamps, images, last_write_index
+
+
+def _timestamp(mm, timestamps, slot):
+    sec, usec = _TIMEVAL.unpack_from(mm, timestamps + slot * _TIMEVAL.size)
+    return sec + usec / 1e6
+
+
+def read_frames(mid, width, height, colours, count, since=0, limit=None, shm_path=DEFAULT_PATH, logger=None):
+    """Newest-first ``(timestamp, image)`` from monitor *mid*'s ring buffer, taken no earlier than *since*.
+
+    Images are BGR. Stops at *limit* images, at the first slot older than
+    *since* or not yet written, and where the ring wraps. A slot that zmc
+    overwrites while it is being converted is left out. Returns [] if the
+    segment is missing or doesn't match the geometry.
+    """
+    return _read(mid, width, height, colours, count, since, limit, shm_path, logger)[0]
+
+
+def _read(mid, width, height, colours, count, since=0, limit=None, shm_path=DEFAULT_PATH, logger=None):
+    """:func:`read_frames`, and whether it stopped at an image older than *since* or an unwritten slot.
+
+    Only then is the oldest image returned the first one taken since *since*.
+    """
+    import cv2
+    import numpy as np
+    conversion = _CONVERSIONS.get(colours)
+    if conversion is None or not (width and height and count):
+        if logger:
+            logger.Debug(1, 'Shared memory of monitor {}: unsupported geometry {}x{}x{} ({} images)'.format(
+                mid, width, height, colours, count))
+        return [], False
+    path = segment_path(mid, shm_path)
+    image_size = width * height * colours
+    shape = (height, width, colours) if colours > 1 else (height, width)
+    try:
+        with open(path, 'rb') as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError) as e:
+        if logger:
+            logger.Debug(1, 'Cannot map {}: {}'.format(path, e))
+        return [], False
+    frames, complete = [], False
+    try:
+        layout = _layout(mm, image_size, count)
+        if layout is None:
+            if logger:
+                logger.Debug(1, '{} does not match {}x{}x{} with {} images (or the ZM 1.36 layout)'.format(
+                    path, width, height, colours, count))
+            return [], False
+        timestamps, images, newest = layout
+        previous = None
+        for k in range(min(count, limit or count)):
+            slot = (newest - k) % count
+            stamp = _timestamp(mm, timestamps, slot)
+            if stamp <= 0 or stamp < since:
+                complete = True
+                break
+            if previous is not None and stamp >= previous:
+                break
+            view = np.frombuffer(mm, dtype=np.uint8, count=image_size, offset=images + slot * image_size).reshape(shape)
+            image = cv2.cvtColor(view, getattr(cv2, conversion))
+            del view  # the mmap can't be closed while a view of it exists
+            if _timestamp(mm, timestamps, slot) != stamp:
+                break
+            frames.append((stamp, image))
+            previous = stamp
+    finally:
+        mm.close()
+    return frames, complete
+
+
+def _start(event):
+    start = getattr(event, 'start_time', None)
+    try:
+        return start.timestamp() if start else 0
+    except (AttributeError, OverflowError, ValueError):
+        return 0
+
+
+def read_event(event, eventpath, ids, logger=None, zm=None, shm_path=DEFAULT_PATH):
+    """``mmap``: frame id -> image for ``snapshot`` and ``alarm`` from the monitor's ring buffer.
+
+    ``snapshot`` is the newest image taken since the event started. The
+    event starts with the monitor's ``PreEventCount`` images from before the
+    alarm, so ``alarm`` is the one after those. It is left to the next
+    source when the event's first images are no longer in the buffer, or
+    the alarm image isn't there yet. Other ids are always left to the next
+    source.
+    """
+    wanted = [fid for fid in ids if fid in ('snapshot', 'alarm')]
+    mid = getattr(event, 'monitor_id', None)
+    if not wanted or not mid or zm is None:
+        return {}
+    try:
+        monitor = zm.monitor(int(mid))
+        width, height, colours, count = geometry(monitor)
+        pre = pre_event_count(monitor)
+    except Exception as e:
+        if logger:
+            logger.Debug(1, 'Cannot get monitor {} settings: {}'.format(mid, e))
+        return {}
+    limit = None if 'alarm' in wanted else 1
+    frames, complete = _read(mid, width, height, colours, count, since=_start(event), limit=limit,
+                             shm_path=shm_path, logger=logger)
+    if not frames:
+        return {}
+    found = {}
+    if 'snapshot' in wanted:
+        found['snapshot'] = frames[0][1]
+    if 'alarm' in wanted:
+        if complete and len(frames) > pre:
+            found['alarm'] = frames[-1 - pre][1]
+        elif logger:
+            logger.Debug(1, 'Monitor {}: alarm image (after {} pre-event images) not in shared memory'.format(mid, pre))
+    if logger:
+        logger.Debug(1, 'Monitor {}: {} image(s) of the event in shared memory, newest {:.1f}s old'.format(
+            mid, len(frames), time.time() - frames[0][0]))
+    return found
+
+
+def write_standin(path, images, timestamps, count=None, colours=3, shared_size=760):
+    """Write a stand-in ``zm.mmap.<mid>`` segment holding *images* (BGR, oldest first).
+
+    *timestamps* are their epoch times; *count* is the ring size (at least
+    ``len(images)``, the rest of the slots stay empty). The layout and size
+    are ZM 1.36's; only the fields read here are filled in.
+    """
+    import cv2
+    height, width = images[0].shape[:2]
+    count = count or len(images)
+    image_size = width * height * colours
+    trigger_size, video_store_size = 560, 4128
+    ts_offset = shared_size + trigger_size + video_store_size
+    ts_end = ts_offset + count * _TIMEVAL.size
+    img_offset = ts_end + -ts_end % _ALIGN
+    buf = bytearray(ts_end + (count + 1) * image_size + _ALIGN)
+    struct.pack_into('@Ii', buf, 0, shared_size, len(images) - 1)
+    struct.pack_into('@I', buf, shared_size, trigger_size)
+    struct.pack_into('@I', buf, shared_size + trigger_size, video_store_size)
+    back = {1: cv2.COLOR_BGR2GRAY, 3: cv2.COLOR_BGR2RGB, 4: cv2.COLOR_BGR2RGBA}[colours]
+    for slot, (image, stamp) in enumerate(zip(images, timestamps)):
+        _TIMEVAL.pack_into(buf, ts_offset + slot * _TIMEVAL.size, int(stamp), int(round((stamp % 1) * 1e6)))
+        start = img_offset + slot * image_size
+        buf[start:start + image_size] = cv2.cvtColor(image, back).tobytes()
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(buf)
+    os.replace(tmp, path)
+    return path
@@ -0,0 +1,395 @@
+"""Stage timing and overlap helpers for zm_detect.
+
+ZM login + frame download and model loading don't depend on each other, so
+zm_detect runs them side by side with :func:`run_parallel` and records how
+long each stage took in a :class:`StageTimer`. A :class:`Deadline`
+(``max_event_latency``) bounds them all.
+"""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+
+class StageTimer:
+    """Wall-clock durations of named stages, safe to use from several threads."""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.stages = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - t0)
+
+    def add(self, name, seconds):
+        with self._lock:
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def elapsed(self):
+        return time.perf_counter() - self.start
+
+    def summary(self):
+        with self._lock:
+            parts = ['{}={:.0f}ms'.format(k, v * 1000) for k, v in self.stages.items()]
+        parts.append('total={:.0f}ms'.format(self.elapsed() * 1000))
+        return ' '.join(parts)
+
+
+class Deadline:
+    """Latency budget of one event (``max_event_latency``), counted from *start*.
+
+    *seconds* of 0 means no limit. Stages check it before starting work
+    they can skip; the first one that was cut short is kept in ``cut``.
+    """
+
+    def __init__(self, seconds=0, start=None):
+        self.seconds = float(seconds or 0)
+        self.start = time.perf_counter() if start is None else start
+        self.cut = None
+        self._lock = threading.Lock()
+
+    def remaining(self):
+        if self.seconds <= 0:
+            return float('inf')
+        return max(0.0, self.start + self.seconds - time.perf_counter())
+
+    def expired(self):
+        return self.remaining() <= 0
+
+    def mark(self, stage):
+        with self._lock:
+            if self.cut is None:
+                self.cut = stage
+
+    def sleep(self, seconds, stage):
+        """Sleep *seconds*, but not past the deadline (then *stage* is marked as cut)."""
+        remaining = self.remaining()
+        if seconds > remaining:
+            self.mark(stage)
+            seconds = remaining
+        if seconds > 0:
+            time.sleep(seconds)
+
+
+def fit_retries(stream_cfg, deadline, logger=None):
+    """*stream_cfg*, or a copy whose initial delay and frame retries fit in what is left of *deadline*.
+
+    pyzm retries a frame ``max_attempts`` times, sleeping
+    ``sleep_between_attempts`` in between; attempts that couldn't start in
+    time are dropped.
+    """
+    remaining = deadline.remaining()
+    if remaining == float('inf'):
+        return stream_cfg
+    changes = {}
+    if (stream_cfg.delay or 0) > remaining:
+        changes['delay'] = int(remaining)
+    sleep, attempts = stream_cfg.sleep_between_attempts or 0, stream_cfg.max_attempts or 1
+    if sleep > 0 and attempts > 1:
+        fit = 1 + int(remaining // sleep)
+        if fit < attempts:
+            changes['max_attempts'] = fit
+    if not changes:
+        return stream_cfg
+    if logger:
+        logger.Debug(1, 'max_event_latency: {:.1f}s left, frame fetch limited to {}'.format(remaining, changes))
+    return stream_cfg.model_copy(update=changes)
+
+
+def run_parallel(*funcs):
+    """Run *funcs* concurrently and return their results in order.
+
+    The first exception raised by any of them is re-raised here, after all
+    of them have finished.
+    """
+    if len(funcs) == 1:
+        return [funcs[0]()]
+    with ThreadPoolExecutor(max_workers=len(funcs)) as pool:
+        futures = [pool.submit(f) for f in funcs]
+    return [f.result() for f in futures]
+
+
+def _missing(obj, names):
+    """The attributes in *names* that *obj* doesn't have (pyzm internals the hooks below rely on)."""
+    return [n for n in names if not hasattr(obj, n)]
+
+
+def preload(detector, lazy=False, logger=None):
+    """Build the detector's model pipeline now instead of on the first detect.
+
+    With *lazy*, only model types that always run are loaded. Types gated on
+    ``pre_existing_labels`` (e.g. face after ``person``, alpr after ``car``)
+    get their backends created without weights and load them on the first
+    frame that actually reaches them, which on most events is never.
+
+    This uses pyzm internals (``Detector._ensure_pipeline(lazy=)``,
+    ``ModelPipeline._backends``, ``backend.is_loaded``); with a pyzm that
+    lacks them it logs why and falls back to loading everything, or to
+    pyzm's own load on the first detect.
+    """
+    ensure = getattr(detector, '_ensure_pipeline', None)
+    if ensure is None:
+        if logger:
+            logger.Debug(1, 'This pyzm Detector has no _ensure_pipeline, models load on the first detect')
+        return
+    if not lazy:
+        ensure()
+        return
+    try:
+        pipeline = ensure(lazy=True)
+    except TypeError:
+        if logger:
+            logger.Warning('lazy_model_load needs a newer pyzm (no lazy pipeline), loading all models')
+        ensure()
+        return
+    if _missing(pipeline, ('_backends',)):
+        if logger:
+            logger.Warning('lazy_model_load: this pyzm pipeline has no _backends, loading all models')
+        if hasattr(pipeline, 'load'):
+            pipeline.load()
+        return
+    gated = {mc.type for mc, _ in pipeline._backends if mc.pre_existing_labels}
+    for mc, backend in list(pipeline._backends):
+        name = mc.name or mc.framework
+        loaded = getattr(backend, 'is_loaded', False)
+        if mc.type in gated:
+            if logger and not loaded:
+                logger.Debug(2, 'Deferring load of {} until {} is detected'.format(name, mc.pre_existing_labels))
+            continue
+        if loaded:
+            continue
+        try:
+            backend.load()
+        except Exception as e:
+            # same as ModelPipeline.load(): a model that fails to load is dropped
+            pipeline._backends.remove((mc, backend))
+            if logger:
+                logger.Error('Error loading model {}: {}'.format(name, e))
+
+
+class _WatchedPipeline:
+    """Pipeline proxy that reports every per-frame result."""
+
+    def __init__(self, pipeline, on_result):
+        self._pipeline = pipeline
+        self._on_result = on_result
+
+    def run(self, *args, **kwargs):
+        result = self._pipeline.run(*args, **kwargs)
+        self._on_result(result)
+        return result
+
+    def __getattr__(self, name):
+        return getattr(self._pipeline, name)
+
+
+@contextmanager
+def watch_matches(detector, on_match, logger=None):
+    """Call ``on_match(result)`` for the first frame that matches, while detection goes on.
+
+    pyzm returns only after every frame went through every model. Within the
+    ``with`` block the detector's multi-frame loop hands each frame's result
+    (zones and patterns already applied, ``frame_id`` set) to a check, so a
+    provisional result can be reported early. Errors in *on_match* are
+    logged and don't affect detection. With a pyzm that has no
+    ``Detector._detect_multi_frame`` this logs a warning and does nothing.
+    """
+    multi = getattr(detector, '_detect_multi_frame', None)
+    if multi is None:
+        if logger:
+            logger.Warning('progressive_results: this pyzm Detector has no _detect_multi_frame, '
+                           'results are reported only when detection is done')
+        yield
+        return
+    current, fired = [None], [False]
+
+    def frames_of(frames):
+        for frame_id, image in frames:
+            current[0] = frame_id
+            yield frame_id, image
+
+    def on_result(result):
+        if fired[0] or not getattr(result, 'matched', False):
+            return
+        fired[0] = True
+        result.frame_id = current[0]
+        try:
+            on_match(result)
+        except Exception as e:
+            if logger:
+                logger.Error('Error reporting provisional result: {}'.format(e))
+
+    def detect_multi_frame(frames, zones, pipeline, *args, **kwargs):
+        return multi(frames_of(frames), zones, _WatchedPipeline(pipeline, on_result), *args, **kwargs)
+
+    saved = vars(detector).get('_detect_multi_frame')
+    detector._detect_multi_frame = detect_multi_frame
+    try:
+        yield
+    finally:
+        if saved is None:
+            del detector._detect_multi_frame
+        else:
+            detector._detect_multi_frame = saved
+
+
+class _BudgetedBackend:
+    """Backend proxy that skips the model once the deadline has passed.
+
+    Models always run on the first frame (``state['first']``), so there is
+    a result to pick even when the deadline was gone before detection.
+    """
+
+    def __init__(self, backend, name, deadline, logger=None, state=None):
+        self._backend = backend
+        self._name = name
+        self._deadline = deadline
+        self._logger = logger
+        self._state = state if state is not None else {'first': False}
+
+    def _skip(self):
+        if self._state['first'] or not self._deadline.expired():
+            return False
+        self._deadline.mark('model:{}'.format(self._name))
+        if self._logger:
+            self._logger.Debug(1, 'max_event_latency reached, skipping {}'.format(self._name))
+        return True
+
+    def detect(self, *args, **kwargs):
+        return [] if self._skip() else self._backend.detect(*args, **kwargs)
+
+    def detect_audio(self, *args, **kwargs):
+        return [] if self._skip() else self._backend.detect_audio(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._backend, name)
+
+
+@contextmanager
+def budget(detector, deadline, logger=None):
+    """Make the detector honour *deadline* within the ``with`` block.
+
+    Once it has passed, the remaining frames and models (ALPR and remote
+    ones included) are skipped and pyzm picks the best result among what
+    did run. The first frame is always analysed with every model, so a
+    deadline that passed during ``wait`` or the download still gives the
+    result of that frame rather than none. A model call already in progress is not interrupted. The
+    detector is restored afterwards, so a cached one (``--serve``) is
+    unaffected. Whatever pyzm internals this relies on are missing
+    (``_ensure_pipeline``, ``_backends``, ``_detect_multi_frame``) is
+    logged and left unbudgeted.
+    """
+    ensure = getattr(detector, '_ensure_pipeline', None)
+    pipeline = ensure() if ensure is not None else None
+    backends = getattr(pipeline, '_backends', None)
+    missing = _missing(detector, ('_ensure_pipeline', '_detect_multi_frame'))
+    if pipeline is not None and backends is None:
+        missing.append('ModelPipeline._backends')
+    if missing and logger:
+        logger.Warning('max_event_latency: this pyzm lacks {}, detection may run past the deadline'.format(
+            ', '.join(missing)))
+    # True while the first frame (or the only image) is being analysed
+    state = {'first': True}
+    if backends is not None:
+        pipeline._backends = [(mc, _BudgetedBackend(backend, mc.name or mc.framework, deadline, logger, state))
+                              for mc, backend in backends]
+    multi = getattr(detector, '_detect_multi_frame', None)
+
+    def frames_of(frames):
+        for i, (frame_id, image) in enumerate(frames):
+            state['first'] = i == 0
+            if i and deadline.expired():
+                deadline.mark('detect')
+                if logger:
+                    logger.Debug(1, 'max_event_latency reached, not analysing frame {} and later'.format(frame_id))
+                return
+            yield frame_id, image
+
+    def detect_multi_frame(frames, *args, **kwargs):
+        return multi(frames_of(frames), *args, **kwargs)
+
+    saved = vars(detector).get('_detect_multi_frame')
+    if multi is not None:
+        detector._detect_multi_frame = detect_multi_frame
+    try:
+        yield
+    finally:
+        if backends is not None:
+            # load() may have dropped a backend that failed: keep that
+            pipeline._backends = [(mc, b._backend if isinstance(b, _BudgetedBackend) else b)
+                                  for mc, b in pipeline._backends]
+        if multi is not None:
+            if saved is None:
+                del detector._detect_multi_frame
+            else:
+                detector._detect_multi_frame = saved
+
+
+class PrefetchedEvent:
+    """Event proxy whose extract_frames() returns frames fetched ahead of time."""
+
+    def __init__(self, event, stream_config, frames):
+        self._event = event
+        self._stream_config = stream_config
+        self._frames = frames
+
+    def extract_frames(self, stream_config=None, **kwargs):
+        if stream_config is self._stream_config and not kwargs:
+            return self._frames
+        return self._event.extract_frames(stream_config=stream_config, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._event, name)
+
+
+class PrefetchedZM:
+    """ZMClient proxy that hands out an already fetched event for *eid*."""
+
+    def __init__(self, zm, eid, event):
+        self._zm = zm
+        self._eid = int(eid)
+        self._event = event
+
+    def event(self, eid):
+        if int(eid) == self._eid and self._event is not None:
+            return self._event
+        return self._zm.event(eid)
+
+    def __getattr__(self, name):
+        return getattr(self._zm, name)
+
+
+def prefetch_event(zm, eid, stream_config, frames=True, logger=None, extract=None):
+    """Fetch event *eid* (and, if *frames*, its frames) and return a ZMClient proxy serving them.
+
+    *extract* ``(event, stream_config)`` gets the frames instead of
+    ``event.extract_frames()`` (see :mod:`zmes_hook_helpers.frame_sources`).
+    Errors are logged and leave the fetch to the detector, which then does it
+    the usual way.
+    """
+    try:
+        event = zm.event(int(eid))
+    except Exception as e:
+        if logger:
+            logger.Debug(1, 'Event prefetch failed, deferring to detector: {}'.format(e))
+        return zm
+    fetched = None
+    if frames and hasattr(event, 'extract_frames'):
+        try:
+            if extract is not None:
+                fetched = extract(event, stream_config)
+            else:
+                fetched = event.extract_frames(stream_config=stream_config)
+        except Exception as e:
+            if logger:
+                logger.Debug(1, 'Frame prefetch failed, deferring to detector: {}'.format(e))
+        if fetched is not None:
+            event = PrefetchedEvent(event, stream_config, fetched)
+    return PrefetchedZM(zm, eid, event)
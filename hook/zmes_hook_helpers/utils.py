@@ -7,11 +7,16 @@ import ssl
 import json
 import re
 import ast
+import copy
 import os
 import traceback
+import hashlib
+import tempfile
+import time
 
 import yaml
 import zmes_hook_helpers.common_params as g
+from zmes_hook_helpers import __version__ as _app_version
 
 
 def _deep_merge(base, override):
@@ -30,6 +35,11 @@ def _deep_merge(base, override):
     return merged
 
 
+def _yaml_load(f):
+    """Parse YAML with the libyaml C loader when available."""
+    return yaml.load(f, Loader=getattr(yaml, 'CSafeLoader', yaml.SafeLoader))
+
+
 def format_detection_output(matched_data, config=None):
     """Format detection results into PREFIX detected:labels--SPLIT--JSON.
 
@@ -83,6 +93,35 @@ def format_detection_output(matched_data, config=None):
     return ''
 
 
+HOOK_OUTPUT_VERSION = 1
+
+
+def format_detection_record(matched_data, text='', timings=None, artifacts=None, **extra):
+    """One ``--output-format jsonl`` result as a dict (schema version HOOK_OUTPUT_VERSION).
+
+    *text* is the text part of format_detection_output ('' if nothing was
+    detected), *timings* stage name -> seconds, *artifacts* name -> path of
+    the files the writeback writes. *extra* keys (event_id, gate, ...) are
+    added as given.
+    """
+    record = {
+        'zmes_hook': HOOK_OUTPUT_VERSION,
+        'type': 'result',
+        'detected': bool(text),
+        'text': text,
+        'labels': matched_data.get('labels') or [],
+        'boxes': matched_data.get('boxes') or [],
+        'confidences': matched_data.get('confidences') or [],
+        'frame_id': matched_data.get('frame_id'),
+        'image_dimensions': matched_data.get('image_dimensions'),
+        'model_names': matched_data.get('model_names') or [],
+        'timings_ms': {k: round(v * 1000, 1) for k, v in (timings or {}).items()},
+        'artifacts': artifacts or {},
+    }
+    record.update(extra)
+    return record
+
+
 # converts a string of coordinates 'x1,y1 x2,y2 ...' to a tuple set. We use this
 # to parse the polygon parameters in the config file
 
@@ -105,7 +144,73 @@ def findWholeWord(w):
     return re.compile(r'\b({0})\b'.format(w), flags=re.IGNORECASE).search
 
 
-# Imports zone definitions from ZM via pyzm client
+def _zm_zones_cache_file(mid):
+    return os.path.join(g.config['base_data_path'], 'misc', 'zm_zones', '{}.json'.format(mid))
+
+
+def _fetch_zm_zones(mid, zm_client):
+    """Fetch monitor *mid*'s zones from ZM as plain dicts (before any filtering)."""
+    monitor = zm_client.monitor(int(mid))
+    return [{
+        'name': z.name,
+        'type': z.raw().get('Zone', {}).get('Type'),
+        'points': [list(p) for p in z.points],
+        'pattern': z.pattern,
+        'ignore_pattern': z.ignore_pattern,
+    } for z in monitor.get_zones()]
+
+
+def _cached_zm_zones(mid):
+    """Return the cached zone list for *mid* if it is younger than zm_zones_cache_ttl, else None."""
+    ttl = int(g.config.get('zm_zones_cache_ttl') or 0)
+    if ttl <= 0:
+        return None
+    try:
+        with open(_zm_zones_cache_file(mid)) as f:
+            entry = json.load(f)
+    except (OSError, ValueError):
+        return None
+    age = time.time() - entry.get('fetched', 0)
+    if entry.get('api_portal') != g.config.get('api_portal') or not 0 <= age < ttl:
+        return None
+    g.logger.Debug(2, 'import_zm_zones: using cached zones for monitor {} ({:.0f}s old)'.format(mid, age))
+    return entry['zones']
+
+
+def _store_zm_zones(mid, zones):
+    if int(g.config.get('zm_zones_cache_ttl') or 0) <= 0:
+        return
+    path = _zm_zones_cache_file(mid)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump({'fetched': time.time(), 'api_portal': g.config.get('api_portal'), 'zones': zones}, f)
+        os.replace(tmp, path)
+    except Exception as e:
+        g.logger.Debug(1, 'import_zm_zones: could not cache zones in {}: {}'.format(path, e))
+
+
+def zm_zones_cached(mid):
+    """True if import_zm_zones() can serve monitor *mid* without talking to ZM."""
+    return _cached_zm_zones(mid) is not None
+
+
+def flush_zm_zones_cache(mid=None):
+    """Drop cached ZM zones for monitor *mid*, or for every monitor if *mid* is None."""
+    d = os.path.join(g.config['base_data_path'], 'misc', 'zm_zones')
+    names = ['{}.json'.format(mid)] if mid else (os.listdir(d) if os.path.isdir(d) else [])
+    for name in names:
+        try:
+            os.unlink(os.path.join(d, name))
+            g.logger.Debug(1, 'Removed cached ZM zones {}'.format(name))
+        except FileNotFoundError:
+            pass
+
+
+# Imports zone definitions from ZM via pyzm client.
+# Returns how many zones were imported (0 if the alarm cause named none of them),
+# or None (importing nothing) if the zones aren't cached and zm_client is None.
 def import_zm_zones(mid, reason, zm_client):
 
     match_reason = False
@@ -113,42 +218,58 @@ def import_zm_zones(mid, reason, zm_client):
         match_reason = True if g.config['only_triggered_zm_zones']=='yes' else False
     g.logger.Debug(2,'import_zm_zones: match_reason={} and reason={}'.format(match_reason, reason))
 
-    monitor = zm_client.monitor(int(mid))
-    zones = monitor.get_zones()
+    zones = _cached_zm_zones(mid)
+    if zones is None:
+        if zm_client is None:
+            return None
+        zones = _fetch_zm_zones(mid, zm_client)
+        _store_zm_zones(mid, zones)
 
+    imported = 0
     for z in zones:
-        raw = z.raw().get('Zone', {})
-
-        if raw.get('Type') == 'Inactive':
-            g.logger.Debug(2, 'Skipping {} as it is inactive'.format(z.name))
+        if z['type'] == 'Inactive':
+            g.logger.Debug(2, 'Skipping {} as it is inactive'.format(z['name']))
             continue
 
         if match_reason:
-            if not findWholeWord(z.name)(reason):
-                g.logger.Debug(1,'dropping {} as zones in alarm cause is {}'.format(z.name, reason))
+            if not findWholeWord(z['name'])(reason):
+                g.logger.Debug(1,'dropping {} as zones in alarm cause is {}'.format(z['name'], reason))
                 continue
 
-        name = z.name.replace(' ','_').lower()
-        g.logger.Debug(2,'importing zoneminder polygon: {} [{}]'.format(name, z.points))
+        name = z['name'].replace(' ','_').lower()
+        points = [tuple(p) for p in z['points']]
+        g.logger.Debug(2,'importing zoneminder polygon: {} [{}]'.format(name, points))
         g.polygons.append({
             'name': name,
-            'value': z.points,
-            'pattern': z.pattern,
-            'ignore_pattern': z.ignore_pattern,
+            'value': points,
+            'pattern': z['pattern'],
+            'ignore_pattern': z['ignore_pattern'],
         })
+        imported += 1
+    return imported
 
 
 
 def get_pyzm_config(args):
+    """Set g.config['pyzm_overrides'] for logging setup.
+
+    Returns the compiled config cache entry (None if there is none), to be
+    passed on to process_config() so the cache is only read once.
+    """
     g.config['pyzm_overrides'] = {}
+    entry = load_config_cache(args)
+    if entry is not None:
+        g.config['pyzm_overrides'] = copy.deepcopy(entry['pyzm_overrides'])
+        return entry
     with open(args.get('config')) as f:
-        yml = yaml.safe_load(f)
+        yml = _yaml_load(f)
     if yml and 'general' in yml:
         pyzm_overrides = yml['general'].get('pyzm_overrides')
         if pyzm_overrides and isinstance(pyzm_overrides, dict):
             g.config['pyzm_overrides'] = pyzm_overrides
         elif pyzm_overrides and isinstance(pyzm_overrides, str):
             g.config['pyzm_overrides'] = ast.literal_eval(pyzm_overrides) if pyzm_overrides else {}
+    return None
 
 
 def _coerce_value(val):
@@ -269,9 +390,210 @@ def apply_cli_overrides(overrides):
             g.logger.Warning('Override path invalid ({}): {}'.format(e, path_str))
 
 
-def process_config(args, ctx):
+# Compiled config cache: the result of parsing objectconfig.yml (+ monitor
+# override, path substitution) for one monitor, stored as JSON under
+# <base_data_path>/misc/config_cache and reused until a source file changes.
+# Values that came from the secrets file are stored as references to their
+# token and read from secrets.yml again on load.
+
+_CONFIG_CACHE_FORMAT = 3
+# left out of the cached g.config: set per run by get_pyzm_config() and changed by --debug
+_CONFIG_CACHE_SKIP = ('pyzm_overrides',)
+# process_config() default: read the cache itself
+_NOT_LOADED = object()
+
+
+def _file_fingerprint(path):
+    # Missing files (e.g. a monitors_dir fragment not created yet) are
+    # recorded too, so adding one later invalidates the entry.
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return [path, None, None, None]
+    with open(path, 'rb') as f:
+        digest = hashlib.sha256(f.read()).hexdigest()
+    return [path, st.st_mtime_ns, st.st_size, digest]
+
+
+def _config_cache_file(args):
+    """Cache file for this config + monitor.
+
+    base_data_path is read with a regex so the lookup doesn't need a YAML parse;
+    the config_vals default is used if it can't be found.
+    """
+    config_path = os.path.abspath(args.get('config'))
+    base = g.config_vals['base_data_path']['default']
+    try:
+        with open(config_path) as f:
+            m = re.search(r'^[ \t]+base_data_path:[ \t]*[\'"]?([^\'"\s#]+)', f.read(), re.MULTILINE)
+        if m and m.group(1)[0] == '/':
+            base = m.group(1)
+    except OSError:
+        pass
+    key = '{}|{}|{}'.format(config_path, args.get('monitorid') or '', _app_version)
+    name = hashlib.sha1(key.encode('utf-8')).hexdigest() + '.json'
+    return os.path.join(base, 'misc', 'config_cache', name)
+
+
+def _owned_by_us(path):
+    """True if *path* belongs to this user and only this user can write to it."""
+    st = os.stat(path)
+    return st.st_uid == os.geteuid() and not st.st_mode & 0o022
+
+
+def _read_secrets(path):
+    if not path:
+        return {}
+    with open(path) as f:
+        return (_yaml_load(f) or {}).get('secrets') or {}
+
+
+def _is_secret_value(v):
+    return isinstance(v, (str, int, float)) and not isinstance(v, bool) and v != ''
+
+
+def _to_cache(obj, tokens):
+    """*obj* as JSON-safe data; values in *tokens* ((type, value) -> token) become references."""
+    if isinstance(obj, dict):
+        if all(isinstance(k, str) for k in obj):
+            return {k: _to_cache(v, tokens) for k, v in obj.items()}
+        return {'__items__': [[_to_cache(k, tokens), _to_cache(v, tokens)] for k, v in obj.items()]}
+    if isinstance(obj, (list, tuple)):
+        items = [_to_cache(v, tokens) for v in obj]
+        return {'__tuple__': items} if isinstance(obj, tuple) else items
+    if _is_secret_value(obj) and (type(obj), obj) in tokens:
+        return {'__secret__': tokens[(type(obj), obj)]}
+    return obj
+
+
+def _from_cache(obj, secrets):
+    """Undo :func:`_to_cache`; raises KeyError if a referenced token is gone."""
+    if isinstance(obj, list):
+        return [_from_cache(v, secrets) for v in obj]
+    if not isinstance(obj, dict):
+        return obj
+    if '__secret__' in obj:
+        return secrets[obj['__secret__']]
+    if '__tuple__' in obj:
+        return tuple(_from_cache(v, secrets) for v in obj['__tuple__'])
+    if '__items__' in obj:
+        return dict((_from_cache(k, secrets), _from_cache(v, secrets)) for k, v in obj['__items__'])
+    return {k: _from_cache(v, secrets) for k, v in obj.items()}
+
+
+def load_config_cache(args):
+    """Return the compiled config entry for *args*, or None if missing, stale or not trusted.
+
+    A file (or directory) that another user owns or can write to is not
+    read: it could feed this user any config.
+    """
+    try:
+        path = _config_cache_file(args)
+        if not (_owned_by_us(os.path.dirname(path)) and _owned_by_us(path)):
+            return None
+        with open(path) as f:
+            entry = json.load(f)
+        if entry.get('format') != _CONFIG_CACHE_FORMAT:
+            return None
+        for dep in entry['deps']:
+            if _file_fingerprint(dep[0]) != dep:
+                return None
+        secrets = _read_secrets(entry['config'].get('secrets'))
+        entry['config'] = _from_cache(entry['config'], secrets)
+        entry['polygons'] = _from_cache(entry['polygons'], secrets)
+        return entry
+    except Exception:
+        return None
+
+
+def save_config_cache(args, deps, pyzm_overrides):
+    """Write g.config / g.polygons as the compiled entry for *args* (best effort)."""
+    path = _config_cache_file(args)
+    try:
+        tokens = {}
+        for token, val in _read_secrets(g.config.get('secrets')).items():
+            if _is_secret_value(val):
+                tokens.setdefault((type(val), val), token)
+        entry = {
+            'format': _CONFIG_CACHE_FORMAT,
+            'deps': [_file_fingerprint(d) for d in deps],
+            'pyzm_overrides': pyzm_overrides,
+            'config': _to_cache(dict((k, v) for k, v in g.config.items() if k not in _CONFIG_CACHE_SKIP), tokens),
+            'polygons': _to_cache(g.polygons, tokens),
+        }
+        os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+        if not _owned_by_us(os.path.dirname(path)):
+            raise OSError('{} is not owned by this user or is writable by others'.format(os.path.dirname(path)))
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(entry, f)
+        os.replace(tmp, path)
+        g.logger.Debug(2, 'Wrote compiled config cache: {}'.format(path))
+    except Exception as e:
+        g.logger.Debug(1, 'Could not write compiled config cache {}: {}'.format(path, e))
+
+
+def process_config(args, ctx=None, cache_entry=_NOT_LOADED):
     # parse YAML config file into a dictionary with defaults
+    # (cache_entry: what get_pyzm_config() returned, so the cache isn't read twice)
+    entry = load_config_cache(args) if cache_entry is _NOT_LOADED else cache_entry
+    if entry is not None:
+        g.logger.Info('Reading config from: {} (compiled cache)'.format(args.get('config')))
+        g.config.update(entry['config'])
+        g.config.setdefault('pyzm_overrides', copy.deepcopy(entry['pyzm_overrides']))
+        g.polygons = entry['polygons']
+    else:
+        deps, pyzm_overrides = _compile_config(args)
+        if g.config.get('config_cache') == 'yes':
+            save_config_cache(args, deps, pyzm_overrides)
+
+    # SSL settings
+    if g.config['allow_self_signed'] == 'yes':
+        if ctx is not None:
+            ctx.check_hostname = False
+            ctx.verify_mode = ssl.CERT_NONE
+        g.logger.Debug(1, 'allowing self-signed certs to work...')
+    else:
+        g.logger.Debug(1, 'strict SSL cert checking is on...')
+
+    # Now munge config if testing args provide
+    if args.get('file'):
+        g.config['write_image_to_zm'] = 'no'
+        g.logger.Debug(1, '--file mode: disabled write_image_to_zm')
+
+    if args.get('output_path'):
+        g.logger.Debug(1, 'Output path modified to {}'.format(args.get('output_path')))
+        g.config['image_path'] = args.get('output_path')
+        g.config['write_debug_image'] = 'yes'
+
+    # Apply CLI overrides last — highest priority
+    if args.get('override'):
+        apply_cli_overrides(args['override'])
+
+
+def _substitute_paths(obj, base_data_path):
+    """Recursively replace ${base_data_path} and legacy {{base_data_path}} in strings."""
+    if isinstance(obj, str):
+        obj = obj.replace('${base_data_path}', base_data_path)
+        obj = obj.replace('{{base_data_path}}', base_data_path)
+        return obj
+    elif isinstance(obj, dict):
+        return {k: _substitute_paths(v, base_data_path) for k, v in obj.items()}
+    elif isinstance(obj, list):
+        return [_substitute_paths(item, base_data_path) for item in obj]
+    return obj
+
+
+def _monitor_fragment_path(monitors_dir, mid):
+    """Return the per-monitor config file for *mid* in *monitors_dir*."""
+    return os.path.join(monitors_dir, '{}.yml'.format(mid))
+
 
+def _compile_config(args):
+    """Parse the config files into g.config / g.polygons.
+
+    Returns (files consulted, raw general.pyzm_overrides) for the compiled cache.
+    """
     has_secrets = False
     secrets_file = None
 
@@ -329,8 +651,9 @@ def process_config(args, ctx):
 
     try:
         g.logger.Info('Reading config from: {}'.format(args.get('config')))
+        deps = [args.get('config')]
         with open(args.get('config')) as f:
-            yml = yaml.safe_load(f)
+            yml = _yaml_load(f)
 
         if not yml:
             raise ValueError('Config file is empty or invalid YAML')
@@ -344,8 +667,9 @@ def process_config(args, ctx):
             g.logger.Info('Reading secrets from: {}'.format(secrets_filename))
             has_secrets = True
             g.config['secrets'] = secrets_filename
+            deps.append(secrets_filename)
             with open(secrets_filename) as f:
-                secrets_file = yaml.safe_load(f)
+                secrets_file = _yaml_load(f)
             if not secrets_file:
                 raise ValueError('Secrets file is empty or invalid YAML')
         else:
@@ -382,14 +706,6 @@ def process_config(args, ctx):
         # Handle [push] section as nested dict
         g.config['push'] = _resolve_secret(yml.get('push', {}))
 
-        # SSL settings
-        if g.config['allow_self_signed'] == 'yes':
-            ctx.check_hostname = False
-            ctx.verify_mode = ssl.CERT_NONE
-            g.logger.Debug(1, 'allowing self-signed certs to work...')
-        else:
-            g.logger.Debug(1, 'strict SSL cert checking is on...')
-
         g.polygons = []
 
         # Check if we have custom overrides for this monitor
@@ -405,6 +721,17 @@ def process_config(args, ctx):
             if monitor_cfg is None:
                 monitor_cfg = monitors.get(str(mid))
 
+            # One file per monitor in monitors_dir; merged over any inline block
+            if g.config.get('monitors_dir'):
+                fragment = _monitor_fragment_path(
+                    _substitute_paths(g.config['monitors_dir'], str(g.config['base_data_path'])), mid)
+                deps.append(fragment)
+                if os.path.isfile(fragment):
+                    g.logger.Debug(1, 'Reading monitor config from: {}'.format(fragment))
+                    with open(fragment) as f:
+                        fragment_cfg = _yaml_load(f) or {}
+                    monitor_cfg = _deep_merge(monitor_cfg or {}, fragment_cfg)
+
             if monitor_cfg:
                 # Process zone definitions
                 zones = monitor_cfg.get('zones', {})
@@ -460,38 +787,20 @@ def process_config(args, ctx):
     g.logger.Debug(3, 'Doing path substitution for base_data_path')
     base_data_path = str(g.config.get('base_data_path', '/var/lib/zmeventnotification'))
 
-    def _substitute_paths(obj):
-        """Recursively replace ${base_data_path} and legacy {{base_data_path}} in strings."""
-        if isinstance(obj, str):
-            obj = obj.replace('${base_data_path}', base_data_path)
-            obj = obj.replace('{{base_data_path}}', base_data_path)
-            return obj
-        elif isinstance(obj, dict):
-            return {k: _substitute_paths(v) for k, v in obj.items()}
-        elif isinstance(obj, list):
-            return [_substitute_paths(item) for item in obj]
-        return obj
-
     # Substitute flat string config values
     for gk, gv in g.config.items():
         if isinstance(gv, str):
-            g.config[gk] = _substitute_paths(gv)
+            g.config[gk] = _substitute_paths(gv, base_data_path)
 
     # Substitute nested structures (ml_sequence, stream_sequence)
     for gk in ('ml_sequence', 'stream_sequence'):
         if gk in g.config and isinstance(g.config[gk], dict):
-            g.config[gk] = _substitute_paths(g.config[gk])
-
-    # Now munge config if testing args provide
-    if args.get('file'):
-        g.config['write_image_to_zm'] = 'no'
-        g.logger.Debug(1, '--file mode: disabled write_image_to_zm')
-
-    if args.get('output_path'):
-        g.logger.Debug(1, 'Output path modified to {}'.format(args.get('output_path')))
-        g.config['image_path'] = args.get('output_path')
-        g.config['write_debug_image'] = 'yes'
-
-    # Apply CLI overrides last — highest priority
-    if args.get('override'):
-        apply_cli_overrides(args['override'])
+            g.config[gk] = _substitute_paths(g.config[gk], base_data_path)
+
+    pyzm_overrides = {}
+    raw = ((yml or {}).get('general') or {}).get('pyzm_overrides')
+    if raw and isinstance(raw, dict):
+        pyzm_overrides = raw
+    elif raw and isinstance(raw, str):
+        pyzm_overrides = ast.literal_eval(raw)
+    return deps, pyzm_overrides
@@ -0,0 +1,395 @@
+"""Post-detection writeback: objdetect image, event notes, tag and push.
+
+The steps don't depend on each other and each waits on its own HTTP or
+disk round trip, so :func:`run` does them side by side, timing each and
+logging its errors without stopping the rest.
+
+zm_detect runs them right after printing its result. With
+``detach_writeback: yes`` it instead records the work as a job in
+``<base_data_path>/misc/writeback/`` and starts a detached
+``zm_detect.py --writeback-worker``, so the ES gets the result without
+waiting on ZM API round trips. ``create_animation`` clips are always made by
+a worker, as part of the job or as a job of their own.
+
+At most ``writeback_workers`` workers run at once, each holding one flock'd
+``slot-N.lock``. A worker drains every pending job before it exits. A job is
+claimed by renaming ``<name>.job`` to ``<name>.run-<pid>``; if that worker
+dies, the next worker puts the job back in the queue (up to
+``_MAX_ATTEMPTS`` times), so a crash doesn't lose notes, tags or pushes.
+"""
+
+import fcntl
+import json
+import os
+import shutil
+import subprocess
+import threading
+import time
+
+import zmes_hook_helpers.common_params as g
+from zmes_hook_helpers import jpeg
+from zmes_hook_helpers.stages import StageTimer, run_parallel
+
+_JOB_FORMAT = 1
+_MAX_ATTEMPTS = 3
+_IMAGE_WAIT_SECONDS = 10
+
+
+def journal_dir(config=None):
+    return os.path.join((config or g.config)['base_data_path'], 'misc', 'writeback')
+
+
+def _jsonable(o):
+    # numpy scalars/arrays that can end up in matched_data
+    if hasattr(o, 'tolist'):
+        return o.tolist()
+    return str(o)
+
+
+def try_push(zm, args, cause, no_match=False, event_path=None):
+    """Send FCM push if push is enabled and eventid/monitorid are available.
+
+    *event_path* (below the storage root) fills EVENTPATH in picture_url.
+    """
+    if not (g.config.get('push', {}).get('enabled') == 'yes'
+            and args.get('eventid') and args.get('monitorid')):
+        return
+    try:
+        from zmes_hook_helpers.push import send_push_notifications
+        mon_name = 'Monitor {}'.format(args['monitorid'])
+        try:
+            mon = zm.monitor(int(args['monitorid']))
+            if mon:
+                mon_name = mon.name
+        except Exception:
+            pass
+        send_push_notifications(
+            zm, g.config, args['monitorid'], args['eventid'],
+            mon_name, cause, g.logger, no_match=no_match, event_path=event_path)
+    except Exception as e:
+        g.logger.Error('Push notification error: {}'.format(e))
+
+
+def debug_image_path(args, matched_data):
+    stream = (args.get('eventid') or args.get('file') or '').strip()
+    return os.path.join(g.config['image_path'], '{}-{}-debug.jpg'.format(os.path.basename(stream), matched_data.get('frame_id')))
+
+
+def _step(timer, name, func):
+    # one step's failure is logged and doesn't affect the others
+    with timer.stage(name):
+        try:
+            func()
+        except Exception as e:
+            g.logger.Error('Writeback step {} failed: {}'.format(name, e))
+
+
+def run(zm, args, pred, matched_data, jpg=None, es_mute=None, no_match=False, ev=None, thumb=None):
+    """Write back the result of a detection run for event ``args['eventid']``.
+
+    *jpg* is the annotated frame, already JPEG-encoded by
+    :func:`zmes_hook_helpers.jpeg.encode` (or None), *thumb* its push-sized
+    copy. With *no_match* only the
+    send_push_on_no_match push is done. *ev* is fetched from *zm* if needed
+    and not given.
+
+    The objdetect image, notes, tag and push don't depend on each other, so
+    they run side by side; the steps that need *ev* share one fetch. Only a
+    push with a picture waits for ``objdetect.jpg`` to be written. Returns
+    the :class:`~zmes_hook_helpers.stages.StageTimer` with one entry per
+    step that ran.
+    """
+    timer = StageTimer()
+    eid = args.get('eventid')
+    steps = []
+
+    event_lock = threading.Lock()
+    fetched = [ev]
+
+    def event():
+        with event_lock:
+            if fetched[0] is None and eid and zm is not None:
+                with timer.stage('event'):
+                    try:
+                        fetched[0] = zm.event(int(eid))
+                    except Exception as e:
+                        g.logger.Error('Error fetching event: {}'.format(e))
+                        fetched[0] = False
+            return fetched[0] or None
+
+    if no_match:
+        if not es_mute:
+            steps.append(('push', lambda: try_push(zm, args, args.get('reason') or '', no_match=True)))
+        return _run_steps(timer, steps)
+
+    # --- Write images ---
+    if jpg is not None and g.config.get('write_debug_image') == 'yes':
+        def debug_image():
+            jpeg.write(debug_image_path(args, matched_data), jpg)
+        steps.append(('debug_image', debug_image))
+
+    image_written = threading.Event()
+    written_to = []
+    if jpg is not None and g.config.get('write_image_to_zm') == 'yes':
+        def objdetect():
+            try:
+                eventpath = args.get('eventpath') or None
+                if not eventpath:
+                    ev = event()
+                    eventpath = ev.path() if ev else None
+                if not eventpath:
+                    g.logger.Debug(1, 'No event path available, skipping write_image_to_zm')
+                    return
+                jpeg.write_objdetect(eventpath, jpg, matched_data, thumb)
+                written_to.append(eventpath)
+                g.logger.Debug(1, 'Wrote objdetect artifacts to {}'.format(eventpath))
+            finally:
+                image_written.set()
+        steps.append(('objdetect', objdetect))
+    else:
+        image_written.set()
+
+    # --- Update ZM event notes ---
+    if args.get('notes') and eid:
+        def notes():
+            ev = event()
+            if not ev:
+                return
+            old = ev.notes or ''
+            parts = old.split('Motion:') if old else ['']
+            new = pred + ('| Motion:' + parts[1] if len(parts) > 1 else '')
+            if new == old:
+                g.logger.Debug(1, 'Event notes already up to date')
+                return
+            ev.update_notes(new)
+        steps.append(('notes', notes))
+
+    # --- Tag detected objects in ZM ---
+    if g.config.get('tag_detected_objects') == 'yes' and eid and matched_data.get('labels'):
+        def tag():
+            ev = event()
+            if not ev:
+                return
+            g.logger.Debug(1, 'Tagging event {} with labels: {}'.format(eid, matched_data['labels']))
+            ev.tag(matched_data['labels'])
+            g.logger.Debug(1, 'Tagging complete for event {}'.format(eid))
+        steps.append(('tag', tag))
+
+    # --- Push notifications ---
+    if not es_mute:
+        def push():
+            # the phone fetches picture_url as soon as the push arrives
+            if g.config.get('push', {}).get('include_picture') == 'yes' and not image_written.wait(_IMAGE_WAIT_SECONDS):
+                g.logger.Debug(1, 'objdetect.jpg not written after {}s, pushing anyway'.format(_IMAGE_WAIT_SECONDS))
+            event_path = jpeg.relative_event_path(written_to[0], args.get('monitorid')) if written_to else None
+            try_push(zm, args, pred, event_path=event_path)
+        steps.append(('push', push))
+
+    return _run_steps(timer, steps)
+
+
+def _run_steps(timer, steps):
+    if steps:
+        run_parallel(*[(lambda n=n, f=f: _step(timer, n, f)) for n, f in steps])
+        g.logger.Debug(1, 'Writeback timings: {}'.format(timer.summary()))
+    return timer
+
+
+# --- Journal ---
+
+def submit(args, pred, matched_data, jpg=None, es_mute=None, no_match=False, d=None, thumb=None,
+           animation=False, animation_only=False):
+    """Journal a writeback job and return its path.
+
+    With *animation* the worker also makes the ``create_animation`` clip;
+    with *animation_only* that is all it does. The job only becomes visible
+    to workers once it is complete on disk.
+    """
+    d = d or journal_dir()
+    os.makedirs(d, exist_ok=True)
+    name = '{}-{}'.format(time.time_ns(), args.get('eventid') or 0)
+    tmp = os.path.join(d, '{}.tmp-{}'.format(name, os.getpid()))
+    os.makedirs(tmp)
+    job = {
+        'format': _JOB_FORMAT,
+        'created': time.time(),
+        'attempts': 0,
+        'args': args,
+        'pred': pred,
+        'matched_data': {k: v for k, v in (matched_data or {}).items() if k != 'image'},
+        'es_mute': es_mute,
+        'no_match': no_match,
+        'animation': animation or animation_only,
+        'animation_only': animation_only,
+    }
+    try:
+        if jpg is not None:
+            jpeg.write(os.path.join(tmp, 'objdetect.jpg'), jpg)
+        if thumb is not None:
+            jpeg.write(os.path.join(tmp, 'objdetect_thumb.jpg'), thumb)
+        _write_job(tmp, job)
+        path = os.path.join(d, name + '.job')
+        os.rename(tmp, path)
+    except Exception:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+    return path
+
+
+def _write_job(path, job):
+    tmp = os.path.join(path, 'job.json.tmp')
+    with open(tmp, 'w') as f:
+        json.dump(job, f, default=_jsonable)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, os.path.join(path, 'job.json'))
+
+
+def load_job(path):
+    with open(os.path.join(path, 'job.json')) as f:
+        return json.load(f)
+
+
+def load_jpg(path, name='objdetect.jpg'):
+    """Encoded annotated image (or *name*) journaled with the job at *path*, or None."""
+    try:
+        with open(os.path.join(path, name), 'rb') as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+def pending(d):
+    try:
+        return sorted(n for n in os.listdir(d) if n.endswith('.job'))
+    except FileNotFoundError:
+        return []
+
+
+def _alive(pid):
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except (PermissionError, ValueError):
+        return True
+    return True
+
+
+def recover(d):
+    """Requeue jobs claimed by workers that died and drop half-written ones.
+
+    Returns the number of jobs put back in the queue.
+    """
+    requeued = 0
+    for n in os.listdir(d):
+        path = os.path.join(d, n)
+        for marker in ('.run-', '.tmp-'):
+            base, sep, pid = n.rpartition(marker)
+            if sep and pid.isdigit() and not _alive(pid):
+                break
+        else:
+            continue
+        if marker == '.tmp-':
+            shutil.rmtree(path, ignore_errors=True)
+            continue
+        try:
+            job = load_job(path)
+            job['attempts'] = job.get('attempts', 0) + 1
+            if job['attempts'] >= _MAX_ATTEMPTS:
+                g.logger.Error('Writeback job {} failed {} times, dropping it'.format(base, job['attempts']))
+                shutil.rmtree(path, ignore_errors=True)
+                continue
+            _write_job(path, job)
+            os.rename(path, os.path.join(d, base + '.job'))
+            g.logger.Info('Requeued writeback job {} from dead worker {}'.format(base, pid))
+            requeued += 1
+        except (OSError, ValueError) as e:
+            # another worker got to it first, or the job is unreadable
+            g.logger.Debug(1, 'Could not requeue writeback job {}: {}'.format(n, e))
+    return requeued
+
+
+def claim(d):
+    """Take the oldest pending job; returns its new path or None."""
+    for n in pending(d):
+        dst = os.path.join(d, '{}.run-{}'.format(n[:-len('.job')], os.getpid()))
+        try:
+            os.rename(os.path.join(d, n), dst)
+            return dst
+        except OSError:
+            continue
+    return None
+
+
+def _acquire_slot(d, workers):
+    for i in range(max(1, int(workers))):
+        fd = os.open(os.path.join(d, 'slot-{}.lock'.format(i)), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return fd
+        except OSError:
+            os.close(fd)
+    return None
+
+
+def work(handler, workers=2, d=None):
+    """Run ``handler(path, job)`` on pending jobs until none are left.
+
+    Returns the number of jobs run. If all *workers* slots are taken, returns
+    0 right away: the running workers will pick the jobs up.
+    """
+    d = d or journal_dir()
+    os.makedirs(d, exist_ok=True)
+    done = 0
+    while True:
+        fd = _acquire_slot(d, workers)
+        if fd is None:
+            return done
+        try:
+            recover(d)
+            while True:
+                path = claim(d)
+                if path is None:
+                    break
+                try:
+                    handler(path, load_job(path))
+                except Exception as e:
+                    g.logger.Error('Writeback job {} failed: {}'.format(os.path.basename(path), e))
+                finally:
+                    shutil.rmtree(path, ignore_errors=True)
+                done += 1
+        finally:
+            os.close(fd)
+        # a job queued while we held the slot may have seen all slots taken
+        if not pending(d):
+            return done
+
+
+def spawn_worker(command, config_file):
+    """Start ``command --writeback-worker`` (an argv list) fully detached from the hook's stdout/stderr."""
+    return subprocess.Popen(list(command) + ['--writeback-worker', '-c', config_file],
+                            stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                            stderr=subprocess.DEVNULL, close_fds=True, start_new_session=True)
+
+
+def detach(command, args, pred, matched_data, jpg=None, es_mute=None, no_match=False, thumb=None,
+           animation=False, animation_only=False):
+    """Journal the writeback and hand it to a background worker.
+
+    Returns False if the job could not be journaled, in which case the
+    caller should write back inline.
+    """
+    try:
+        path = submit(args, pred, matched_data, jpg, es_mute, no_match, thumb=thumb,
+                      animation=animation, animation_only=animation_only)
+    except Exception as e:
+        g.logger.Error('Could not journal writeback, running it inline: {}'.format(e))
+        return False
+    g.logger.Debug(1, 'Queued writeback job {}'.format(os.path.basename(path)))
+    try:
+        spawn_worker(command, args['config'])
+    except Exception as e:
+        # the job stays queued for the next worker
+        g.logger.Error('Could not start writeback worker: {}'.format(e))
+    return True
@@ -0,0 +1,105 @@
+"""Per-invocation cache and call counter for ZM API requests.
+
+Several parts of one zm_detect run ask ZM for the same objects: the event is
+read by the writeback steps (notes, tag, push); the monitor list is read for
+the push title; the notifications list by push.py. :func:`attach` wraps the
+``request`` method of a ZMClient's ``ZMAPI`` so those GETs go to ZM once per
+run, and counts every request that does, so the per-event total can be
+logged.
+
+The event itself changes while it is being recorded: frame selection
+(snapshot -> MaxScoreFrameId), the adaptive wait and pyzm's frame retries
+must see new frames and a new max score. So ``events/<id>`` is only cached
+once detection is done and :func:`settle` was called; the monitor and
+notification lists are cached from the start.
+
+Any PUT/POST/DELETE drops the cached responses of the same kind (a notes
+update drops the cached event), so nothing reads back stale data it wrote
+itself.
+"""
+
+import re
+import threading
+from collections import Counter
+
+_CACHEABLE = re.compile(r'^(monitors|monitors/\d+|notifications)\.json$')
+# cached only after settle(): these change until the event's frames have been read
+_CACHEABLE_SETTLED = re.compile(r'^events/\d+\.json$')
+
+
+def _kind(endpoint):
+    # 'events/123.json' -> 'events', 'frames/index/EventId:1.json' -> 'frames'
+    return endpoint.split('/', 1)[0].split('.', 1)[0] or 'api'
+
+
+class CallCache:
+    """Installed on one ZMAPI instance by :func:`attach`."""
+
+    def __init__(self, api):
+        self._real = api.request
+        self._base = api.api_url.rstrip('/') + '/'
+        self._lock = threading.Lock()
+        self._responses = {}
+        self.settled = False
+        self.calls = Counter()
+        self.hits = Counter()
+        api.request = self.request
+
+    def request(self, url, method='get', params=None, payload=None, reauth=True):
+        method = method.lower()
+        endpoint = url[len(self._base):].split('?', 1)[0] if url.startswith(self._base) else None
+        kind = _kind(endpoint) if endpoint is not None else 'portal'
+        cacheable = method == 'get' and not params and endpoint is not None and bool(
+            _CACHEABLE.match(endpoint) or (self.settled and _CACHEABLE_SETTLED.match(endpoint)))
+        with self._lock:
+            if cacheable and endpoint in self._responses:
+                self.hits[kind] += 1
+                return self._responses[endpoint]
+            self.calls['{} {}'.format(method.upper(), kind)] += 1
+        resp = self._real(url, method=method, params=params, payload=payload, reauth=reauth)
+        with self._lock:
+            if cacheable:
+                self._responses[endpoint] = resp
+            elif method != 'get':
+                for ep in [ep for ep in self._responses if _kind(ep) == kind]:
+                    del self._responses[ep]
+        return resp
+
+    def api_calls(self):
+        """Requests made to the ZM API (portal requests such as frame images not included)."""
+        return sum(n for k, n in self.calls.items() if not k.endswith(' portal'))
+
+    def summary(self):
+        with self._lock:
+            api = ', '.join('{}={}'.format(k, n) for k, n in sorted(self.calls.items()) if not k.endswith(' portal'))
+            portal = sum(n for k, n in self.calls.items() if k.endswith(' portal'))
+            hits = sum(self.hits.values())
+        return '{} ({}), {} served from cache; portal requests: {}'.format(self.api_calls(), api or 'none', hits, portal)
+
+
+def _api(zm):
+    api = getattr(zm, 'api', None) if zm is not None else None
+    return api if hasattr(api, 'request') else None
+
+
+def of(zm):
+    """The :class:`CallCache` attached to ZMClient *zm*, or None."""
+    api = _api(zm)
+    existing = getattr(api.request, '__self__', None) if api is not None else None
+    return existing if isinstance(existing, CallCache) else None
+
+
+def settle(zm):
+    """Cache event reads of ZMClient *zm* from now on (called once detection is done)."""
+    calls = of(zm)
+    if calls is not None:
+        calls.settled = True
+    return calls
+
+
+def attach(zm):
+    """Install a :class:`CallCache` on ZMClient *zm* and return it (None if *zm* has no ZMAPI)."""
+    api = _api(zm)
+    if api is None:
+        return None
+    return of(zm) or CallCache(api)
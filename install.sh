@@ -520,12 +520,16 @@ install_hook() {
 
     install -m 755 -o "${WEB_OWNER}" hook/zm_detect.py "${TARGET_BIN_HOOK}"
     install -m 755 -o "${WEB_OWNER}" hook/zm_train_faces.py "${TARGET_BIN_HOOK}"
+    install -m 644 -o "${WEB_OWNER}" hook/zm_detect.service "${TARGET_BIN_HOOK}"
 
     # Fix hardcoded paths in installed scripts to match TARGET_CONFIG / TARGET_BIN_HOOK
     sed -i "s|CONFIG_FILE=\"/etc/zm/objectconfig.yml\"|CONFIG_FILE=\"${TARGET_CONFIG}/objectconfig.yml\"|" \
         "${TARGET_BIN_HOOK}/zm_event_start.sh"
     sed -i "s|/var/lib/zmeventnotification/bin/zm_detect.py|${TARGET_BIN_HOOK}/zm_detect.py|g" \
-        "${TARGET_BIN_HOOK}/zm_event_start.sh"
+        "${TARGET_BIN_HOOK}/zm_event_start.sh" \
+        "${TARGET_BIN_HOOK}/zm_detect.service"
+    sed -i "s|^User=www-data|User=${WEB_OWNER}|;s|^Group=www-data|Group=${WEB_GROUP}|" \
+        "${TARGET_BIN_HOOK}/zm_detect.service"
     sed -i "s|default='/etc/zm/objectconfig.yml'|default='${TARGET_CONFIG}/objectconfig.yml'|" \
         "${TARGET_BIN_HOOK}/zm_detect.py" \
         "${TARGET_BIN_HOOK}/zm_train_faces.py"
@@ -89,6 +89,17 @@ ZmEventNotification::Util->import(':all');
         'https://zm.example.com/zm/index.php?view=image&eid=EVENTID&fid=objdetect&width=600';
     my $url_fail = buildPictureUrl(999, 'motion', 1, 'test', 'alarm');
     like($url_fail, qr/fid=snapshot/, 'buildPictureUrl: objdetect -> snapshot on hook fail');
+
+    # EVENTPATH -> event directory below the storage root (push thumbnails)
+    no warnings qw(redefine once);
+    local *ZmEventNotification::Util::getRelativeEventPath = sub { '3/2024-01-31/' . $_[0] };
+    local $ZmEventNotification::Config::notify_config{picture_url} =
+        'https://zm.example.com/events/EVENTPATH/objdetect_thumb.jpg';
+    my $url_thumb = buildPictureUrl(4321, 'detected:person', 0, 'test', 'alarm');
+    is($url_thumb, 'https://zm.example.com/events/3/2024-01-31/4321/objdetect_thumb.jpg?username=user1&password=p%40ss',
+        'buildPictureUrl: EVENTPATH replaced, credentials start the query string');
+    my $url_thumb_fail = buildPictureUrl(4321, 'motion', 1, 'test', 'alarm');
+    like($url_thumb_fail, qr{/4321/snapshot\.jpg\?}, 'buildPictureUrl: objdetect_thumb.jpg -> snapshot.jpg on hook fail');
 }
 
 # ===== getFrameId =====
@@ -79,4 +79,19 @@ is(isAllowedChannel('event_end', 'fcm',  1), '', 'event_end fail: fcm not allowe
 # Invalid event type
 is(isAllowedChannel('bogus', 'fcm', 0), 0, 'invalid event_type returns 0');
 
+# ===== _run_hook: jsonl output streamed line by line =====
+{
+    local $hooks_config{hook_output_format} = 'jsonl';
+    my @seen;
+    my $out = ZmEventNotification::HookProcessor::_run_hook(
+        q{printf '%s\n' "$ZMES_HOOK_OUTPUT_FORMAT" second; exit 3},
+        sub { push @seen, shift });
+    is($? >> 8, 3, '_run_hook: exit code in $?');
+    is($out, "jsonl\nsecond\n", '_run_hook: returns full output');
+    is_deeply(\@seen, ["jsonl\n", "second\n"], '_run_hook: each line handed to callback');
+
+    $out = ZmEventNotification::HookProcessor::_run_hook(q{echo plain});
+    is($out, "plain\n", '_run_hook: without callback');
+}
+
 done_testing();
@@ -11,7 +11,7 @@ use JSON;
 require StubZM;
 
 use ZmEventNotification::Config qw(:all);
-use ZmEventNotification::Util qw(parseDetectResults);
+use ZmEventNotification::Util qw(parseDetectResults parseHookOutput parseHookRecord);
 
 # ===== Contract: --SPLIT-- format between Python producer and Perl consumer =====
 
@@ -62,4 +62,54 @@ my $special_output = '[a] detected:person (wearing hat)--SPLIT--{"labels":["pers
     is($json->{labels}[0], 'person (wearing hat)', 'special chars: label preserved in JSON');
 }
 
+# ===== Contract: --output-format jsonl record (hook_output_format: jsonl) =====
+
+my $record = '{"zmes_hook": 1, "type": "result", "detected": true, "text": "[a] detected:person:97%", '
+  . '"labels": ["person"], "boxes": [[1, 2, 3, 4]], "confidences": [0.97], "frame_id": "alarm", '
+  . '"image_dimensions": null, "model_names": ["yolo"], "timings_ms": {"detect": 812.5, "total": 1020.1}, '
+  . '"artifacts": {"objdetect_jpg": "/var/cache/zoneminder/events/1/7/objdetect.jpg"}, "event_id": "7", "monitor_id": "1"}';
+
+{
+    my ($txt, $json_str, $rec) = parseHookOutput("log noise\n$record", 'jsonl');
+    is($txt, '[a] detected:person:97%', 'jsonl: text from record');
+    my $json = decode_json($json_str);
+    is_deeply($json->{labels}, ['person'], 'jsonl: labels in detection JSON');
+    is($json->{frame_id}, 'alarm', 'jsonl: frame_id in detection JSON');
+    ok(!exists $json->{timings_ms}, 'jsonl: detection JSON keeps the text-format keys');
+    is($rec->{timings_ms}{detect}, 812.5, 'jsonl: full record returned');
+    like($rec->{artifacts}{objdetect_jpg}, qr/objdetect\.jpg$/, 'jsonl: artifact paths');
+}
+
+{
+    my ($txt, $json_str, $rec) = parseHookOutput('{"zmes_hook": 1, "type": "result", "detected": false, "text": "", "gate": "no_enabled_models"}', 'jsonl');
+    is($txt, '', 'jsonl no detection: empty text');
+    is($json_str, '[]', 'jsonl no detection: empty JSON array');
+    is($rec->{gate}, 'no_enabled_models', 'jsonl no detection: gate in record');
+}
+
+{
+    my ($txt, $json_str, $rec) = parseHookOutput($good_output, 'jsonl');
+    is($txt, '[a] detected:person,car', 'jsonl: falls back to the text format');
+    ok(!defined $rec, 'jsonl fallback: no record');
+    ($txt) = parseHookOutput('motion notes', 'jsonl');
+    is($txt, 'motion notes', 'jsonl fallback: end hook text passed through');
+    ($txt, $json_str) = parseHookOutput($good_output);
+    is($txt, '[a] detected:person,car', 'text format is the default');
+}
+
+# ===== Contract: progressive_results provisional record =====
+{
+    my $provisional = '{"zmes_hook": 1, "type": "provisional", "detected": true, "text": "[s] detected:person:91%", '
+      . '"labels": ["person"], "boxes": [[1, 2, 3, 4]], "confidences": [0.91], "frame_id": "snapshot", "image_dimensions": null}';
+    my ($txt, $json_str, $rec) = parseHookRecord($provisional);
+    is($rec->{type}, 'provisional', 'provisional: record type');
+    is($txt, '[s] detected:person:91%', 'provisional: text');
+    is(decode_json($json_str)->{frame_id}, 'snapshot', 'provisional: detection JSON');
+    is(scalar(my @none = parseHookRecord('not json')), 0, 'parseHookRecord: non-record line');
+
+    ($txt, $json_str, $rec) = parseHookOutput("$provisional\n$record", 'jsonl');
+    is($rec->{type}, 'result', 'provisional + final: final record wins');
+    is($txt, '[a] detected:person:97%', 'provisional + final: final text');
+}
+
 done_testing();
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""Compare how long zm_detect takes to get an event's frames from each frame_source.
+
+For 1, 5 and 20 frames starting at the event's alarm frame, times getting
+them over HTTP (ZM's image API, what pyzm does with the default
+``frame_source: http``), from the event's JPEGs (``local``) and by decoding
+the event's mp4 (``video``), and prints the median of a few runs. Run it on
+the ZM host, as the user zm_detect runs as, against a finished event.
+
+Usage:
+    python3 tools/bench_frame_sources.py --config /etc/zm/objectconfig.yml --eventid 1234 \
+        [--counts 1,5,20] [--sources http,local,video] [--stride 5] [--repeat 3] [--eventpath PATH]
+"""
+
+import argparse
+import statistics
+import sys
+import time
+
+
+def connect(config_file):
+    """ZMClient for the ZM in *config_file* (an objectconfig.yml)."""
+    from pyzm.log import setup_zm_logging
+    import zmes_hook_helpers.common_params as g
+    import zmes_hook_helpers.utils as utils
+    import zmes_hook_helpers.auth_cache as auth_cache
+    args = {'config': config_file}
+    cache_entry = utils.get_pyzm_config(args)
+    g.config['pyzm_overrides'].update(dump_console=False, log_debug=False)
+    g.logger = setup_zm_logging(name='bench_frame_sources', override=g.config['pyzm_overrides'])
+    utils.process_config(args, None, cache_entry=cache_entry)
+    return auth_cache.connect(g.config, g.logger)
+
+
+def frame_numbers(event, count, stride):
+    """*count* frame numbers every *stride* frames from the alarm frame."""
+    from zmes_hook_helpers import frame_sources
+    first = frame_sources.frame_number('alarm', event) or frame_sources.frame_number('snapshot', event) or 1
+    return [str(first + i * stride) for i in range(count)]
+
+
+def timed(fetch, repeat):
+    """(median seconds, frames got) of *repeat* calls of *fetch*."""
+    times, got = [], 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        got = fetch()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times), got
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    ap.add_argument('--config', default='/etc/zm/objectconfig.yml', help='objectconfig.yml with the ZM login')
+    ap.add_argument('--eventid', required=True, type=int)
+    ap.add_argument('--eventpath', help='event directory (default: the event\'s storage path from ZM)')
+    ap.add_argument('--counts', default='1,5,20', help='numbers of frames to get (default: %(default)s)')
+    ap.add_argument('--sources', default='http,local,video', help='frame sources to time (default: %(default)s)')
+    ap.add_argument('--stride', type=int, default=5, help='frames between sampled frames (default: %(default)s)')
+    ap.add_argument('--repeat', type=int, default=3, help='runs per measurement (default: %(default)s)')
+    args = ap.parse_args(argv)
+
+    from pyzm.models.config import StreamConfig
+    from zmes_hook_helpers import frame_sources
+
+    zm = connect(args.config)
+    event = zm.event(args.eventid)
+    eventpath = args.eventpath or event.path()
+    print('Event {}: {} frames, {}, path {}'.format(
+        args.eventid, event.frames, frame_sources.video_file(eventpath, args.eventid) or 'no mp4', eventpath))
+
+    def http(ids):
+        frames, _ = event.extract_frames(stream_config=StreamConfig(frame_set=ids, max_attempts=1))
+        return len(frames)
+
+    def reader(source):
+        read = {'local': frame_sources.read_event_dir, 'video': frame_sources.read_event_video}[source]
+        return lambda ids: len(read(event, eventpath, ids))
+
+    fetchers = {'http': http, 'local': reader('local'), 'video': reader('video')}
+    sources = [s.strip() for s in args.sources.split(',') if s.strip() in fetchers]
+    print('{:<8}{:>8}{:>6}{:>12}{:>12}{:>10}'.format('source', 'frames', 'got', 'total ms', 'ms/frame', 'vs http'))
+    for count in [int(c) for c in args.counts.split(',')]:
+        ids = frame_numbers(event, count, args.stride)
+        baseline = None
+        for source in sources:
+            secs, got = timed(lambda: fetchers[source](ids), args.repeat)
+            if source == 'http':
+                baseline = secs
+            ratio = '{:.1f}x'.format(baseline / secs) if baseline and secs and source != 'http' else ''
+            print('{:<8}{:>8}{:>6}{:>12.1f}{:>12.1f}{:>10}'.format(
+                source, count, got, secs * 1000, secs * 1000 / max(got, 1), ratio))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())